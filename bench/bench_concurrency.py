@@ -0,0 +1,92 @@
+# bench/bench_concurrency.py — пропускная способность при параллельной обработке разных чатов.
+#
+# Все обновления кладутся в очередь разом; поддельный Bot API отвечает с
+# задержкой сети. Сравнивается последовательная обработка и
+# PerChatUpdateProcessor, и проверяется, что в каждом чате ответы пришли в
+# порядке нажатий.
+#
+#   python bench/bench_concurrency.py [--workers 16] [--latency 0.02] [--chats 1 4 16 64]
+
+from __future__ import annotations
+import argparse
+import asyncio
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import aiohttp
+from telegram import Update
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import fake_bot_api
+import main
+from bench_transport import synth_updates, chat_of
+from workload import make_tasks
+
+MARKERS = {"menu:today": "План на сегодня", "menu:week": "Недельный обзор", "menu:list": "Список задач"}
+
+async def load(chats: int, workers: int, latency: float, tasks_per_chat: int) -> tuple[float, bool]:
+    proc, port = fake_bot_api.spawn(latency=latency, enforce_limits=False)
+    session = aiohttp.ClientSession()
+
+    async def texts() -> dict:
+        async with session.get(f"http://127.0.0.1:{port}/_texts") as resp:
+            return {int(k): v for k, v in (await resp.json()).items()}
+    main.CONCURRENT_UPDATES = workers
+    updates = synth_updates(chats, 3)
+    with tempfile.TemporaryDirectory() as tmp:
+        unlimited = main.ChatRateLimiter(overall=1e6, per_chat=1e6, chat_burst=1e6, per_group=1e6)
+        app = main.build_app(main.SQLitePersistence(Path(tmp) / "state.db"), token="1:fake",
+                             base_url=f"http://127.0.0.1:{port}/bot", rate_limiter=unlimited)
+        await app.initialize()
+        now = datetime.now()
+        for cid in {chat_of(u) for u in updates}:
+            repo = main.repo_for(app.chat_data[cid], cid)
+            for t in make_tasks(tasks_per_chat, now, seed=cid):
+                repo.save(t)
+        await app.start()
+
+        async def replied() -> int:
+            return sum(1 for chat in (await texts()).values() for text in chat
+                       if any(m in text for m in MARKERS.values()))
+
+        t0 = time.monotonic()
+        for u in updates:
+            await app.update_queue.put(Update.de_json(u, app.bot))
+        # ждём ответ на каждое нажатие, затем — пока не допишутся строки списков
+        while await replied() < len(updates) or app.update_processor.current_concurrent_updates:
+            await asyncio.sleep(0.01)
+        wall = time.monotonic() - t0
+
+        await app.stop()
+        await app.post_stop(app)
+        await app.shutdown()
+
+    received = await texts()
+    await session.close()
+    proc.terminate()
+    ordered = True
+    for cid in {chat_of(u) for u in updates}:
+        pressed = [MARKERS[u["callback_query"]["data"]] for u in updates if chat_of(u) == cid]
+        got = [m for text in received.get(cid, []) for m in MARKERS.values() if m in text]
+        ordered &= got == pressed
+    return len(updates) / wall, ordered
+
+async def run(args) -> None:
+    print(f"задержка API {args.latency * 1000:.0f} мс, {args.tasks} задач на чат, 3 нажатия на чат")
+    print(f"{'чатов':>6} {'послед., обн/с':>15} {'параллельно, обн/с':>19} {'порядок':>8}")
+    for chats in args.chats:
+        seq, _ = await load(chats, 1, args.latency, args.tasks)
+        par, ordered = await load(chats, args.workers, args.latency, args.tasks)
+        print(f"{chats:>6} {seq:>15.1f} {par:>19.1f} {'да' if ordered else 'НЕТ':>8}")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=16)
+    ap.add_argument("--latency", type=float, default=0.02)
+    ap.add_argument("--tasks", type=int, default=5)
+    ap.add_argument("--chats", type=int, nargs="+", default=[1, 4, 16, 64])
+    asyncio.run(run(ap.parse_args()))
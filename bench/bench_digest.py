@@ -0,0 +1,63 @@
+# bench/bench_digest.py — утренняя волна: план на сегодня для всех чатов разом.
+#
+# Сравнивается поштучный plan_today_for по каждому чату с plan_today_batch
+# (NumPy) на одинаковых данных; заодно проверяется, что планы и назначенные
+# даты совпадают.
+#
+#   python bench/bench_digest.py [--chats 100 1000 5000] [--tasks 30]
+
+from __future__ import annotations
+import argparse
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from workload import make_tasks
+import main
+from main import chat_store, repo_for, ser_task
+
+def repos(chats: int, tasks_per_chat: int, now: datetime):
+    main.DEADLINES = main.DeadlineScheduler()
+    out = []
+    for cid in range(1, chats + 1):
+        chat_data = {}
+        chat_store(chat_data, cid)["tasks"] = {t.id: ser_task(t) for t in make_tasks(tasks_per_chat, now, seed=cid)}
+        out.append(repo_for(chat_data, cid))
+    return out
+
+def snapshot(plans, rs):
+    return ({cid: [(i.start, i.end, i.label, i.task_id) for i in plan] for cid, plan in plans.items()},
+            {r.chat_id: sorted((t.id, t.planned_for) for t in r.active()) for r in rs})
+
+def run(chats: int, tasks_per_chat: int) -> None:
+    now = datetime.now().replace(hour=7, minute=30, second=0, microsecond=0)
+
+    main.PLAN_CACHE = main.PlanCache()
+    rs = repos(chats, tasks_per_chat, now)
+    t0 = time.perf_counter()
+    seq = {r.chat_id: main.plan_today_for(r, now) for r in rs}
+    seq_s = time.perf_counter() - t0
+    seq_snap = snapshot(seq, rs)
+
+    main.PLAN_CACHE = main.PlanCache()
+    rs = repos(chats, tasks_per_chat, now)
+    t0 = time.perf_counter()
+    batch = main.plan_today_batch(rs, now)
+    batch_s = time.perf_counter() - t0
+
+    same = "да" if snapshot(batch, rs) == seq_snap else "НЕТ"
+    print(f"{chats:>6} {seq_s * 1000:>14.1f} {batch_s * 1000:>14.1f} {seq_s / batch_s:>8.1f}x  {same}")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chats", type=int, nargs="+", default=[100, 1000, 5000])
+    ap.add_argument("--tasks", type=int, default=30)
+    args = ap.parse_args()
+    main._numpy()  # numpy импортируется при первой волне — не в замере
+    print(f"{args.tasks} задач на чат")
+    print(f"{'чатов':>6} {'поштучно, мс':>14} {'пакетом, мс':>14} {'выигрыш':>9}  совпадает")
+    for n in args.chats:
+        run(n, args.tasks)
@@ -0,0 +1,101 @@
+# bench/bench_digest_spread.py — кривая рассылки утреннего плана по минутам.
+#
+# --chats чатов раскладываются по поясам из ZONES (часть — без своей
+# настройки) и по DigestScheduler прогоняются сутки серверного времени
+# поминутно. Сравнивается с прежней схемой, где все чаты получали план одной
+# волной в DIGEST_TIME по времени сервера: пик отправок в минуту и время
+# планирования самой большой корзины против всей волны разом.
+#
+#   python bench/bench_digest_spread.py [--chats 1000 10000] [--tasks 30] [--jitter 20]
+
+from __future__ import annotations
+import argparse
+import random
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from workload import make_tasks
+import main
+from main import chat_store, repo_for, ser_task
+
+# пояса подписчиков: половина — в поясе по умолчанию
+ZONES = ("", "", "", "", "Europe/Moscow", "Europe/Berlin", "Asia/Almaty", "Asia/Yekaterinburg", "+3", "-5")
+
+def subscribe(chats: int) -> dict:
+    rnd = random.Random(chats)
+    bot_data = {"digest_chats": set(range(1, chats + 1)), "digest_at": {}}
+    for cid in bot_data["digest_chats"]:
+        name = rnd.choice(ZONES)
+        if name:
+            # у части чатов и время своё
+            minute = rnd.choice((7 * 60, 7 * 60 + 30, 8 * 60))
+            bot_data["digest_at"][cid] = (name, minute)
+    return bot_data
+
+def curve(bot_data: dict, day: datetime) -> Counter:
+    """Сколько чатов попадает в каждую серверную минуту суток day."""
+    main.DIGESTS = sched = main.DigestScheduler()
+    for cid in bot_data["digest_chats"]:
+        sched.schedule(bot_data, cid, day)
+    sends = Counter()
+    t = day
+    while t < day + timedelta(days=1):
+        t += timedelta(minutes=1)
+        for when, chat_ids in sched.due(t).items():
+            sends[when.replace(second=0, microsecond=0)] += len(chat_ids)
+            for cid in chat_ids:
+                sched.schedule(bot_data, cid, t)
+    return sends
+
+def plan_time(chat_ids, tasks_per_chat: int) -> float:
+    main.DEADLINES = main.DeadlineScheduler()
+    main.PLAN_CACHE = main.PlanCache()
+    main._REPOS.clear()
+    now = datetime.now().replace(hour=7, minute=30, second=0, microsecond=0)
+    rs = []
+    for cid in chat_ids:
+        chat_data = {}
+        chat_store(chat_data, cid)["tasks"] = {t.id: ser_task(t) for t in make_tasks(tasks_per_chat, now, seed=cid)}
+        rs.append(repo_for(chat_data, cid))
+    t0 = time.perf_counter()
+    main.plan_today_batch(rs, now)
+    return time.perf_counter() - t0
+
+def run(chats: int, tasks_per_chat: int) -> None:
+    bot_data = subscribe(chats)
+    day = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    sends = curve(bot_data, day)
+    peak_at, peak = max(sends.items(), key=lambda kv: kv[1])
+    print(f"=== {chats} чатов, сдвиг до {main.DIGEST_JITTER} мин")
+    print(f"одной волной: {chats} отправок за минуту в {main.DIGEST_TIME:%H:%M}")
+    print(f"корзинами:    {len(sends)} минут с отправками, пик {peak} в {peak_at:%H:%M} "
+          f"({peak / chats:.1%} от волны)")
+    width = 50
+    for minute in sorted(sends):
+        n = sends[minute]
+        print(f"  {minute:%H:%M} {n:>6} {'#' * max(1, n * width // peak)}")
+    if tasks_per_chat:
+        sched = main.DigestScheduler()
+        for cid in bot_data["digest_chats"]:
+            sched.schedule(bot_data, cid, day)
+        biggest = max(sched.due(day + timedelta(days=1)).values(), key=len)
+        wave_s = plan_time(sorted(bot_data["digest_chats"]), tasks_per_chat)
+        bucket_s = plan_time(biggest, tasks_per_chat)
+        print(f"планирование: волна {wave_s * 1000:.1f} мс, самая большая корзина ({len(biggest)} чатов) "
+              f"{bucket_s * 1000:.1f} мс")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chats", type=int, nargs="+", default=[1000, 10000])
+    ap.add_argument("--tasks", type=int, default=30, help="0 — не замерять планирование")
+    ap.add_argument("--jitter", type=int, default=main.DIGEST_JITTER)
+    args = ap.parse_args()
+    main.DIGEST_JITTER = args.jitter
+    main._numpy()  # numpy импортируется при первой волне — не в замере
+    for n in args.chats:
+        run(n, args.tasks)
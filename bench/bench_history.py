@@ -0,0 +1,71 @@
+# bench/bench_history.py — «История» при растущем числе выполненных задач.
+#
+# Сравнивается прежний экран (разбор всего списка, показ последних 50) с
+# HistoryLog: добавление записи, первая и последняя страницы, счётчики и
+# размер store, который пишет персистентность на каждое обновление.
+#
+#   python bench/bench_history.py [--sizes 1000 10000 100000]
+
+from __future__ import annotations
+import argparse
+import os
+import pickle
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main
+from main import DoneEntry, HistoryLog, chat_store, deser_done, fmt_history, ser_done
+
+def timeit(fn, repeat: int = 20) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+def entries(n: int):
+    base = datetime.now() - timedelta(minutes=n)
+    return [DoneEntry(task_id=f"t{i}", title=f"задача {i}", completed_at=base + timedelta(minutes=i))
+            for i in range(n)]
+
+def run(n: int) -> None:
+    done = entries(n)
+
+    legacy = {"history": [ser_done(e) for e in done]}
+    old_ms = timeit(lambda: fmt_history([deser_done(d) for d in legacy["history"]][-50:][::-1]))
+    old_kb = len(pickle.dumps(legacy, protocol=pickle.HIGHEST_PROTOCOL)) / 1024
+
+    store = chat_store({}, 1)
+    t0 = time.perf_counter()
+    log = HistoryLog(store, 1)
+    for e in done:
+        log.append(e)
+    append_us = (time.perf_counter() - t0) / n * 1e6
+
+    main._load_segment.cache_clear()
+    first_ms = timeit(lambda: fmt_history(HistoryLog(store, 1).page(0)))
+    last_ms = timeit(lambda: (main._load_segment.cache_clear(), fmt_history(HistoryLog(store, 1).page(log.pages - 1))))
+    stats_ms = timeit(lambda: log.done_since(date.today() - timedelta(days=6)))
+    new_kb = len(pickle.dumps(store, protocol=pickle.HIGHEST_PROTOCOL)) / 1024
+    disk_kb = sum(f.stat().st_size for f in (main.HISTORY_DIR / "1").glob("*")) / 1024 if log.archived else 0
+
+    print(f"{n:>7}  {old_ms:8.2f} {old_kb:8.0f} | {append_us:8.1f} {first_ms:8.2f} {last_ms:8.2f} "
+          f"{stats_ms:8.3f} {new_kb:8.0f} {disk_kb:7.0f}")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    args = ap.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        print("          прежний экран    | HistoryLog")
+        print("записей  экран,мс store,КБ | доб.,мкс стр.1,мс посл.,мс счёт.,мс store,КБ  диск,КБ")
+        for n in args.sizes:
+            main.HISTORY_DIR = Path(tmp) / f"h{n}"
+            run(n)
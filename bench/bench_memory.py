@@ -0,0 +1,66 @@
+# bench/bench_memory.py — память chat_data: прежние словари с ISO-строками против кортежей.
+#
+#   python bench/bench_memory.py [задач на чат] [записей истории на чат] [чатов]
+
+from __future__ import annotations
+import pickle
+import sys
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from workload import make_tasks
+from main import DoneEntry, ser_task, ser_done
+
+def legacy_task(t) -> dict:
+    """Формат до перехода на кортежи (словарь ISO-строк)."""
+    return {
+        "id": t.id, "title": t.title, "duration_min": t.duration_min,
+        "deadline_at": t.deadline_at.isoformat(), "effort": t.effort,
+        "fixed_start": t.fixed_start.isoformat() if t.fixed_start else None,
+        "fixed_end": t.fixed_end.isoformat() if t.fixed_end else None,
+        "splittable": t.splittable, "done": t.done, "auto": t.auto, "constant": t.constant,
+        "dow": t.dow or [],
+        "constant_start_hm": list(t.constant_start_hm) if t.constant_start_hm else None,
+        "constant_end_hm": list(t.constant_end_hm) if t.constant_end_hm else None,
+        "planned_for": t.planned_for, "overdue": t.overdue,
+    }
+
+def build(kind: str, tasks, now: datetime, n_hist: int, n_chats: int) -> dict:
+    chats = {}
+    for c in range(n_chats):
+        if kind == "legacy":
+            chats[c] = {
+                "tasks": {t.id: legacy_task(t) for t in tasks},
+                "history": [{"task": legacy_task(tasks[i % len(tasks)]), "completed_at": now.isoformat()}
+                            for i in range(n_hist)],
+            }
+        else:
+            chats[c] = {
+                "tasks": {t.id: ser_task(t) for t in tasks},
+                "history": [ser_done(DoneEntry(tasks[i % len(tasks)].id, tasks[i % len(tasks)].title, now))
+                            for i in range(n_hist)],
+            }
+    return chats
+
+def measure(kind: str, tasks, now, n_hist, n_chats):
+    tracemalloc.start()
+    data = build(kind, tasks, now, n_hist, n_chats)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, len(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+
+def main(n_tasks: int, n_hist: int, n_chats: int) -> None:
+    now = datetime.now().replace(second=0, microsecond=0)
+    tasks = make_tasks(n_tasks, now)
+    print(f"{n_chats} чатов × {n_tasks} задач × {n_hist} записей истории")
+    print(f"{'формат':>8} {'RAM, КБ':>10} {'pickle, КБ':>11}")
+    for kind in ("legacy", "compact"):
+        ram, pkl = measure(kind, tasks, now, n_hist, n_chats)
+        print(f"{kind:>8} {ram / 1024:>10.0f} {pkl / 1024:>11.0f}")
+
+if __name__ == "__main__":
+    args = [int(x) for x in sys.argv[1:]] + [200, 1000, 50][len(sys.argv[1:]):]
+    main(*args[:3])
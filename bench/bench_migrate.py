@@ -0,0 +1,82 @@
+# bench/bench_migrate.py — формат store чата: вложенный (v0) против плоского (STORE_VERSION).
+#
+# Строится состояние PicklePersistence на --chats чатов в исходном формате:
+# store вложен в chat_data[chat_id], задачи и история — словари с
+# ISO-строками. Меряются размер файла, загрузка (pickle.load) и запись
+# (pickle.dump, как flush) для трёх вариантов: исходного, упакованного, но всё
+# ещё вложенного, и плоского после migrate_store; отдельно — время самой
+# миграции при загрузке.
+#
+#   python bench/bench_migrate.py [--chats 1000 10000] [--tasks 30] [--history 100]
+
+from __future__ import annotations
+import argparse
+import copy
+import io
+import pickle
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from workload import make_tasks
+import main
+
+def legacy_task(t) -> dict:
+    iso = lambda dt: dt.isoformat() if dt else None
+    return {"id": t.id, "title": t.title, "duration_min": t.duration_min, "deadline_at": iso(t.deadline_at),
+            "effort": t.effort, "fixed_start": iso(t.fixed_start), "fixed_end": iso(t.fixed_end),
+            "splittable": t.splittable, "done": t.done, "auto": t.auto, "constant": t.constant,
+            "dow": list(t.dow or []), "constant_start_hm": t.constant_start_hm,
+            "constant_end_hm": t.constant_end_hm, "planned_for": t.planned_for, "overdue": t.overdue}
+
+def legacy_state(chats: int, tasks_per_chat: int, history: int) -> dict:
+    now = datetime.now().replace(second=0, microsecond=0)
+    chat_data = {}
+    for cid in range(1, chats + 1):
+        tasks = make_tasks(tasks_per_chat, now, seed=cid)
+        chat_data[cid] = {cid: {
+            "tasks": {t.id: legacy_task(t) for t in tasks},
+            "history": [{"task": {"id": f"h{i:07d}", "title": f"done {i}"},
+                         "completed_at": (now - timedelta(hours=i)).isoformat()} for i in range(history)],
+            "overdue": {},
+        }}
+    return {"chat_data": chat_data, "user_data": {}, "bot_data": {}, "conversations": {}, "callback_data": None}
+
+def measure(state: dict) -> tuple:
+    t0 = time.perf_counter()
+    blob = pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+    dump_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    pickle.load(io.BytesIO(blob))
+    load_s = time.perf_counter() - t0
+    return len(blob), load_s, dump_s
+
+def run(chats: int, tasks_per_chat: int, history: int) -> None:
+    legacy = legacy_state(chats, tasks_per_chat, history)
+    packed = copy.deepcopy(legacy)
+    for cid, cd in packed["chat_data"].items():
+        main._pack_store(cd[cid], cid)
+    flat = copy.deepcopy(legacy)
+    t0 = time.perf_counter()
+    for cid, cd in flat["chat_data"].items():
+        main.migrate_store(cd, cid)
+    migrate_s = time.perf_counter() - t0
+
+    print(f"=== {chats} чатов, {tasks_per_chat} задач и {history} записей истории на чат; "
+          f"миграция при загрузке {migrate_s * 1000:.0f} мс")
+    for name, state in (("исходный (v0)", legacy), ("кортежи, вложенный", packed), (f"плоский (v{main.STORE_VERSION})", flat)):
+        size, load_s, dump_s = measure(state)
+        print(f"  {name:<20} {size / 2 ** 20:>8.2f} МБ {load_s * 1000:>10.1f} {dump_s * 1000:>10.1f}")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chats", type=int, nargs="+", default=[1000, 10000])
+    ap.add_argument("--tasks", type=int, default=30)
+    ap.add_argument("--history", type=int, default=100)
+    args = ap.parse_args()
+    print(f"  {'формат':<20} {'размер':>11} {'загрузка, мс':>10} {'запись, мс':>10}")
+    for n in args.chats:
+        run(n, args.tasks, args.history)
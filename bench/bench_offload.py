@@ -0,0 +1,59 @@
+# bench/bench_offload.py — насколько тяжёлое планирование блокирует event loop.
+#
+# Один «тяжёлый» чат запрашивает недельный план (кэш сбрасывается перед
+# каждым запросом), а в паузах loop обслуживает остальных.
+# LoopLag меряет задержку пробуждения loop; сравниваются расчёт inline и
+# через пул процессов.
+#
+#   python bench/bench_offload.py [--tasks 3000 10000] [--requests 10]
+
+from __future__ import annotations
+import argparse
+import asyncio
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from workload import make_tasks
+import main
+from main import chat_store, repo_for, ser_task
+
+async def run(n_tasks: int, requests: int, offload: bool) -> None:
+    main.PLAN_OFFLOAD_MIN_TASKS = 1000 if offload else 10 ** 9
+    now = datetime.now().replace(second=0, microsecond=0)
+    chat_data = {}
+    chat_store(chat_data, 1)["tasks"] = {t.id: ser_task(t) for t in make_tasks(n_tasks, now)}
+    repo = repo_for(chat_data, 1)
+    if offload:  # процессы пула поднимаются один раз за жизнь бота — не в замере
+        await asyncio.gather(*(main.PLAN_POOL.run(main._plan_week_remote, (), now, now)
+                               for _ in range(main.PLAN_POOL.workers)))
+
+    lag = main.LoopLag(interval=0.005)
+    lag.start()
+    spent = 0.0
+    for _ in range(requests):
+        repo.version += 1
+        t0 = time.perf_counter()
+        await main.plan_week_async(repo, now)
+        spent += time.perf_counter() - t0
+        await asyncio.sleep(0.05)  # между запросами loop обслуживает остальных
+    await lag.stop()
+    st = lag.stats()
+    mode = "пул" if offload else "inline"
+    print(f"{n_tasks:>7} {mode:>7} {spent / requests * 1000:>12.1f} {st['p99'] * 1000:>10.0f} {st['max'] * 1000:>10.1f}")
+
+async def amain(args) -> None:
+    print(f"{'задач':>7} {'режим':>7} {'план, мс':>12} {'p99 lag':>10} {'max lag':>10}")
+    for n in args.tasks:
+        for offload in (False, True):
+            await run(n, args.requests, offload)
+    main.PLAN_POOL.shutdown()
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--tasks", type=int, nargs="+", default=[3000, 10000])
+    ap.add_argument("--requests", type=int, default=10)
+    asyncio.run(amain(ap.parse_args()))
@@ -0,0 +1,93 @@
+# bench/bench_outbound.py — пропускная способность и хвостовые задержки исходящих сообщений.
+#
+# Сравнивает «по сообщению на уведомление без темпа» с очередью Outbox +
+# ChatRateLimiter на поддельном Bot API, и удаление экрана по одному против
+# deleteMessages.
+#
+#   python bench/bench_outbound.py [чатов] [уведомлений на чат]
+
+from __future__ import annotations
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from telegram.error import RetryAfter
+from telegram.ext import ExtBot
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import fake_bot_api
+from main import ChatRateLimiter, Outbox
+
+def pct(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+async def naive(bot, chats: int, per_chat: int):
+    lat, lost = [], 0
+    for c in range(chats):
+        for i in range(per_chat):
+            t0 = time.monotonic()
+            try:
+                await bot.send_message(c + 1, f"уведомление {i}")
+            except RetryAfter:
+                lost += 1
+            lat.append(time.monotonic() - t0)
+    return lat, lost
+
+async def pipelined(bot, chats: int, per_chat: int, api):
+    outbox = Outbox(delay=0.05)
+    start = time.monotonic()
+    for c in range(chats):
+        for i in range(per_chat):
+            outbox.notify(bot, c + 1, f"уведомление {i}")
+    await asyncio.sleep(outbox.delay)
+    while outbox._timers or outbox.pending:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.05)
+    return [t - start for t, m, _ in api.received if m == "sendMessage"], 0
+
+async def run(chats: int, per_chat: int) -> None:
+    print(f"{chats} чатов × {per_chat} уведомлений")
+    print(f"{'режим':>12} {'вызовов':>8} {'429':>5} {'потеряно':>9} {'сообщ/с':>8} {'p50, мс':>8} {'p99, мс':>8}")
+    for mode in ("naive", "pipeline"):
+        api = fake_bot_api.FakeBotApi()
+        runner, port = await fake_bot_api.start(api)
+        limiter = ChatRateLimiter() if mode == "pipeline" else None
+        bot = ExtBot("1:fake", base_url=f"http://127.0.0.1:{port}/bot", rate_limiter=limiter)
+        await bot.initialize()
+        api.received.clear()
+        api.calls.clear()
+        t0 = time.monotonic()
+        if mode == "naive":
+            lat, lost = await naive(bot, chats, per_chat)
+        else:
+            lat, lost = await pipelined(bot, chats, per_chat, api)
+        wall = time.monotonic() - t0
+        sent = api.calls["sendMessage"] - api.flood
+        print(f"{mode:>12} {api.calls['sendMessage']:>8} {api.flood:>5} {lost:>9} {sent / wall:>8.1f} "
+              f"{statistics.median(lat) * 1000:>8.1f} {pct(lat, 0.99) * 1000:>8.1f}")
+        await bot.shutdown()
+        await runner.cleanup()
+
+    api = fake_bot_api.FakeBotApi(enforce_limits=False)
+    runner, port = await fake_bot_api.start(api)
+    bot = ExtBot("1:fake", base_url=f"http://127.0.0.1:{port}/bot")
+    await bot.initialize()
+    ids = list(range(1, 51))
+    t0 = time.monotonic()
+    for mid in ids:
+        await bot.delete_message(1, mid)
+    single = time.monotonic() - t0
+    t0 = time.monotonic()
+    await bot.delete_messages(1, ids)
+    bulk = time.monotonic() - t0
+    print(f"удаление 50 сообщений: по одному {single * 1000:.1f} мс, deleteMessages {bulk * 1000:.1f} мс")
+    await bot.shutdown()
+    await runner.cleanup()
+
+if __name__ == "__main__":
+    args = [int(x) for x in sys.argv[1:]] + [20, 5][len(sys.argv[1:]):]
+    asyncio.run(run(*args[:2]))
@@ -0,0 +1,35 @@
+# bench/bench_planner.py — как растёт задержка планирования с числом задач в чате.
+#
+#   python bench/bench_planner.py [10 100 1000 10000]
+
+from __future__ import annotations
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from workload import make_tasks
+from main import plan_today_assign_once, plan_week_without_dup
+
+def best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def main(sizes) -> None:
+    now = datetime.now().replace(hour=9, minute=0, second=0, microsecond=0)
+    print(f"{'задач':>8} {'сегодня, мс':>12} {'неделя, мс':>12}")
+    for n in sizes:
+        tasks = make_tasks(n, now)
+        repeat = 5 if n <= 1000 else 1
+        today = best_of(lambda: plan_today_assign_once(now, now, tasks, persist=False), repeat)
+        week = best_of(lambda: plan_week_without_dup(now, now, tasks), repeat)
+        print(f"{n:>8} {today * 1000:>12.2f} {week * 1000:>12.2f}")
+
+if __name__ == "__main__":
+    main([int(x) for x in sys.argv[1:]] or [10, 100, 1000, 10000])
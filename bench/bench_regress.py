@@ -0,0 +1,151 @@
+# bench/bench_regress.py — регрессионный прогон планировщика против сохранённого baseline.
+#
+# Для каждой функции планирования и каждого размера из --sizes меряются
+# медиана и минимум времени (раундов столько, чтобы набрать ~--budget
+# секунд) и пик памяти (tracemalloc, отдельным прогоном). Данные —
+# детерминированный набор make_mix на фиксированную дату.
+#
+#   python bench/bench_regress.py                 # сравнить с bench/baseline.json
+#   python bench/bench_regress.py --save          # записать новый baseline
+#   python bench/bench_regress.py --threshold 0.3 --sizes 10 100 1000
+#
+# Сравнивается минимум времени, поделённый на скорость машины в этом
+# прогоне: перед каждым замером гоняется эталонный цикл, и его лучший
+# результат за прогон служит единицей. Так сокращаются и частота процессора,
+# и долгие периоды, когда машину нагружают соседи. Случай, вышедший за
+# порог, перемеряется до --retries раз; baseline пишется как лучший из
+# 1 + --retries замеров. Код выхода 1, если хоть где-то стало хуже больше
+# чем на threshold (по умолчанию 25%). При смене версии Python baseline
+# стоит перезаписать.
+
+from __future__ import annotations
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from workload import MIXES, make_mix
+from main import build_fixed_blocks, eligible_flex_for_day, plan_today_assign_once, plan_week_without_dup
+
+BASELINE = Path(__file__).resolve().parent / "baseline.json"
+NOW = datetime(2025, 1, 6, 9, 0)  # понедельник: воспроизводимые планы
+
+CASES = {
+    "build_fixed_blocks": lambda tasks: build_fixed_blocks(NOW, NOW, tasks),
+    "eligible_flex_for_day": lambda tasks: eligible_flex_for_day(NOW, NOW, tasks),
+    "plan_today": lambda tasks: plan_today_assign_once(NOW, NOW, tasks, persist=False),
+    "plan_week": lambda tasks: plan_week_without_dup(NOW, NOW, tasks),
+}
+
+class Run:
+    """Замеры одного прогона и лучший результат эталонного цикла за прогон."""
+
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.calibration_ms = float("inf")
+        self.results = {}
+
+    def calibrate(self) -> None:
+        def work():
+            d = {}
+            for i in range(20000):
+                d[i % 977] = d.get(i % 977, 0) + i
+            return sorted(((v, k) for k, v in d.items()), reverse=True)
+        for _ in range(10):
+            t0 = time.perf_counter()
+            work()
+            self.calibration_ms = min(self.calibration_ms, (time.perf_counter() - t0) * 1000)
+
+    def measure(self, key: str, fn, tasks) -> None:
+        """Замерить случай; если он уже мерился, оставить лучший результат."""
+        self.calibrate()
+        fn(tasks)  # прогрев
+        times = []
+        spent = 0.0
+        while len(times) < 3 or (spent < self.budget and len(times) < 200):
+            t0 = time.perf_counter()
+            fn(tasks)
+            dt = time.perf_counter() - t0
+            times.append(dt)
+            spent += dt
+            if dt > self.budget:
+                break
+        tracemalloc.start()
+        fn(tasks)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        r = {"median_ms": statistics.median(times) * 1000, "min_ms": min(times) * 1000,
+             "rounds": len(times), "peak_kb": peak / 1024}
+        old = self.results.get(key)
+        if old is None or r["min_ms"] < old["min_ms"]:
+            self.results[key] = r
+
+    def units(self, key: str) -> float:
+        return self.results[key]["min_ms"] / self.calibration_ms
+
+def machine() -> str:
+    return f"{platform.python_implementation()} {platform.python_version()} / {platform.machine()} / {platform.processor() or '?'}"
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000, 100000])
+    ap.add_argument("--mix", choices=sorted(MIXES), default="default")
+    ap.add_argument("--budget", type=float, default=0.5, help="секунд на один замер")
+    ap.add_argument("--threshold", type=float, default=0.25)
+    ap.add_argument("--retries", type=int, default=2)
+    ap.add_argument("--save", action="store_true")
+    args = ap.parse_args()
+
+    base = json.loads(BASELINE.read_text(encoding="utf-8")) if BASELINE.exists() else None
+    if base and not args.save and base.get("machine") != machine():
+        print(f"baseline снят на другой машине ({base.get('machine')}), сравнение ориентировочное")
+
+    run = Run(args.budget)
+    cases = {}
+    for n in args.sizes:
+        tasks = make_mix(args.mix, n, NOW)
+        for name, fn in CASES.items():
+            cases[f"{args.mix}/{name}/{n}"] = (name, n, fn, tasks)
+    for key, (_, _, fn, tasks) in cases.items():
+        run.measure(key, fn, tasks)
+
+    def ratio(key: str) -> Optional[float]:
+        old = base and not args.save and base["results"].get(key)
+        return run.units(key) / (old["min_ms"] / base["calibration_ms"]) if old else None
+
+    for _ in range(args.retries):
+        for key in [k for k in cases if args.save or (ratio(k) or 0) > 1 + args.threshold]:
+            _, _, fn, tasks = cases[key]
+            run.measure(key, fn, tasks)
+
+    failed = []
+    print(f"{'функция':>22} {'задач':>7} {'медиана, мс':>12} {'мин, мс':>10} {'пик, КБ':>10} {'к baseline':>11}")
+    for key, (name, n, _, _) in cases.items():
+        r = run.results[key]
+        q = ratio(key)
+        verdict = ""
+        if q is not None:
+            verdict = f"{q:.2f}x" + (" !" if q > 1 + args.threshold else "  ")
+            if q > 1 + args.threshold:
+                failed.append(key)
+        print(f"{name:>22} {n:>7} {r['median_ms']:>12.3f} {r['min_ms']:>10.3f} {r['peak_kb']:>10.0f} {verdict:>11}")
+
+    if args.save:
+        saved = base["results"] if base else {}
+        for r in saved.values():  # старые записи — в масштабе нового эталона
+            r["min_ms"] *= run.calibration_ms / base["calibration_ms"]
+        saved.update(run.results)
+        BASELINE.write_text(json.dumps({"machine": machine(), "calibration_ms": run.calibration_ms, "results": saved},
+                                       indent=1, sort_keys=True) + "\n", encoding="utf-8")
+        print(f"baseline записан: {BASELINE}")
+    elif failed:
+        print(f"регрессия больше {args.threshold:.0%}: {', '.join(failed)}")
+        sys.exit(1)
@@ -0,0 +1,94 @@
+# bench/bench_restore.py — восстановление расписаний всех чатов при старте.
+#
+# Во временном каталоге создаётся SQLite-хранилище на --chats чатов по
+# --tasks задач, все подписаны на утренний план, у --legacy доли чатов
+# alert_at неизвестно (как после импорта state.pkl). Затем дважды
+# «перезапускается» бот: restore_deadlines + restore_digest на свежем
+# состоянии процесса. Первый старт распаковывает legacy-чаты и дописывает им
+# alert_at, второй уже полностью ленивый; повторный вызов в том же процессе
+# должен ничего не добавить в кучи. Telegram не вызывается.
+#
+#   python bench/bench_restore.py [--chats 100000] [--tasks 5] [--legacy 0.1]
+
+from __future__ import annotations
+import argparse
+import asyncio
+import pickle
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from workload import make_tasks
+import main
+from main import ALERT_NONE, SQLitePersistence, chat_store, dt_to_min, repo_for, ser_task
+
+def reset() -> None:
+    """Состояние процесса как сразу после запуска."""
+    main.DEADLINES = main.DeadlineScheduler()
+    main.DIGESTS = main.DigestScheduler()
+    main._REPOS.clear()
+
+async def fill(db: Path, chats: int, tasks_per_chat: int, legacy: float) -> None:
+    now = datetime.now().replace(second=0, microsecond=0)
+    p = SQLitePersistence(db)
+    rows = []
+    legacy_every = round(1 / legacy) if legacy else 0
+    for cid in range(1, chats + 1):
+        data = {}
+        chat_store(data, cid)["tasks"] = {t.id: ser_task(t) for t in make_tasks(tasks_per_chat, now, seed=cid)}
+        alert = repo_for(data, cid).next_alert()
+        main._REPOS.clear()
+        if legacy_every and cid % legacy_every == 0:
+            alert_at = None
+        else:
+            alert_at = ALERT_NONE if alert is None else dt_to_min(alert)
+        rows.append((cid, pickle.dumps(data, pickle.HIGHEST_PROTOCOL), alert_at))
+    with p.db:
+        p.db.execute("BEGIN")
+        p.db.executemany("INSERT INTO chat_data (chat_id, data, alert_at) VALUES (?, ?, ?)", rows)
+    await p.update_bot_data({"digest_chats": set(range(1, chats + 1))})
+    p.db.close()
+    reset()
+
+async def boot(db: Path) -> None:
+    reset()
+    p = SQLitePersistence(db)
+    t0 = time.perf_counter()
+    app = SimpleNamespace(chat_data=await p.get_chat_data(), bot_data=await p.get_bot_data(),
+                          persistence=p, job_queue=None)
+    load_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    await main.restore_deadlines(app)
+    main.restore_digest(app)
+    restore_s = time.perf_counter() - t0
+    heaps = (len(main.DEADLINES.heap), len(main.DIGESTS.heap))
+    t0 = time.perf_counter()
+    await main.restore_deadlines(app)
+    main.restore_digest(app)
+    again_s = time.perf_counter() - t0
+    same = "да" if (len(main.DEADLINES.heap), len(main.DIGESTS.heap)) == heaps else "НЕТ"
+    loaded = sum(1 for d in app.chat_data.values() if getattr(d, "loaded", True))
+    print(f"  чтение хранилища {load_s * 1000:8.1f} мс, восстановление {restore_s * 1000:8.1f} мс, "
+          f"повторно {again_s * 1000:7.1f} мс (кучи не выросли: {same})")
+    print(f"  распаковано чатов: {loaded}; событий дедлайнов: {heaps[0]}, планов в корзинах: {heaps[1]}")
+    p.db.close()
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chats", type=int, default=100000)
+    ap.add_argument("--tasks", type=int, default=5)
+    ap.add_argument("--legacy", type=float, default=0.1, help="доля чатов без alert_at")
+    args = ap.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Path(tmp) / "state.db"
+        asyncio.run(fill(db, args.chats, args.tasks, args.legacy))
+        print(f"{args.chats} чатов по {args.tasks} задач, {db.stat().st_size / 2 ** 20:.1f} МБ, "
+              f"без alert_at: {args.legacy:.0%}")
+        for n in (1, 2):
+            print(f"старт {n}:")
+            asyncio.run(boot(db))
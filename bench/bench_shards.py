@@ -0,0 +1,149 @@
+# bench/bench_shards.py — пропускная способность шардированного режима по числу процессов.
+#
+# Во временном каталоге создаётся state.db на --chats чатов по --tasks задач,
+# затем для каждого числа шардов оно раскладывается split_state, поднимаются
+# рабочие процессы run_shard и фронт make_front_app, и каждому чату
+# отправляется нажатие «Неделя» (план на неделю без кэша — работа для CPU).
+# Время — от первого обновления до последнего sendMessage в поддельном Bot API
+# (отдельный процесс, без лимитов).
+#
+#   python bench/bench_shards.py [--shards 1 2 4] [--chats 2000] [--tasks 100] [--clients 64]
+
+from __future__ import annotations
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import fake_bot_api
+import main
+from main import SQLitePersistence, chat_store, repo_for, ser_task
+from workload import make_tasks
+
+def worker(index: int, shards: int, base_url: str, base_port: int) -> None:
+    main.BOT_API_RATE = 1e6  # лимиты Telegram здесь не проверяются
+    main.METRICS_PORT = 0
+    main.SHARD_BASE_PORT = base_port
+    main.run_shard(index, shards, base_url)
+
+def free_port_block(n: int) -> int:
+    """Начало n подряд свободных портов."""
+    while True:
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            base = s.getsockname()[1]
+        if base + n < 65536 and all(_free(base + i) for i in range(n)):
+            return base
+
+def _free(port: int) -> bool:
+    with socket.socket() as s:
+        try:
+            s.bind(("127.0.0.1", port))
+            return True
+        except OSError:
+            return False
+
+def wait_port(port: int, timeout: float = 60) -> None:
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(port)
+
+async def fill(chats: int, tasks_per_chat: int) -> None:
+    now = datetime.now().replace(second=0, microsecond=0)
+    p = SQLitePersistence(main.STATE_DB_PATH)
+    for cid in range(1, chats + 1):
+        data = {}
+        chat_store(data, cid)["tasks"] = {t.id: ser_task(t) for t in make_tasks(tasks_per_chat, now, seed=cid)}
+        repo_for(data, cid)
+        await p.update_chat_data(cid, data)
+        main._REPOS.clear()
+    p.db.close()
+
+def press(cid: int) -> dict:
+    return {"update_id": cid, "callback_query": {
+        "id": str(cid), "chat_instance": str(cid), "data": "menu:week",
+        "from": {"id": cid, "is_bot": False, "first_name": "u"},
+        "message": {"message_id": cid, "date": 0, "chat": {"id": cid, "type": "private"}}}}
+
+async def sent(session: aiohttp.ClientSession, api: str) -> int:
+    async with session.get(f"{api}/_calls") as resp:
+        return (await resp.json()).get("sendMessage", 0)
+
+async def run(shards: int, chats: int, clients: int, api_port: int) -> float:
+    for p in Path.cwd().glob("state.*.db*"):
+        p.unlink()
+    main.split_state(shards)
+    main.SHARD_BASE_PORT = base_port = free_port_block(shards)
+    ctx = multiprocessing.get_context("spawn")
+    api = f"http://127.0.0.1:{api_port}"
+    procs = [ctx.Process(target=worker, args=(i, shards, f"{api}/bot", base_port)) for i in range(shards)]
+    for proc in procs:
+        proc.start()
+    for i in range(shards):
+        wait_port(base_port + i)
+
+    runner = web.AppRunner(main.make_front_app(shards))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    front = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}{main.WEBHOOK_PATH}"
+
+    async with aiohttp.ClientSession() as session:
+        expected = await sent(session, api) + chats
+        gate = asyncio.Semaphore(clients)
+
+        async def post(cid: int) -> None:
+            async with gate, session.post(front, json=press(cid)) as resp:
+                resp.raise_for_status()
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(post(cid) for cid in range(1, chats + 1)))
+        while await sent(session, api) < expected:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - t0
+
+    await runner.cleanup()
+    for proc in procs:
+        proc.terminate()
+    for proc in procs:
+        proc.join()
+    return elapsed
+
+async def main_async(args) -> None:
+    await fill(args.chats, args.tasks)
+    api_proc, api_port = fake_bot_api.spawn(enforce_limits=False)
+    print(f"{args.chats} чатов по {args.tasks} задач, {os.cpu_count()} ядер")
+    print(f"{'шардов':>6} {'время, с':>9} {'обн./с':>8} {'ускорение':>10}")
+    base = None
+    for n in args.shards:
+        elapsed = await run(n, args.chats, args.clients, api_port)
+        base = base or elapsed * n / args.shards[0]
+        print(f"{n:>6} {elapsed:>9.2f} {args.chats / elapsed:>8.0f} {base / elapsed:>9.2f}x")
+    api_proc.terminate()
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    ap.add_argument("--chats", type=int, default=2000)
+    ap.add_argument("--tasks", type=int, default=100)
+    ap.add_argument("--clients", type=int, default=64)
+    args = ap.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        asyncio.run(main_async(args))
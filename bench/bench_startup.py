@@ -0,0 +1,60 @@
+# bench/bench_startup.py — холодный старт с большим state.db.
+#
+# Во временном каталоге создаётся SQLite-хранилище на --chats чатов по
+# --tasks задач, и main.py --profile-startup запускается отдельным процессом
+# дважды: когда время ближайшего события каждого чата известно (чаты
+# распаковываются лениво) и когда колонка alert_at пуста, как после импорта
+# state.pkl (все чаты разбираются при старте, как раньше).
+#
+#   python bench/bench_startup.py [--chats 1000 10000] [--tasks 30]
+
+from __future__ import annotations
+import argparse
+import asyncio
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from workload import make_tasks
+import main
+from main import SQLitePersistence, chat_store, repo_for, ser_task
+
+MAIN = Path(__file__).resolve().parent.parent / "main.py"
+
+async def fill(db: Path, chats: int, tasks_per_chat: int) -> None:
+    now = datetime.now().replace(second=0, microsecond=0)
+    p = SQLitePersistence(db)
+    for cid in range(1, chats + 1):
+        data = {}
+        chat_store(data, cid)["tasks"] = {t.id: ser_task(t) for t in make_tasks(tasks_per_chat, now, seed=cid)}
+        repo_for(data, cid)
+        await p.update_chat_data(cid, data)
+        main._REPOS.clear()
+    p.db.close()
+
+def profile(cwd: Path) -> str:
+    out = subprocess.run([sys.executable, str(MAIN), "--profile-startup"], cwd=cwd,
+                         capture_output=True, text=True, check=True).stdout
+    return out
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chats", type=int, nargs="+", default=[1000, 10000])
+    ap.add_argument("--tasks", type=int, default=30)
+    args = ap.parse_args()
+    for n in args.chats:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = Path(tmp) / "state.db"
+            asyncio.run(fill(db, n, args.tasks))
+            print(f"=== {n} чатов по {args.tasks} задач, {db.stat().st_size / 2 ** 20:.1f} МБ, ленивая загрузка")
+            print(profile(Path(tmp)))
+            con = main.sqlite3.connect(db)
+            con.execute("UPDATE chat_data SET alert_at = NULL")
+            con.commit()
+            con.close()
+            print(f"=== {n} чатов, alert_at неизвестно — все чаты разбираются при старте")
+            print(profile(Path(tmp)))
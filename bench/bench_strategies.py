@@ -0,0 +1,59 @@
+# bench/bench_strategies.py — сравнение стратегий размещения на синтетических неделях.
+#
+# Для каждой стратегии из SCHEDULERS строится недельный план и считается:
+#   загрузка  — доля свободного (после фиксированных блоков) времени недели,
+#               занятая гибкими задачами;
+#   сорвано   — гибкие авто-задачи с дедлайном в пределах недели, размещённые
+#               не полностью;
+#   день      — средний номер дня (0 = сегодня), куда попала гибкая задача;
+#   время     — время построения плана.
+#
+#   python bench/bench_strategies.py [--sizes 10 30 100 300] [--seeds 5]
+
+from __future__ import annotations
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from workload import make_tasks
+from main import SCHEDULERS, build_fixed_blocks, plan_week_without_dup
+
+def measure(name: str, n: int, seed: int, now: datetime) -> tuple:
+    tasks = make_tasks(n, now, seed=seed)
+    days = [(now + timedelta(days=i)).replace(hour=12, minute=0) for i in range(7)]
+    free_min = sum(sum((e - s).total_seconds() / 60 for s, e in build_fixed_blocks(d, now, tasks)[1]) for d in days)
+    flex = {t.id: t for t in tasks if t.auto and not t.constant and not (t.fixed_start and t.fixed_end)}
+
+    t0 = time.perf_counter()
+    week = plan_week_without_dup(now, now, tasks, scheduler=SCHEDULERS[name])
+    elapsed = time.perf_counter() - t0
+
+    placed, day_of = {}, {}
+    for i, items in enumerate(week.values()):
+        for it in items:
+            if it.task_id in flex:
+                placed[it.task_id] = placed.get(it.task_id, 0) + (it.end - it.start).total_seconds() / 60
+                day_of[it.task_id] = i
+    horizon = days[-1].replace(hour=23, minute=59)
+    missed = sum(1 for tid, t in flex.items() if t.deadline_at <= horizon and placed.get(tid, 0) < t.duration_min)
+    util = sum(placed.values()) / free_min if free_min else 0.0
+    avg_day = sum(day_of.values()) / len(day_of) if day_of else 0.0
+    return util, missed, avg_day, elapsed
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[10, 30, 100, 300])
+    ap.add_argument("--seeds", type=int, default=5)
+    args = ap.parse_args()
+    now = datetime.now().replace(hour=9, minute=0, second=0, microsecond=0)
+    print(f"{'задач':>6} {'стратегия':>10} {'загрузка':>9} {'сорвано':>8} {'день':>6} {'время, мс':>10}")
+    for n in args.sizes:
+        for name in SCHEDULERS:
+            rows = [measure(name, n, seed, now) for seed in range(args.seeds)]
+            util, missed, avg_day, elapsed = (sum(col) / len(rows) for col in zip(*rows))
+            print(f"{n:>6} {name:>10} {util:>8.1%} {missed:>8.1f} {avg_day:>6.2f} {elapsed * 1000:>10.2f}")
+        print()
@@ -0,0 +1,101 @@
+# bench/bench_tasklog.py — запись изменений задач журналом task_log против перезаписи строки.
+#
+# Чат с --tasks задачами получает --edits правок по одной задаче (отметить
+# выполненной, переключить авто, удалить, добавить), после каждой вызывается
+# update_chat_data — вместе с deepcopy, который перед ней делает Application.
+# Сравнивается с прежней схемой, где каждая запись — deepcopy и pickle всего
+# chat_data. Затем хранилище открывается заново, чат
+# распаковывается со снимка и журнала, и задачи сверяются с живым
+# репозиторием.
+#
+#   python bench/bench_tasklog.py [--tasks 200 2000] [--edits 1000]
+
+from __future__ import annotations
+import argparse
+import asyncio
+import copy
+import pickle
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from workload import make_tasks
+import main
+from main import LazyChatData, SQLitePersistence, Task, chat_store, repo_for
+
+CHAT = 1
+
+def edit(repo, rnd: random.Random, i: int) -> None:
+    r = rnd.random()
+    tasks = repo.active()
+    if r < 0.1 or not tasks:
+        repo.save(Task(id=f"new{i:06d}", title=f"new {i}", duration_min=30, deadline_at=repo.now()))
+    elif r < 0.2:
+        repo.remove(rnd.choice(tasks).id)
+    else:
+        t = rnd.choice(tasks)
+        if r < 0.6:
+            t.done = not t.done
+        else:
+            t.auto = not t.auto
+        repo.touch(t)
+
+async def run(n_tasks: int, edits: int) -> None:
+    main._REPOS.clear()
+    main.DEADLINES = main.DeadlineScheduler()
+    now = datetime.now().replace(second=0, microsecond=0)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Path(tmp) / "state.db"
+        p = SQLitePersistence(db)
+        chat_data = LazyChatData()  # так chat_data новых чатов создаёт Application
+        store = chat_store(chat_data, CHAT)
+        for t in make_tasks(n_tasks, now):
+            store["tasks"][t.id] = main.ser_task(t)
+        repo = repo_for(chat_data, CHAT)
+        await p.update_chat_data(CHAT, chat_data)
+
+        rnd = random.Random(n_tasks)
+        full_s = full_b = 0.0
+        log_s = 0.0
+        for i in range(edits):
+            edit(repo, rnd, i)
+            t0 = time.perf_counter()
+            await p.update_chat_data(CHAT, copy.deepcopy(chat_data))
+            log_s += time.perf_counter() - t0
+            # прежняя схема: копия и вся строка заново
+            t0 = time.perf_counter()
+            blob = pickle.dumps(copy.deepcopy(dict(chat_data)), pickle.HIGHEST_PROTOCOL)
+            p.db.execute("INSERT OR REPLACE INTO kv VALUES ('bench', ?)", (blob,))
+            full_s += time.perf_counter() - t0
+            full_b += len(blob)
+        events = p.db.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM task_log").fetchone()
+        p.db.close()
+        live = {tid: main.ser_task(t) for tid, t in repo.tasks.items()}
+
+        main._REPOS.clear()
+        p = SQLitePersistence(db)
+        data = (await p.get_chat_data())[CHAT]
+        t0 = time.perf_counter()
+        replayed = dict(chat_store(data, CHAT)["tasks"])
+        replay_s = time.perf_counter() - t0
+        p.db.close()
+
+    same = "да" if replayed == live else "НЕТ"
+    print(f"{n_tasks:>6} {full_s / edits * 1e6:>12.0f} {full_b / edits / 1024:>10.1f} "
+          f"{log_s / edits * 1e6:>12.0f} {events[0]:>8} {replay_s * 1000:>10.1f}  {same}")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--tasks", type=int, nargs="+", default=[200, 2000])
+    ap.add_argument("--edits", type=int, default=1000)
+    args = ap.parse_args()
+    print(f"{args.edits} правок по одной задаче; снимок раз в {main.TASK_LOG_SNAPSHOT} событий")
+    print(f"{'задач':>6} {'строкой, мкс':>12} {'строка, КБ':>10} {'журналом, мкс':>12} {'событий':>8} "
+          f"{'распаковка, мс':>10}  совпадает")
+    for n in args.tasks:
+        asyncio.run(run(n, args.edits))
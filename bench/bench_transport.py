@@ -0,0 +1,118 @@
+# bench/bench_transport.py — сквозная задержка обработчиков: long polling против вебхука.
+#
+# Проигрывает записанные обновления (JSONL, по одному Update на строку; без
+# файла — синтетические нажатия «Сегодня»/«Неделя»/«Список») через поддельный
+# Bot API и меряет время от появления обновления до первого sendMessage в ответ.
+#
+#   python bench/bench_transport.py [--updates rec.jsonl] [--chats 50] [--tasks 5] [--concurrency 1]
+
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import fake_bot_api
+import main
+from workload import make_tasks
+
+def synth_updates(chats: int, per_chat: int) -> list:
+    out = []
+    buttons = ("menu:today", "menu:week", "menu:list")
+    for i in range(per_chat):
+        for c in range(chats):
+            n = len(out) + 1
+            cid = 1000 + c
+            out.append({"update_id": n, "callback_query": {
+                "id": str(n), "chat_instance": str(cid), "data": buttons[i % len(buttons)],
+                "from": {"id": cid, "is_bot": False, "first_name": "u"},
+                "message": {"message_id": n, "date": 0, "chat": {"id": cid, "type": "private"}}}})
+    return out
+
+def chat_of(update: dict) -> int:
+    for key in ("message", "edited_message"):
+        if key in update:
+            return update[key]["chat"]["id"]
+    return update["callback_query"]["message"]["chat"]["id"]
+
+async def replay(mode: str, updates: list, tasks_per_chat: int, concurrency: int) -> list:
+    api = fake_bot_api.FakeBotApi(enforce_limits=False)
+    api_runner, api_port = await fake_bot_api.start(api)
+    main.CONCURRENT_UPDATES = concurrency
+    with tempfile.TemporaryDirectory() as tmp:
+        # лимиты Telegram здесь не проверяются — меряется только транспорт и обработчики
+        unlimited = main.ChatRateLimiter(overall=1e6, per_chat=1e6, chat_burst=1e6, per_group=1e6)
+        app = main.build_app(main.SQLitePersistence(Path(tmp) / "state.db"), token="1:fake",
+                             base_url=f"http://127.0.0.1:{api_port}/bot", rate_limiter=unlimited)
+        await app.initialize()
+        now = datetime.now()
+        for cid in {chat_of(u) for u in updates}:
+            repo = main.repo_for(app.chat_data[cid], cid)
+            for t in make_tasks(tasks_per_chat, now, seed=cid):
+                repo.save(t)
+        await app.post_init(app)
+
+        hook_runner = session = None
+        if mode == "polling":
+            await app.updater.start_polling(poll_interval=0, timeout=10)
+        else:
+            hook_runner = web.AppRunner(main.make_webhook_app(app))
+            await hook_runner.setup()
+            site = web.TCPSite(hook_runner, "127.0.0.1", 0)
+            await site.start()
+            hook_url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}{main.WEBHOOK_PATH}"
+            session = aiohttp.ClientSession()
+        await app.start()
+
+        latencies = []
+        for u in updates:
+            fut = api.wait_message(chat_of(u))
+            t0 = time.monotonic()
+            if mode == "polling":
+                api.push_update(u)
+            else:
+                async with session.post(hook_url, json=u, headers={
+                        "X-Telegram-Bot-Api-Secret-Token": main.WEBHOOK_SECRET}) as resp:
+                    resp.raise_for_status()
+            latencies.append(await asyncio.wait_for(fut, 30) - t0)
+
+        if mode == "polling":
+            await app.updater.stop()
+        else:
+            await session.close()
+            await hook_runner.cleanup()
+        await app.stop()
+        await app.post_stop(app)
+        await app.shutdown()
+    await api_runner.cleanup()
+    return latencies
+
+async def run(args) -> None:
+    if args.updates:
+        updates = [json.loads(line) for line in Path(args.updates).read_text(encoding="utf-8").splitlines() if line]
+    else:
+        updates = synth_updates(args.chats, 3)
+    print(f"{len(updates)} обновлений, {args.tasks} задач на чат")
+    print(f"{'режим':>8} {'p50, мс':>8} {'p90, мс':>8} {'p99, мс':>8}")
+    for mode in ("polling", "webhook"):
+        lat = sorted(await replay(mode, updates, args.tasks, args.concurrency))
+        p = lambda q: lat[min(len(lat) - 1, int(len(lat) * q))] * 1000
+        print(f"{mode:>8} {statistics.median(lat) * 1000:>8.2f} {p(0.9):>8.2f} {p(0.99):>8.2f}")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--updates")
+    ap.add_argument("--chats", type=int, default=50)
+    ap.add_argument("--tasks", type=int, default=5)
+    ap.add_argument("--concurrency", type=int, default=1)
+    asyncio.run(run(ap.parse_args()))
@@ -0,0 +1,127 @@
+# bench/fake_bot_api.py — локальный поддельный Bot API для бенчмарков исходящего трафика.
+#
+# Отвечает на любые методы, держит лимиты Telegram (30 сообщений/с на бота,
+# ~1/с со всплеском 20 на чат) и на превышение отвечает 429 с retry_after.
+#
+#   python bench/fake_bot_api.py [порт]
+
+from __future__ import annotations
+import asyncio
+import multiprocessing
+import socket
+import sys
+import time
+from pathlib import Path
+from collections import defaultdict
+
+from aiohttp import web
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from main import TokenBucket
+
+class FakeBotApi:
+    def __init__(self, latency: float = 0.0, enforce_limits: bool = True):
+        self.latency = latency
+        self.enforce_limits = enforce_limits
+        self.overall = TokenBucket(30, 30)
+        self.chats = defaultdict(lambda: TokenBucket(1, 20))
+        self.calls = defaultdict(int)
+        self.flood = 0
+        self.received = []  # (monotonic, method, chat_id)
+        self.texts = defaultdict(list)  # chat_id -> тексты sendMessage по порядку
+        self.message_id = 0
+        self.updates: asyncio.Queue = asyncio.Queue()  # что отдать в getUpdates
+        self.waiters: dict = {}  # chat_id -> Future первого sendMessage в этот чат
+
+    def wait_message(self, chat_id: int) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        self.waiters[chat_id] = fut
+        return fut
+
+    def push_update(self, update: dict) -> None:
+        self.updates.put_nowait(update)
+
+    async def get_updates(self, timeout: float) -> list:
+        """Long polling: ждать первое обновление до timeout, затем забрать всё накопленное."""
+        try:
+            first = await asyncio.wait_for(self.updates.get(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        out = [first]
+        while not self.updates.empty() and len(out) < 100:
+            out.append(self.updates.get_nowait())
+        return out
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_get("/_texts", self.texts_json)
+        app.router.add_get("/_calls", self.calls_json)
+        return app
+
+    async def calls_json(self, request: web.Request) -> web.Response:
+        return web.json_response(self.calls)
+
+    async def texts_json(self, request: web.Request) -> web.Response:
+        return web.json_response({str(k): v for k, v in self.texts.items()})
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = dict(await request.post())
+        if not data and request.can_read_body:
+            data = await request.json()
+        if method == "getUpdates":
+            return web.json_response({"ok": True, "result": await self.get_updates(float(data.get("timeout", 0)))})
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.calls[method] += 1
+        chat_id = int(data["chat_id"]) if "chat_id" in data else None
+        if self.enforce_limits and method.startswith(("send", "edit", "delete")):
+            if (chat_id is not None and self.chats[chat_id].reserve() > 0) or self.overall.reserve() > 0:
+                self.flood += 1
+                return web.json_response({"ok": False, "error_code": 429,
+                                          "description": "Too Many Requests: retry after 1",
+                                          "parameters": {"retry_after": 1}}, status=429)
+        self.received.append((time.monotonic(), method, chat_id))
+        if method == "getMe":
+            return web.json_response({"ok": True, "result": {
+                "id": 1, "is_bot": True, "first_name": "fake", "username": "fake_bot"}})
+        if method == "sendMessage":
+            self.message_id += 1
+            self.texts[chat_id].append(data.get("text", ""))
+            fut = self.waiters.pop(chat_id, None)
+            if fut is not None and not fut.done():
+                fut.set_result(time.monotonic())
+            return web.json_response({"ok": True, "result": {
+                "message_id": self.message_id, "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "text": data.get("text", "")}})
+        return web.json_response({"ok": True, "result": True})
+
+async def start(api: FakeBotApi, port: int = 0) -> tuple[web.AppRunner, int]:
+    runner = web.AppRunner(api.app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    await site.start()
+    return runner, site._server.sockets[0].getsockname()[1]
+
+def _serve(port: int, latency: float, enforce_limits: bool) -> None:
+    web.run_app(FakeBotApi(latency, enforce_limits).app(), host="127.0.0.1", port=port, print=None)
+
+def spawn(latency: float = 0.0, enforce_limits: bool = True) -> tuple[multiprocessing.Process, int]:
+    """Запустить сервер в отдельном процессе, чтобы он не делил CPU с ботом."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    proc = multiprocessing.Process(target=_serve, args=(port, latency, enforce_limits), daemon=True)
+    proc.start()
+    for _ in range(200):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            break
+        except OSError:
+            time.sleep(0.025)
+    return proc, port
+
+if __name__ == "__main__":
+    web.run_app(FakeBotApi().app(), host="127.0.0.1", port=int(sys.argv[1]) if len(sys.argv) > 1 else 8081)
@@ -0,0 +1,54 @@
+# bench/workload.py — генератор синтетических наборов задач для бенчмарков планировщика.
+
+from __future__ import annotations
+import random
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from main import Task  # noqa: E402
+
+EFFORTS = ("quick", "medium", "heavy", "extreme")
+
+# Доли фиксированных и постоянных задач (остальное — гибкие) для типичных чатов
+MIXES = {
+    "default": (0.2, 0.2),
+    "office": (0.4, 0.3),     # много встреч и повторяющихся блоков
+    "student": (0.1, 0.4),    # расписание пар плюс домашние задания
+    "freelance": (0.05, 0.05),  # почти всё гибкое
+}
+
+def make_tasks(n: int, now: datetime, seed: int = 0, fixed_share: float = 0.2, const_share: float = 0.2) -> List[Task]:
+    """Смесь фиксированных, постоянных и гибких задач на ближайшие две недели."""
+    rnd = random.Random(seed)
+    out: List[Task] = []
+    for i in range(n):
+        tid = f"{i:08x}"
+        r = rnd.random()
+        if r < fixed_share:
+            start = (now + timedelta(days=rnd.randint(0, 7))).replace(
+                hour=rnd.randint(6, 20), minute=rnd.choice((0, 15, 30, 45)), second=0, microsecond=0)
+            dur = rnd.choice((15, 30, 45, 60, 90))
+            out.append(Task(id=tid, title=f"fixed {i}", duration_min=dur, deadline_at=start + timedelta(minutes=dur),
+                            effort=rnd.choice(EFFORTS), fixed_start=start, fixed_end=start + timedelta(minutes=dur)))
+        elif r < fixed_share + const_share:
+            sh = rnd.randint(6, 20)
+            sm = rnd.choice((0, 30))
+            dur = rnd.choice((30, 60, 90))
+            eh, em = divmod(sh * 60 + sm + dur, 60)
+            out.append(Task(id=tid, title=f"const {i}", duration_min=dur, deadline_at=now,
+                            effort=rnd.choice(EFFORTS), constant=True,
+                            dow=sorted(rnd.sample(range(7), rnd.randint(1, 5))),
+                            constant_start_hm=(sh, sm), constant_end_hm=(min(eh, 23), em)))
+        else:
+            out.append(Task(id=tid, title=f"flex {i}", duration_min=rnd.choice((15, 30, 60, 120, 240)),
+                            deadline_at=now + timedelta(hours=rnd.randint(20, 24 * 14)),
+                            effort=rnd.choice(EFFORTS), splittable=rnd.random() < 0.5, auto=rnd.random() < 0.8))
+    return out
+
+def make_mix(mix: str, n: int, now: datetime, seed: int = 0) -> List[Task]:
+    fixed_share, const_share = MIXES[mix]
+    return make_tasks(n, now, seed=seed, fixed_share=fixed_share, const_share=const_share)
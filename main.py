@@ -3,55 +3,133 @@
 # и чтением стоических цитат из файла quotes.json (UTF-8).
 
 from __future__ import annotations
+from time import perf_counter
+_IMPORTS = [("", perf_counter())]  # отметки времени импорта для --profile-startup
 from dataclasses import dataclass
-from datetime import datetime, timedelta, time
-from typing import Optional, Dict, List, Tuple
+from datetime import datetime, date, timedelta, time, timezone, tzinfo
+from typing import Optional, Dict, List, Tuple, Callable
+from bisect import bisect_left, bisect_right
 import uuid
 import copy
 import json
+import pickle
+import sqlite3
+import heapq
+import itertools
+import zlib
+import mmap
+import random
+import asyncio
+import logging
+import os
+import signal
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from time import monotonic
 from pathlib import Path
-
-from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+from functools import lru_cache, wraps
+from array import array
+from math import gcd
+from types import SimpleNamespace
+from contextlib import asynccontextmanager, contextmanager
+import re
+import sys
+from zoneinfo import ZoneInfo
+_IMPORTS.append(("стандартная библиотека", perf_counter()))
+
+# aiohttp (вебхук) и numpy (утренняя волна) импортируются при первом использовании
+np = None
+
+@lru_cache(maxsize=None)
+def _numpy():
+    global np
+    try:
+        import numpy
+    except ImportError:  # без numpy утренняя волна планируется по одному чату
+        return None
+    np = numpy
+    return np
+
+from telegram import Bot, Update, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.error import RetryAfter, TelegramError
 from telegram.ext import (
     Application, CommandHandler, CallbackQueryHandler,
-    ContextTypes, PicklePersistence, ConversationHandler,
+    ContextTypes, PicklePersistence, BasePersistence, BaseRateLimiter, BaseUpdateProcessor, ConversationHandler,
     MessageHandler, filters
 )
+_IMPORTS.append(("python-telegram-bot", perf_counter()))
+
+log = logging.getLogger("scheduler-bot")
 
 # ==================== Конфигурация ====================
 BOT_TOKEN = "8382727090:AAEzR9dhvDcCgwFVXAEZBMJU60wEaChzfl4"  # замените
 DAY_START = (6, 0)
 DAY_END = (22, 0)
 
-# Путь к файлу цитат стоиков (UTF-8), формат: [{"q": "цитата", "a": "автор"}, ...]
-QUOTES_PATH = Path("quotes.json")
-QUOTES: List[dict] = []
-
-def load_quotes() -> None:
-    """Загрузить список цитат из quotes.json (UTF-8)."""
-    global QUOTES
-    try:
-        if QUOTES_PATH.exists():
-            with QUOTES_PATH.open("r", encoding="utf-8") as f:
-                QUOTES = json.load(f)
-        else:
-            QUOTES = []
-    except Exception:
-        QUOTES = []
-
-def stoic_quote_ru() -> str:
-    """Вернуть случайную цитату стоика на русском из QUOTES, либо фолбэк."""
-    import random
-    if QUOTES:
-        item = random.choice(QUOTES)
-        q = (item.get("q") or "").strip()
-        a = (item.get("a") or "Стоик").strip()
-        if q:
-            return f"«{q}» — {a}"
-    return "«Счастье вашей жизни зависит от качества ваших мыслей.» — Марк Аврелий"
+# Хранилище состояния: "sqlite" (по строке на чат) или "pickle" (один файл)
+STATE_BACKEND = "sqlite"
+STATE_DB_PATH = Path("state.db")
+STATE_PICKLE_PATH = Path("state.pkl")  # при первом запуске SQLite импортируется отсюда
+# SQLite: задачи пишутся в журнал task_log событиями; раз в TASK_LOG_SNAPSHOT
+# событий чата его задачи сжимаются в снимок, в журнале остаётся TASK_LOG_KEEP последних
+TASK_LOG_SNAPSHOT = 256
+TASK_LOG_KEEP = 2000
+
+# Получение обновлений: "polling" (long polling) или "webhook" (aiohttp-сервер)
+UPDATE_MODE = os.environ.get("BOT_MODE", "polling")
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")         # публичный адрес для setWebhook; пусто — не регистрировать
+WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")   # сверяется с X-Telegram-Bot-Api-Secret-Token
+# Шардирование (только вебхук): SHARDS > 1 — фронт на WEBHOOK_PORT и SHARDS рабочих
+# процессов; каждый владеет диапазоном хэшей chat_id, своим state.<i>.db и JobQueue
+# и слушает фронт на SHARD_HOST:SHARD_BASE_PORT + i
+SHARDS = int(os.environ.get("SHARDS", "1"))
+SHARD_HOST = "127.0.0.1"
+SHARD_BASE_PORT = int(os.environ.get("SHARD_BASE_PORT", "8100"))
+BOT_API_RATE = 30  # сообщений/с на бота (лимит Telegram); шарды делят его поровну
+# >1 — разные чаты обрабатываются параллельно, обновления одного чата — по порядку
+CONCURRENT_UPDATES = int(os.environ.get("CONCURRENT_UPDATES", "1"))
+# Метрики в формате Prometheus: http://METRICS_HOST:METRICS_PORT/metrics; порт 0 — не поднимать
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9108"))
+
+# Планы для чатов с PLAN_OFFLOAD_MIN_TASKS задач и больше считаются в пуле
+# процессов, чтобы не останавливать event loop для остальных чатов
+PLAN_OFFLOAD_MIN_TASKS = int(os.environ.get("PLAN_OFFLOAD_MIN_TASKS", "1000"))
+PLAN_WORKERS = int(os.environ.get("PLAN_WORKERS", "2"))
+
+# Стратегия размещения гибких задач: first-fit | best-fit | edf | bnb | gap-fill
+PLANNER = os.environ.get("PLANNER", "first-fit")
+
+# Часовой пояс чатов без своей настройки: IANA ("Europe/Moscow") или смещение ("+3"); пусто — пояс сервера
+DEFAULT_TZ = os.environ.get("BOT_TZ", "")
+
+# Утренний план: чаты из bot_data["digest_chats"] получают его в своё местное
+# время (по умолчанию DIGEST_TIME) со сдвигом до DIGEST_JITTER минут, постоянным
+# для чата, — рассылка раскладывается по минутным корзинам, а не уходит одной волной
+DIGEST_TIME = time(7, 30)
+DIGEST_JITTER = int(os.environ.get("DIGEST_JITTER", "20"))
+DIGEST_TICK = 60  # сек.: как часто проверять наступившие корзины
+
+# История выполненных: в store лежит «горячий» хвост, старое уходит на диск
+# сжатыми сегментами по HISTORY_SEGMENT записей
+HISTORY_DIR = Path("history")
+HISTORY_HOT = 200        # сколько последних записей всегда держать в store
+HISTORY_SEGMENT = 500    # размер архивного сегмента
+HISTORY_PAGE = 10        # записей на странице «Истории»
+HISTORY_DAYS_KEEP = 400  # сколько дней хранить посуточные счётчики
+
+# Файл цитат стоиков (UTF-8): quotes.json — [{"q": "цитата", "a": "автор"}, ...],
+# либо *.jsonl — по такому объекту на строку (для большого корпуса)
+QUOTES_PATH = Path(os.environ.get("QUOTES_PATH", "quotes.json"))
+QUOTES_RECHECK = 5.0          # сек.: как часто сверять mtime файла цитат
+QUOTES_MMAP_MIN = 1 << 20     # байт: *.jsonl крупнее этого не читается целиком, а отображается в память
+QUOTE_FALLBACK = "«Счастье вашей жизни зависит от качества ваших мыслей.» — Марк Аврелий"
 
 # ==================== Домены ====================
-@dataclass
+@dataclass(slots=True)
 class Task:
     id: str
     title: str
@@ -69,41 +147,119 @@ class Task:
     constant_end_hm: Optional[Tuple[int, int]] = None    # (HH,MM)
     planned_for: Optional[str] = None  # 'YYYY-MM-DD' — назначенная дата для гибкой
     overdue: bool = False           # просроченная
+    alerted: int = 0                # сколько предупреждений о дедлайне отправлено: 1 — за 24ч, 2 — за 4ч
 
-@dataclass
+@dataclass(slots=True)
 class DoneEntry:
-    task: Task
+    task_id: str
+    title: str
     completed_at: datetime
 
+# ==================== Часовые пояса ====================
+# Планировщик считает в «настенном» времени чата: naive datetime в его поясе.
+# В серверное время (им живут куча дедлайнов и JobQueue) переводится на границе.
+_OFFSET_RE = re.compile(r"^(?:UTC|GMT)?\s*([+-])(\d{1,2})(?::?(\d{2}))?$", re.IGNORECASE)
+
+@lru_cache(maxsize=None)
+def zone(name: str) -> Optional[tzinfo]:
+    """tzinfo по имени из настроек; None — пояс сервера. Неизвестное имя — ValueError."""
+    name = (name or "").strip()
+    if not name:
+        return None
+    m = _OFFSET_RE.match(name)
+    if m:
+        sign, hh, mm = m.groups()
+        offset = timedelta(hours=int(hh), minutes=int(mm or 0))
+        if offset > timedelta(hours=14):
+            raise ValueError(name)
+        return timezone(-offset if sign == "-" else offset)
+    try:
+        return ZoneInfo(name)
+    except Exception:
+        raise ValueError(name) from None
+
+def chat_tz(store: Dict) -> Optional[tzinfo]:
+    try:
+        return zone(store.get("tz") or DEFAULT_TZ)
+    except ValueError:
+        return None
+
+def local_now(tz: Optional[tzinfo]) -> datetime:
+    """Текущее настенное время пояса tz."""
+    return datetime.now(tz).replace(tzinfo=None) if tz is not None else datetime.now()
+
+def to_server(dt: datetime, tz: Optional[tzinfo]) -> datetime:
+    """Настенное время пояса tz -> серверное настенное время."""
+    return dt.replace(tzinfo=tz).astimezone().replace(tzinfo=None) if tz is not None else dt
+
+def from_server(dt: datetime, tz: Optional[tzinfo]) -> datetime:
+    return dt.astimezone(tz).replace(tzinfo=None) if tz is not None else dt
+
 # ==================== Персистентность ====================
 def get_store(context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> Dict:
-    chat = context.chat_data.setdefault(chat_id, {})
-    chat.setdefault("tasks", {})     # активные задачи
-    chat.setdefault("history", [])   # история выполненных
-    chat.setdefault("overdue", {})   # просроченные
-    return chat
-
-def ser_task(t: Task) -> dict:
-    return {
-        "id": t.id,
-        "title": t.title,
-        "duration_min": t.duration_min,
-        "deadline_at": t.deadline_at.isoformat(),
-        "effort": t.effort,
-        "fixed_start": t.fixed_start.isoformat() if t.fixed_start else None,
-        "fixed_end": t.fixed_end.isoformat() if t.fixed_end else None,
-        "splittable": t.splittable,
-        "done": t.done,
-        "auto": t.auto,
-        "constant": t.constant,
-        "dow": t.dow or [],
-        "constant_start_hm": list(t.constant_start_hm) if t.constant_start_hm else None,
-        "constant_end_hm": list(t.constant_end_hm) if t.constant_end_hm else None,
-        "planned_for": t.planned_for,
-        "overdue": t.overdue,
-    }
-
-def deser_task(d: dict) -> Task:
+    return chat_store(context.chat_data, chat_id)
+
+def chat_store(chat_data: Dict, chat_id: int) -> Dict:
+    """store чата — сам chat_data: PTB и так держит его отдельно для каждого чата.
+    Данные старых форматов доводятся до STORE_VERSION при первом обращении."""
+    if chat_data.get("v") != STORE_VERSION:
+        migrate_store(chat_data, chat_id)
+    chat_data.setdefault("tasks", {})     # активные задачи
+    chat_data.setdefault("history", [])   # история выполненных
+    chat_data.setdefault("overdue", {})   # просроченные
+    return chat_data
+
+# Задача хранится кортежем фиксированной длины: время — целые минуты от эпохи,
+# булевы поля — битовая маска, дни недели — маска по битам 0=Пн..6=Вс.
+EFFORTS = ("quick", "medium", "heavy", "extreme")
+_EFFORT_CODE = {e: i for i, e in enumerate(EFFORTS)}
+F_SPLIT, F_DONE, F_AUTO, F_CONST, F_OVERDUE = 1, 2, 4, 8, 16
+F_ALERT_SHIFT = 5  # биты 5–6 флагов: Task.alerted
+
+def dt_to_min(dt: Optional[datetime]) -> Optional[int]:
+    return int(dt.timestamp() // 60) if dt else None
+
+def min_to_dt(m: Optional[int]) -> Optional[datetime]:
+    return datetime.fromtimestamp(m * 60) if m is not None else None
+
+def ser_task(t: Task) -> tuple:
+    flags = ((F_SPLIT if t.splittable else 0) | (F_DONE if t.done else 0) | (F_AUTO if t.auto else 0)
+             | (F_CONST if t.constant else 0) | (F_OVERDUE if t.overdue else 0) | t.alerted << F_ALERT_SHIFT)
+    dow_mask = 0
+    for d in t.dow or ():
+        dow_mask |= 1 << d
+    csh = t.constant_start_hm[0] * 60 + t.constant_start_hm[1] if t.constant_start_hm else None
+    ceh = t.constant_end_hm[0] * 60 + t.constant_end_hm[1] if t.constant_end_hm else None
+    planned = date.fromisoformat(t.planned_for).toordinal() if t.planned_for else None
+    return (t.id, t.title, t.duration_min, dt_to_min(t.deadline_at), _EFFORT_CODE.get(t.effort, 1),
+            dt_to_min(t.fixed_start), dt_to_min(t.fixed_end), flags, dow_mask, csh, ceh, planned)
+
+def deser_task(d) -> Task:
+    if isinstance(d, dict):
+        return deser_task_legacy(d)
+    tid, title, duration, deadline, effort, fs, fe, flags, dow_mask, csh, ceh, planned = d
+    return Task(
+        id=tid,
+        title=title,
+        duration_min=duration,
+        deadline_at=min_to_dt(deadline),
+        effort=EFFORTS[effort],
+        fixed_start=min_to_dt(fs),
+        fixed_end=min_to_dt(fe),
+        splittable=bool(flags & F_SPLIT),
+        done=bool(flags & F_DONE),
+        auto=bool(flags & F_AUTO),
+        constant=bool(flags & F_CONST),
+        dow=[i for i in range(7) if dow_mask >> i & 1],
+        constant_start_hm=divmod(csh, 60) if csh is not None else None,
+        constant_end_hm=divmod(ceh, 60) if ceh is not None else None,
+        planned_for=date.fromordinal(planned).isoformat() if planned else None,
+        overdue=bool(flags & F_OVERDUE),
+        alerted=flags >> F_ALERT_SHIFT & 3,
+    )
+
+def deser_task_legacy(d: dict) -> Task:
+    """Прежний формат: словарь с ISO-строками."""
     def parse_dt(x):
         return datetime.fromisoformat(x) if x else None
     csh = tuple(d["constant_start_hm"]) if d.get("constant_start_hm") else None
@@ -125,16 +281,832 @@ def deser_task(d: dict) -> Task:
         constant_end_hm=ceh,
         planned_for=d.get("planned_for"),
         overdue=bool(d.get("overdue", False)),
+        alerted=int(d.get("alerted", 0)),
     )
 
-def ser_done(entry: DoneEntry) -> dict:
-    return {"task": ser_task(entry.task), "completed_at": entry.completed_at.isoformat()}
-
-def deser_done(d: dict) -> DoneEntry:
-    return DoneEntry(task=deser_task(d["task"]), completed_at=datetime.fromisoformat(d["completed_at"]))
+def ser_done(entry: DoneEntry) -> tuple:
+    return (entry.task_id, entry.title, dt_to_min(entry.completed_at))
+
+def deser_done(d) -> DoneEntry:
+    if isinstance(d, dict):
+        return DoneEntry(task_id=d["task"]["id"], title=d["task"]["title"],
+                         completed_at=datetime.fromisoformat(d["completed_at"]))
+    tid, title, at = d
+    return DoneEntry(task_id=tid, title=title, completed_at=min_to_dt(at))
+
+# Версия формата store чата (store["v"]); MIGRATIONS[v] переводит store из версии v в v + 1
+STORE_VERSION = 2
+
+def _flatten_store(chat_data: Dict, chat_id: int) -> None:
+    """0 -> 1: store лежал вложенным в chat_data[chat_id]."""
+    inner = chat_data.get(chat_id)
+    if isinstance(inner, dict):
+        del chat_data[chat_id]
+        chat_data.update(inner)
+
+def _pack_store(chat_data: Dict, chat_id: int) -> None:
+    """1 -> 2: задачи и история из словарей с ISO-строками — в кортежи ser_task/ser_done."""
+    for key in ("tasks", "overdue"):
+        section = chat_data.get(key)
+        if section and any(isinstance(d, dict) for d in section.values()):
+            chat_data[key] = {tid: ser_task(deser_task(d)) for tid, d in section.items()}
+    history = chat_data.get("history")
+    if history and any(isinstance(d, dict) for d in history):
+        chat_data["history"] = [ser_done(deser_done(d)) for d in history]
+
+MIGRATIONS: Tuple[Callable[[Dict, int], None], ...] = (_flatten_store, _pack_store)
+
+def migrate_store(chat_data: Dict, chat_id: int) -> bool:
+    """Довести store чата до STORE_VERSION; False — миграция не понадобилась."""
+    version = chat_data.get("v", 0)
+    if version == STORE_VERSION:
+        return False
+    for step in MIGRATIONS[version:]:
+        step(chat_data, chat_id)
+    chat_data["v"] = STORE_VERSION
+    return True
+
+# ==================== История ====================
+@lru_cache(maxsize=64)
+def _load_segment(path: str) -> tuple:
+    """Сегмент неизменяем после записи, поэтому его можно кэшировать по пути."""
+    with open(path, "rb") as f:
+        return pickle.loads(zlib.decompress(f.read()))
+
+class HistoryLog:
+    """История выполненных одного чата: хвост в store и сжатые сегменты на диске.
+
+    store["history"] — последние записи (старые в начале), store["history_archived"] —
+    число сегментов на диске, store["history_days"] — {ordinal дня: выполнено}.
+    Позиция 0 — самая старая запись; сегмент k хранит позиции
+    [k * HISTORY_SEGMENT, (k + 1) * HISTORY_SEGMENT).
+    """
+
+    def __init__(self, store: Dict, chat_id: int):
+        self.store = store
+        self.chat_id = chat_id
+        self.hot: list = store["history"]
+        store.setdefault("history_archived", 0)
+        if "history_days" not in store:
+            # единственный полный проход — для истории из старого формата
+            days: Dict[int, int] = {}
+            for d in self.hot:
+                day = deser_done(d).completed_at.toordinal()
+                days[day] = days.get(day, 0) + 1
+            store["history_days"] = days
+        self._spill()
+
+    @property
+    def archived(self) -> int:
+        return self.store["history_archived"] * HISTORY_SEGMENT
+
+    @property
+    def total(self) -> int:
+        return self.archived + len(self.hot)
+
+    @property
+    def pages(self) -> int:
+        return max(1, -(-self.total // HISTORY_PAGE))
+
+    def _segment_path(self, k: int) -> Path:
+        return HISTORY_DIR / str(self.chat_id) / f"{k:06d}.pkl.z"
+
+    def append(self, entry: DoneEntry) -> None:
+        self.hot.append(ser_done(entry))
+        days = self.store["history_days"]
+        day = entry.completed_at.toordinal()
+        if day not in days and len(days) >= HISTORY_DAYS_KEEP:
+            del days[min(days)]
+        days[day] = days.get(day, 0) + 1
+        self._spill()
+
+    def _spill(self) -> None:
+        """Вынести старейшие записи на диск, пока хвост длиннее HISTORY_HOT + сегмент."""
+        while len(self.hot) >= HISTORY_HOT + HISTORY_SEGMENT:
+            seg = tuple(ser_done(deser_done(d)) for d in self.hot[:HISTORY_SEGMENT])
+            path = self._segment_path(self.store["history_archived"])
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(".tmp")
+            tmp.write_bytes(zlib.compress(pickle.dumps(seg, protocol=pickle.HIGHEST_PROTOCOL)))
+            os.replace(tmp, path)
+            del self.hot[:HISTORY_SEGMENT]
+            self.store["history_archived"] += 1
+
+    def _slice(self, lo: int, hi: int) -> list:
+        """Записи с позициями [lo, hi); с диска читаются только нужные сегменты."""
+        out = []
+        pos = lo
+        while pos < hi and pos < self.archived:
+            k, off = divmod(pos, HISTORY_SEGMENT)
+            try:
+                seg = _load_segment(str(self._segment_path(k)))
+            except Exception:
+                seg = ()  # архив потерян — показываем то, что есть
+            end = min(hi, (k + 1) * HISTORY_SEGMENT)
+            out.extend(seg[off:end - k * HISTORY_SEGMENT])
+            pos = end
+        if pos < hi:
+            out.extend(self.hot[pos - self.archived:hi - self.archived])
+        return out
+
+    def page(self, n: int) -> List[DoneEntry]:
+        """Страница n (0 — самые свежие), новые записи первыми."""
+        hi = self.total - n * HISTORY_PAGE
+        lo = max(0, hi - HISTORY_PAGE)
+        return [deser_done(d) for d in reversed(self._slice(lo, max(lo, hi)))]
+
+    def done_since(self, day: date) -> int:
+        """Сколько выполнено с начала дня day (по счётчикам, без чтения записей)."""
+        first = day.toordinal()
+        return sum(n for d, n in self.store["history_days"].items() if d >= first)
+
+def history_for(store: Dict, chat_id: int) -> HistoryLog:
+    return HistoryLog(store, chat_id)
+
+# ==================== Цитаты ====================
+def fmt_quote(item) -> Optional[str]:
+    if not isinstance(item, dict):
+        return None
+    q = (item.get("q") or "").strip()
+    a = (item.get("a") or "Стоик").strip()
+    return f"«{q}» — {a}" if q else None
+
+class QuoteBook:
+    """Цитаты стоиков: читаются один раз и перечитываются, когда меняется mtime файла.
+
+    quotes.json разбирается в кортеж готовых строк. Большой *.jsonl целиком не
+    читается: файл отображается в память через mmap, в памяти держатся только
+    смещения строк (заменять такой файл нужно атомарно, через rename). Каждый
+    чат идёт по своей перестановке цитат i -> (a*i + b) mod n и не видит
+    повторов, пока не покажут все остальные. Перестановка и позиция в ней —
+    четыре числа в chat_data чата, так что круг переживает перезапуск, а в
+    памяти процесса по чатам ничего не копится.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._items: Tuple[str, ...] = ()
+        self._mm: Optional[mmap.mmap] = None
+        self._offsets: Optional[array] = None
+        self._mtime: Optional[int] = None
+        self._checked = float("-inf")
+        self._rng = random.Random()
+
+    def __len__(self) -> int:
+        return len(self._offsets) if self._offsets is not None else len(self._items)
+
+    def refresh(self) -> None:
+        """Перечитать файл, если он изменился (mtime сверяется не чаще QUOTES_RECHECK)."""
+        now = monotonic()
+        if now - self._checked < QUOTES_RECHECK:
+            return
+        self._checked = now
+        try:
+            mtime = self.path.stat().st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime != self._mtime:
+            self._mtime = mtime
+            self.load()
+
+    def load(self) -> None:
+        items, mm, offsets = (), None, None
+        try:
+            if not self.path.exists():
+                pass
+            elif self.path.suffix != ".jsonl":
+                with self.path.open("r", encoding="utf-8") as f:
+                    items = tuple(filter(None, map(fmt_quote, json.load(f))))
+            elif self.path.stat().st_size < QUOTES_MMAP_MIN:
+                with self.path.open("r", encoding="utf-8") as f:
+                    items = tuple(filter(None, (fmt_quote(json.loads(line)) for line in f if line.strip())))
+            else:
+                with self.path.open("rb") as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                offsets = array("Q")
+                pos, size = 0, len(mm)
+                while pos < size:
+                    end = mm.find(b"\n", pos)
+                    if end < 0:
+                        end = size
+                    if end - pos > 2:
+                        offsets.append(pos)
+                    pos = end + 1
+        except Exception:
+            log.warning("Не удалось прочитать цитаты из %s, оставлены прежние", self.path, exc_info=True)
+            return
+        if self._mm is not None:
+            self._mm.close()
+        self._items, self._mm, self._offsets = items, mm, offsets
+
+    def _get(self, i: int) -> Optional[str]:
+        if self._offsets is None:
+            return self._items[i]
+        start = self._offsets[i]
+        end = self._mm.find(b"\n", start)
+        try:
+            return fmt_quote(json.loads(self._mm[start:end if end >= 0 else len(self._mm)]))
+        except ValueError:
+            return None
+
+    def _next(self, chat_data: Optional[Dict], n: int) -> int:
+        if chat_data is None:
+            return self._rng.randrange(n)
+        st = chat_data.get("quote")
+        if st is None or st[0] != n or st[3] >= n:  # новый круг, в том числе после смены числа цитат
+            a = self._rng.randrange(1, n) if n > 1 else 1
+            while gcd(a, n) != 1:
+                a += 1
+            st = (n, a, self._rng.randrange(n), 0)
+        _, a, b, pos = st
+        chat_data["quote"] = (n, a, b, pos + 1)
+        return (a * pos + b) % n
+
+    def pick(self, chat_data: Optional[Dict] = None) -> str:
+        """Следующая цитата для чата (его позиция — в chat_data["quote"]), либо фолбэк, если цитат нет."""
+        self.refresh()
+        n = len(self)
+        for _ in range(min(n, 3)):
+            text = self._get(self._next(chat_data, n))
+            if text:
+                return text
+        return QUOTE_FALLBACK
+
+QUOTE_BOOK = QuoteBook(QUOTES_PATH)
+
+def stoic_quote_ru(chat_data: Optional[Dict] = None) -> str:
+    """Цитата стоика на русском для чата (без повторов до конца круга)."""
+    return QUOTE_BOOK.pick(chat_data)
+
+# ==================== Репозиторий задач ====================
+def task_anchor(t: Task) -> Optional[datetime]:
+    """Момент, после которого задача считается просроченной; None — не следим."""
+    if t.done or t.constant or t.overdue:
+        return None
+    return t.fixed_end or t.deadline_at
+
+_REPO_SERIAL = itertools.count(1)
+
+class TaskRepo:
+    """Живые объекты Task одного чата поверх сериализованного store.
+
+    Сохранённые задачи разбираются один раз при создании репозитория; изменённые
+    задачи помечаются через touch() и сериализуются обратно только в flush().
+    Какие задачи менялись с прошлой записи, отдаёт take_events() — из этого
+    SQLitePersistence пишет журнал task_log.
+    Якоря активных задач (fixed_end или deadline_at) лежат в min-куче: expired()
+    достаёт только истёкшие, устаревшие записи отбрасываются лениво.
+    """
+
+    def __init__(self, store: Dict, chat_id: int):
+        self.store = store
+        self.chat_id = chat_id
+        self.tasks: Dict[str, Task] = {tid: deser_task(d) for tid, d in store["tasks"].items()}
+        self.overdue: Dict[str, Task] = {tid: deser_task(d) for tid, d in store["overdue"].items()}
+        self._dirty: set = set()
+        self._changed: set = set()  # id задач, изменённых или удалённых с прошлого take_events()
+        self.version = 0  # растёт при любой мутации; по нему сверяется кэш планов
+        self.serial = next(_REPO_SERIAL)  # новый репозиторий того же чата снова начинает version с 0
+        self.tz = chat_tz(store)
+        self._anchor: Dict[str, datetime] = {}
+        for t in self.tasks.values():
+            a = task_anchor(t)
+            if a is not None:
+                self._anchor[t.id] = a
+        self._heap: List[Tuple[datetime, str]] = [(a, tid) for tid, a in self._anchor.items()]
+        heapq.heapify(self._heap)
+
+    def active(self) -> List[Task]:
+        return list(self.tasks.values())
+
+    def now(self) -> datetime:
+        """Текущее время в поясе чата — в нём планируются и сверяются его задачи."""
+        return local_now(self.tz)
+
+    def set_tz(self, name: str) -> None:
+        """Сменить пояс чата (ValueError, если имя неизвестно) и переставить его дедлайны в куче."""
+        self.tz = zone(name)
+        self.store["tz"] = name
+        self.version += 1
+        for t in self.active():
+            DEADLINES.forget(self.chat_id, t.id)
+            DEADLINES.watch(self.chat_id, t, tz=self.tz)
+
+    def _index(self, tid: str, anchor: Optional[datetime]) -> None:
+        if self._anchor.get(tid) == anchor:
+            return
+        if anchor is None:
+            self._anchor.pop(tid, None)
+            return
+        self._anchor[tid] = anchor
+        heapq.heappush(self._heap, (anchor, tid))
+        if len(self._heap) > 2 * len(self._anchor) + 64:  # много мусора — пересобрать
+            self._heap = [(a, i) for i, a in self._anchor.items()]
+            heapq.heapify(self._heap)
+
+    def expired(self, now: datetime) -> List[Task]:
+        """Активные задачи с якорем раньше now; пусто — за O(1)."""
+        out = []
+        heap = self._heap
+        while heap and heap[0][0] < now:
+            anchor, tid = heapq.heappop(heap)
+            if self._anchor.get(tid) != anchor:
+                continue  # запись устарела: дедлайн сменили, задачу удалили или закрыли
+            del self._anchor[tid]
+            t = self.tasks.get(tid)
+            if t is not None:
+                out.append(t)
+        return out
+
+    def touch(self, t: Task) -> None:
+        self._dirty.add(t.id)
+        self._changed.add(t.id)
+        self.version += 1
+        anchor = task_anchor(t) if t.id in self.tasks else None
+        old = self._anchor.get(t.id)
+        if old is not None and anchor is not None and old != anchor:
+            t.alerted = 0  # дедлайн перенесли — предупреждать заново
+        self._index(t.id, anchor)
+        DEADLINES.watch(self.chat_id, t, tz=self.tz)
+
+    def next_alert(self) -> Optional[datetime]:
+        """Время ближайшего события дедлайнов чата (в его поясе): предупреждения или просрочки."""
+        best = None
+        for tid, anchor in self._anchor.items():
+            level = self.tasks[tid].alerted
+            when = anchor - (WARN_EARLY if level < 1 else WARN_URGENT if level < 2 else timedelta(0))
+            if best is None or when < best:
+                best = when
+        return best
+
+    def mark_dirty(self, t: Task) -> None:
+        """Сохранить задачу при следующем flush, не сбрасывая кэш планов."""
+        self._dirty.add(t.id)
+        self._changed.add(t.id)
+
+    def save(self, t: Task) -> None:
+        self.tasks[t.id] = t
+        self.touch(t)
+
+    def remove(self, tid: str) -> None:
+        self.tasks.pop(tid, None)
+        self.store["tasks"].pop(tid, None)
+        self._dirty.discard(tid)
+        self._changed.add(tid)
+        self.version += 1
+        self._anchor.pop(tid, None)
+        DEADLINES.forget(self.chat_id, tid)
+
+    def move_to_overdue(self, t: Task) -> None:
+        t.overdue = True
+        self.tasks.pop(t.id, None)
+        self.store["tasks"].pop(t.id, None)
+        self.overdue[t.id] = t
+        self.touch(t)
+
+    def restore_from_overdue(self, t: Task) -> None:
+        t.overdue = False
+        t.alerted = 0
+        self.overdue.pop(t.id, None)
+        self.store["overdue"].pop(t.id, None)
+        self.tasks[t.id] = t
+        self.touch(t)
+
+    def remove_overdue(self, tid: str) -> None:
+        self.overdue.pop(tid, None)
+        self.store["overdue"].pop(tid, None)
+        self._dirty.discard(tid)
+        self._changed.add(tid)
+        self.version += 1
+        DEADLINES.forget(self.chat_id, tid)
+
+    def flush(self) -> int:
+        """Сериализовать изменённые задачи в store; вернуть их число."""
+        n = len(self._dirty)
+        for tid in self._dirty:
+            if tid in self.tasks:
+                self.store["tasks"][tid] = ser_task(self.tasks[tid])
+            elif tid in self.overdue:
+                self.store["overdue"][tid] = ser_task(self.overdue[tid])
+        self._dirty.clear()
+        return n
+
+    def requeue(self, events: List[Tuple[str, Optional[tuple]]]) -> None:
+        """Вернуть события take_events, которые не удалось записать."""
+        self._changed.update(tid for tid, _ in events)
+
+    def take_events(self) -> List[Tuple[str, Optional[tuple]]]:
+        """Итог изменений с прошлого вызова: (id, кортеж задачи) или (id, None) — удалена.
+        Вызывать после flush(): кортежи берутся из store."""
+        tasks, overdue = self.store["tasks"], self.store["overdue"]
+        out = [(tid, tasks.get(tid) or overdue.get(tid)) for tid in self._changed]
+        self._changed.clear()
+        return out
+
+_REPOS: Dict[int, TaskRepo] = {}
+
+def get_repo(context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> TaskRepo:
+    return repo_for(context.chat_data, chat_id)
+
+def repo_for(chat_data: Dict, chat_id: int) -> TaskRepo:
+    store = chat_store(chat_data, chat_id)
+    repo = _REPOS.get(chat_id)
+    if repo is None or repo.store is not store:
+        repo = _REPOS[chat_id] = TaskRepo(store, chat_id)
+        for t in repo.active():
+            DEADLINES.watch(chat_id, t, tz=repo.tz)
+    return repo
+
+def apply_task_events(store: Dict, events) -> None:
+    """Применить события take_events к tasks/overdue store: положить кортеж или удалить задачу."""
+    tasks, overdue = store["tasks"], store["overdue"]
+    for tid, d in events:
+        tasks.pop(tid, None)
+        overdue.pop(tid, None)
+        if d is not None:
+            (overdue if d[7] & F_OVERDUE else tasks)[tid] = d
+
+def flush_repo(chat_id: int) -> List[Tuple[str, Optional[tuple]]]:
+    """Сбросить изменённые задачи в store; вернуть события для журнала."""
+    repo = _REPOS.get(chat_id)
+    if repo is None:
+        return []
+    repo.flush()
+    return repo.take_events()
+
+class RepoPicklePersistence(PicklePersistence):
+    """PicklePersistence, которая перед записью сбрасывает изменённые задачи из TaskRepo
+    и при загрузке доводит chat_data всех чатов до STORE_VERSION.
+
+    Application делает deepcopy(chat_data) ещё до update_chat_data, то есть до
+    flush_repo, — в такой копии последних изменений задач нет. Они доносятся в
+    копию событиями flush_repo: кортежи задач неизменяемы, второй копии не нужно.
+    """
+
+    async def get_chat_data(self) -> Dict[int, Dict]:
+        data = await super().get_chat_data()
+        for chat_id, chat_data in data.items():
+            migrate_store(chat_data, chat_id)
+        return data
+
+    async def update_chat_data(self, chat_id: int, data: Dict) -> None:
+        events = flush_repo(chat_id)
+        if events:
+            apply_task_events(chat_store(data, chat_id), events)
+        await super().update_chat_data(chat_id, data)
+
+    async def flush(self) -> None:
+        t0 = perf_counter()
+        for chat_id in list(_REPOS):
+            events = flush_repo(chat_id)
+            if events and self.chat_data is not None and chat_id in self.chat_data:
+                apply_task_events(self.chat_data[chat_id], events)
+        await super().flush()
+        METRICS.observe("bot_persistence_flush_seconds", perf_counter() - t0, backend="pickle")
+
+class LazyChatData(dict):
+    """chat_data, который распаковывается из строки БД при первом обращении.
+
+    При старте Application получает по такому объекту на чат, не разбирая
+    pickle; наружу он ведёт себя как обычный dict и пишется как dict.
+    replay(self) вызывается сразу после распаковки — им SQLitePersistence
+    восстанавливает задачи из снимка и журнала. Без blob это просто пустой
+    chat_data: так его создаёт Application для новых чатов (ContextTypes).
+
+    deepcopy возвращает сам объект. Application копирует chat_data перед
+    каждым update_chat_data, а SQLitePersistence ссылку не хранит: задачи
+    загруженного чата берёт из TaskRepo, остальное сериализует сразу же.
+    Без этого каждое обновление копировало бы все задачи чата.
+    """
+    __slots__ = ("_blob", "_replay")
+
+    def __init__(self, blob: Optional[bytes] = None, replay: Optional[Callable[[Dict], None]] = None):
+        super().__init__()
+        self._blob = blob
+        self._replay = replay
+
+    @property
+    def loaded(self) -> bool:
+        return self._blob is None
+
+    def _load(self) -> None:
+        if self._blob is not None:
+            blob, self._blob = self._blob, None
+            dict.update(self, pickle.loads(blob))
+            replay, self._replay = self._replay, None
+            if replay is not None:
+                replay(self)
+
+    def __reduce__(self):
+        self._load()
+        return dict, (dict(self),)
+
+    def __deepcopy__(self, memo):
+        return self
+
+def _lazy_method(name: str):
+    method = getattr(dict, name)
+    def wrapper(self, *args, **kwargs):
+        self._load()
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    return wrapper
+
+for _name in ("__getitem__", "__setitem__", "__delitem__", "__contains__", "__iter__", "__len__", "__eq__",
+              "__repr__", "get", "setdefault", "pop", "popitem", "keys", "values", "items", "update", "clear", "copy"):
+    setattr(LazyChatData, _name, _lazy_method(_name))
+
+ALERT_NONE = -1  # alert_at: у чата нет предстоящих событий дедлайнов
+
+class SQLitePersistence(BasePersistence):
+    """Персистентность в SQLite (WAL): по строке на чат, пользователя и состояние диалога.
+
+    update_* пишет только ту строку, что пришла от Application, и пропускает
+    запись, если сериализованные данные не изменились с прошлого раза.
+    chat_data отдаётся лениво (LazyChatData), а рядом с ним хранится время
+    ближайшего события дедлайнов чата, чтобы при старте не распаковывать чаты
+    ради кучи дедлайнов.
+
+    Задачи загруженного чата в строку не входят: каждое изменение задачи —
+    одна строка журнала task_log (seq по чату, кортеж задачи или NULL —
+    удалена). Раз в TASK_LOG_SNAPSHOT событий задачи чата целиком пишутся
+    снимком в chat_data.tasks, а chat_data.log_seq запоминает, до какого seq
+    он дошёл. При распаковке чата к снимку применяются события после log_seq.
+    Строки без снимка (старый формат, импорт state.pkl) держат задачи в data.
+    """
+
+    def __init__(self, filepath: Path, update_interval: float = 60):
+        super().__init__(update_interval=update_interval)
+        self.filepath = Path(filepath)
+        self.db = sqlite3.connect(self.filepath, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS chat_data (chat_id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+            CREATE TABLE IF NOT EXISTS user_data (user_id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+            CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, data BLOB NOT NULL);
+            CREATE TABLE IF NOT EXISTS conversations (
+                name TEXT NOT NULL, key TEXT NOT NULL, state BLOB NOT NULL, PRIMARY KEY (name, key));
+        """)
+        if "alert_at" not in {row[1] for row in self.db.execute("PRAGMA table_info(chat_data)")}:
+            # минуты от эпохи (dt_to_min), ALERT_NONE — событий нет, NULL — неизвестно
+            self.db.execute("ALTER TABLE chat_data ADD COLUMN alert_at INTEGER")
+        if "tasks" not in {row[1] for row in self.db.execute("PRAGMA table_info(chat_data)")}:
+            # снимок (tasks, overdue) на момент log_seq; NULL — задачи лежат в data
+            self.db.execute("ALTER TABLE chat_data ADD COLUMN tasks BLOB")
+            self.db.execute("ALTER TABLE chat_data ADD COLUMN log_seq INTEGER NOT NULL DEFAULT 0")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS task_log (
+                chat_id INTEGER NOT NULL, seq INTEGER NOT NULL, at INTEGER NOT NULL,
+                task_id TEXT NOT NULL, data BLOB, PRIMARY KEY (chat_id, seq)) WITHOUT ROWID
+        """)
+        self._digests: Dict[Tuple[str, object], int] = {}
+        self._head: Dict[int, int] = {}            # последний seq журнала по чатам
+        self._snap: Dict[int, Optional[int]] = {}  # log_seq снимка; None — снимка нет
+
+    # --- служебное ---
+    def _dump(self, kind: str, ident, data) -> Optional[bytes]:
+        """Сериализовать; вернуть None, если данные не менялись с прошлой записи.
+        Записанным blob считается только после _saved — когда запись прошла."""
+        blob = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        if self._digests.get((kind, ident)) == hash(blob):
+            METRICS.inc("bot_persistence_skipped_total", kind=kind)
+            return None
+        return blob
+
+    def _saved(self, kind: str, ident, blob: bytes) -> None:
+        self._digests[(kind, ident)] = hash(blob)
+
+    def _load_rows(self, kind: str, sql: str) -> Dict:
+        out = {}
+        for ident, blob in self.db.execute(sql):
+            out[ident] = pickle.loads(blob)
+            self._digests[(kind, ident)] = hash(blob)
+        return out
+
+    def import_pickle(self, path: Path) -> int:
+        """Перенести состояние из файла PicklePersistence; вернуть число чатов."""
+        with Path(path).open("rb") as f:
+            data = pickle.load(f)
+        for chat_id, chat_data in data.get("chat_data", {}).items():
+            migrate_store(chat_data, chat_id)
+        p = pickle.HIGHEST_PROTOCOL
+        with self.db:
+            self.db.execute("BEGIN")
+            self.db.executemany("INSERT OR REPLACE INTO chat_data (chat_id, data) VALUES (?, ?)",
+                                ((cid, pickle.dumps(d, p)) for cid, d in data.get("chat_data", {}).items()))
+            self.db.executemany("INSERT OR REPLACE INTO user_data VALUES (?, ?)",
+                                ((uid, pickle.dumps(d, p)) for uid, d in data.get("user_data", {}).items()))
+            self.db.execute("INSERT OR REPLACE INTO kv VALUES ('bot_data', ?)",
+                            (pickle.dumps(data.get("bot_data", {}), p),))
+            for name, conv in (data.get("conversations") or {}).items():
+                self.db.executemany("INSERT OR REPLACE INTO conversations VALUES (?, ?, ?)",
+                                    ((name, json.dumps(list(k)), pickle.dumps(s, p))
+                                     for k, s in conv.items() if s is not None))
+        return len(data.get("chat_data", {}))
+
+    def is_empty(self) -> bool:
+        return not any(self.db.execute(f"SELECT 1 FROM {t} LIMIT 1").fetchone()
+                       for t in ("chat_data", "user_data", "kv", "conversations"))
+
+    # --- чтение ---
+    async def get_chat_data(self) -> Dict[int, Dict]:
+        out = {}
+        for chat_id, blob, log_seq, snap in self.db.execute(
+                "SELECT chat_id, data, log_seq, tasks IS NOT NULL FROM chat_data"):
+            self._snap[chat_id] = log_seq if snap else None
+            out[chat_id] = LazyChatData(blob, lambda data, c=chat_id, s=log_seq: self._replay(c, s, data))
+            self._digests[("chat", chat_id)] = hash(blob)
+        return out
+
+    def _replay(self, chat_id: int, log_seq: int, data: Dict) -> None:
+        """Восстановить задачи чата: снимок (если есть) плюс события журнала после log_seq."""
+        store = chat_store(data, chat_id)
+        if self._snap.get(chat_id) is not None:
+            (snap,) = self.db.execute("SELECT tasks FROM chat_data WHERE chat_id = ?", (chat_id,)).fetchone()
+            store["tasks"], store["overdue"] = pickle.loads(snap)
+        rows = self.db.execute("SELECT seq, task_id, data FROM task_log WHERE chat_id = ? AND seq > ? ORDER BY seq",
+                               (chat_id, log_seq)).fetchall()
+        apply_task_events(store, ((tid, None if blob is None else pickle.loads(blob)) for _, tid, blob in rows))
+        self._head[chat_id] = rows[-1][0] if rows else log_seq
+
+    def _log_head(self, chat_id: int) -> int:
+        head = self._head.get(chat_id)
+        if head is None:
+            row = self.db.execute("SELECT MAX(seq) FROM task_log WHERE chat_id = ?", (chat_id,)).fetchone()
+            head = self._head[chat_id] = max(row[0] or 0, self._snap.get(chat_id) or 0)
+        return head
+
+    def task_log(self, chat_id: int, task_id: Optional[str] = None, limit: int = 50) -> List[Tuple[int, datetime, str, Optional[Task]]]:
+        """Последние события журнала чата (новые первыми): seq, время, id и состояние задачи (None — удалена)."""
+        sql = "SELECT seq, at, task_id, data FROM task_log WHERE chat_id = ?"
+        args: tuple = (chat_id,)
+        if task_id is not None:
+            sql += " AND task_id = ?"
+            args += (task_id,)
+        rows = self.db.execute(sql + " ORDER BY seq DESC LIMIT ?", args + (limit,))
+        return [(seq, min_to_dt(at), tid, None if blob is None else deser_task(pickle.loads(blob)))
+                for seq, at, tid, blob in rows]
+
+    def alert_times(self) -> Dict[int, Optional[datetime]]:
+        """Ближайшее событие дедлайнов по чатам (серверное время), где оно известно (None — событий нет)."""
+        rows = self.db.execute("SELECT chat_id, alert_at FROM chat_data WHERE alert_at IS NOT NULL")
+        return {chat_id: None if m == ALERT_NONE else min_to_dt(m) for chat_id, m in rows}
+
+    def store_alert_times(self, alerts: Dict[int, Optional[datetime]]) -> None:
+        """Дописать alert_at чатам, не трогая их данные (None — событий нет)."""
+        with self.db:
+            self.db.execute("BEGIN")
+            self.db.executemany("UPDATE chat_data SET alert_at = ? WHERE chat_id = ?",
+                                ((ALERT_NONE if when is None else dt_to_min(when), chat_id)
+                                 for chat_id, when in alerts.items()))
+
+    async def get_user_data(self) -> Dict[int, Dict]:
+        return self._load_rows("user", "SELECT user_id, data FROM user_data")
+
+    async def get_bot_data(self) -> Dict:
+        return self._load_rows("kv", "SELECT key, data FROM kv WHERE key = 'bot_data'").get("bot_data", {})
+
+    async def get_callback_data(self):
+        return self._load_rows("kv", "SELECT key, data FROM kv WHERE key = 'callback_data'").get("callback_data")
+
+    async def get_conversations(self, name: str) -> Dict:
+        rows = self.db.execute("SELECT key, state FROM conversations WHERE name = ?", (name,))
+        return {tuple(json.loads(k)): pickle.loads(s) for k, s in rows}
+
+    # --- запись ---
+    async def update_chat_data(self, chat_id: int, data: Dict) -> None:
+        t0 = perf_counter()
+        events = flush_repo(chat_id)
+        repo = _REPOS.get(chat_id)
+        if repo is None:
+            if isinstance(data, LazyChatData) and not data.loaded:
+                return  # чат даже не распаковывался — в БД он тот же
+            # задачи чата не загружались — прежнее alert_at верно; задачи едут в data,
+            # снимок и журнал до текущего seq больше не нужны для распаковки
+            blob = self._dump("chat", chat_id, data)
+            if blob is None:
+                return
+            head = self._log_head(chat_id)
+            self.db.execute("INSERT INTO chat_data (chat_id, data, log_seq) VALUES (?, ?, ?) "
+                            "ON CONFLICT(chat_id) DO UPDATE SET data = excluded.data, tasks = NULL, "
+                            "log_seq = excluded.log_seq", (chat_id, blob, head))
+            self._saved("chat", chat_id, blob)
+            self._snap[chat_id] = None
+            self._written("chat", t0, blob)
+            return
+        store = repo.store
+        blob = self._dump("chat", chat_id, {k: v for k, v in store.items() if k not in ("tasks", "overdue")})
+        head = self._log_head(chat_id)
+        snap = self._snap.get(chat_id)
+        compact = snap is None or head + len(events) - snap >= TASK_LOG_SNAPSHOT
+        if blob is None and not events and not compact:
+            return
+        alert = repo.next_alert()
+        alert_at = ALERT_NONE if alert is None else dt_to_min(to_server(alert, repo.tz))
+        at = dt_to_min(datetime.now())
+        rows = [(chat_id, head + i, at, tid, None if d is None else pickle.dumps(d, pickle.HIGHEST_PROTOCOL))
+                for i, (tid, d) in enumerate(events, 1)]
+        head += len(rows)
+        try:
+            with self.db:
+                self.db.execute("BEGIN")
+                self.db.executemany("INSERT INTO task_log VALUES (?, ?, ?, ?, ?)", rows)
+                if blob is not None:
+                    self.db.execute("INSERT INTO chat_data (chat_id, data, alert_at) VALUES (?, ?, ?) "
+                                    "ON CONFLICT(chat_id) DO UPDATE SET data = excluded.data, alert_at = excluded.alert_at",
+                                    (chat_id, blob, alert_at))
+                else:
+                    self.db.execute("UPDATE chat_data SET alert_at = ? WHERE chat_id = ?", (alert_at, chat_id))
+                if compact:
+                    self.db.execute("UPDATE chat_data SET tasks = ?, log_seq = ? WHERE chat_id = ?",
+                                    (pickle.dumps((store["tasks"], store["overdue"]), pickle.HIGHEST_PROTOCOL), head, chat_id))
+                    self.db.execute("DELETE FROM task_log WHERE chat_id = ? AND seq <= ?", (chat_id, head - TASK_LOG_KEEP))
+        except sqlite3.Error:
+            repo.requeue(events)  # транзакция откатилась — события уйдут следующей записью
+            raise
+        if blob is not None:
+            self._saved("chat", chat_id, blob)
+        self._head[chat_id] = head
+        if compact:
+            self._snap[chat_id] = head
+        if rows:
+            METRICS.inc("bot_task_log_events_total", len(rows))
+        self._written("chat", t0, blob or b"")
+
+    def _written(self, kind: str, t0: float, blob: bytes) -> None:
+        METRICS.observe("bot_persistence_write_seconds", perf_counter() - t0, kind=kind)
+        METRICS.observe("bot_persistence_write_bytes", len(blob), kind=kind)
+
+    async def update_user_data(self, user_id: int, data: Dict) -> None:
+        t0 = perf_counter()
+        blob = self._dump("user", user_id, data)
+        if blob is not None:
+            self.db.execute("INSERT OR REPLACE INTO user_data VALUES (?, ?)", (user_id, blob))
+            self._saved("user", user_id, blob)
+            self._written("user", t0, blob)
+
+    async def update_bot_data(self, data: Dict) -> None:
+        t0 = perf_counter()
+        blob = self._dump("kv", "bot_data", data)
+        if blob is not None:
+            self.db.execute("INSERT OR REPLACE INTO kv VALUES ('bot_data', ?)", (blob,))
+            self._saved("kv", "bot_data", blob)
+            self._written("bot", t0, blob)
+
+    async def update_callback_data(self, data) -> None:
+        t0 = perf_counter()
+        blob = self._dump("kv", "callback_data", data)
+        if blob is not None:
+            self.db.execute("INSERT OR REPLACE INTO kv VALUES ('callback_data', ?)", (blob,))
+            self._saved("kv", "callback_data", blob)
+            self._written("callback", t0, blob)
+
+    async def update_conversation(self, name: str, key: Tuple[int, ...], new_state: Optional[object]) -> None:
+        k = json.dumps(list(key))
+        if new_state is None:
+            self.db.execute("DELETE FROM conversations WHERE name = ? AND key = ?", (name, k))
+        else:
+            self.db.execute("INSERT OR REPLACE INTO conversations VALUES (?, ?, ?)",
+                            (name, k, pickle.dumps(new_state, pickle.HIGHEST_PROTOCOL)))
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._digests.pop(("chat", chat_id), None)
+        self._head.pop(chat_id, None)
+        self._snap.pop(chat_id, None)
+        self.db.execute("DELETE FROM chat_data WHERE chat_id = ?", (chat_id,))
+        self.db.execute("DELETE FROM task_log WHERE chat_id = ?", (chat_id,))
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._digests.pop(("user", user_id), None)
+        self.db.execute("DELETE FROM user_data WHERE user_id = ?", (user_id,))
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        with METRICS.time("bot_persistence_flush_seconds", backend="sqlite"):
+            self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.db.close()
+
+def make_persistence() -> BasePersistence:
+    """Выбрать хранилище по STATE_BACKEND; при первом запуске SQLite импортировать state.pkl."""
+    if STATE_BACKEND == "pickle":
+        return RepoPicklePersistence(filepath=STATE_PICKLE_PATH)
+    persistence = SQLitePersistence(STATE_DB_PATH)
+    if persistence.is_empty() and STATE_PICKLE_PATH.exists():
+        n = persistence.import_pickle(STATE_PICKLE_PATH)
+        log.info("Импортировано чатов из %s: %d", STATE_PICKLE_PATH, n)
+    return persistence
 
 # ==================== Планирование ====================
-@dataclass
+@dataclass(slots=True)
 class PlanItem:
     start: datetime
     end: datetime
@@ -166,11 +1138,88 @@ def meals_for_day(day: datetime) -> List[Tuple[datetime, datetime, str]]:
         block(19, 0, 45, "Ужин"),
     ]
 
-def build_fixed_blocks(day: datetime, now: datetime, tasks: List[Task]) -> Tuple[List[PlanItem], List[Tuple[datetime, datetime]]]:
+class FreeSlots:
+    """Индекс свободного времени дня: отсортированные непересекающиеся интервалы.
+
+    Вырезание занятых блоков идёт через bisect, а кэш самого длинного
+    промежутка позволяет сразу отказать куску, который никуда не влезет.
+    """
+    __slots__ = ("starts", "ends", "_max_gap")
+
+    def __init__(self, start: datetime, end: datetime):
+        self.starts: List[datetime] = [start] if start < end else []
+        self.ends: List[datetime] = [end] if start < end else []
+        self._max_gap: Optional[timedelta] = None
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __bool__(self) -> bool:
+        return bool(self.starts)
+
+    def __iter__(self):
+        return iter(zip(self.starts, self.ends))
+
+    def carve(self, s: datetime, e: datetime) -> None:
+        """Убрать [s, e) из свободного времени."""
+        i = bisect_right(self.ends, s)    # первый интервал, заканчивающийся после s
+        j = bisect_left(self.starts, e)   # первый интервал, начинающийся не раньше e
+        if i >= j:
+            return
+        starts, ends = [], []
+        if self.starts[i] < s:
+            starts.append(self.starts[i]); ends.append(s)
+        if e < self.ends[j - 1]:
+            starts.append(e); ends.append(self.ends[j - 1])
+        self.starts[i:j] = starts
+        self.ends[i:j] = ends
+        self._max_gap = None
+
+    def max_gap(self) -> timedelta:
+        if self._max_gap is None:
+            self._max_gap = max((e - s for s, e in zip(self.starts, self.ends)), default=timedelta(0))
+        return self._max_gap
+
+    def take(self, minutes: int) -> Optional[Tuple[datetime, datetime]]:
+        """Первый подходящий (first-fit) интервал длиной minutes; занять его начало."""
+        need = timedelta(minutes=minutes)
+        if not self.starts or self.max_gap() < need:
+            return None
+        for i, (fs, fe) in enumerate(zip(self.starts, self.ends)):
+            if fe - fs >= need:
+                return self._take_at(i, need)
+        return None
+
+    def take_best(self, minutes: int) -> Optional[Tuple[datetime, datetime]]:
+        """Самый короткий подходящий (best-fit) интервал; занять его начало."""
+        need = timedelta(minutes=minutes)
+        if not self.starts or self.max_gap() < need:
+            return None
+        best, best_gap = -1, None
+        for i, (fs, fe) in enumerate(zip(self.starts, self.ends)):
+            gap = fe - fs
+            if gap >= need and (best_gap is None or gap < best_gap):
+                best, best_gap = i, gap
+                if gap == need:
+                    break
+        return self._take_at(best, need)
+
+    def _take_at(self, i: int, need: timedelta) -> Tuple[datetime, datetime]:
+        fs, fe = self.starts[i], self.ends[i]
+        e = fs + need
+        if e < fe:
+            self.starts[i] = e
+        else:
+            del self.starts[i], self.ends[i]
+        if fe - fs == self._max_gap:
+            self._max_gap = None
+        return fs, e
+
+def build_fixed_blocks(day: datetime, now: datetime, tasks: List[Task]) -> Tuple[List[PlanItem], FreeSlots]:
     day_start, day_end = day_window(day, now)
+    free = FreeSlots(day_start, day_end)
     if day_start >= day_end:
-        return [], []
-    free = [(day_start, day_end)]
+        return [], free
     items: List[PlanItem] = []
 
     fixed_blocks = []
@@ -187,10 +1236,11 @@ def build_fixed_blocks(day: datetime, now: datetime, tasks: List[Task]) -> Tuple
             e = min(t.fixed_end, day_end)
             fixed_blocks.append((s, e, t.title, t.id))
     # Постоянные задачи
+    wd = day.weekday()
     for t in tasks:
         if t.done or not t.constant or not t.dow or not t.constant_start_hm or not t.constant_end_hm:
             continue
-        if day.weekday() in t.dow:
+        if wd in t.dow:
             sh, sm = t.constant_start_hm
             eh, em = t.constant_end_hm
             s = day.replace(hour=sh, minute=sm, second=0, microsecond=0)
@@ -200,18 +1250,24 @@ def build_fixed_blocks(day: datetime, now: datetime, tasks: List[Task]) -> Tuple
 
     for s, e, label, tid in sorted(fixed_blocks, key=lambda x: x[0]):
         items.append(PlanItem(start=s, end=e, label=label, task_id=tid))
-        new_free = []
-        for fs, fe in free:
-            if e <= fs or s >= fe:
-                new_free.append((fs, fe))
-            else:
-                if fs < s:
-                    new_free.append((fs, s))
-                if e < fe:
-                    new_free.append((e, fe))
-        free = sorted(new_free, key=lambda p: p[0])
+        free.carve(s, e)
     return items, free
 
+def place_task(free: FreeSlots, items: List[PlanItem], t: Task) -> int:
+    """Разложить задачу кусками по свободному времени; вернуть размещённые минуты."""
+    need = t.duration_min
+    chunk = 120 if (t.effort == "extreme" and t.splittable) else need
+    placed = 0
+    while need > 0 and free:
+        part = min(chunk, need)
+        slot = free.take(part)
+        if slot is None:
+            break
+        items.append(PlanItem(slot[0], slot[1], t.title, t.id))
+        placed += part
+        need -= part
+    return placed
+
 def eligible_flex_for_day(day: datetime, now: datetime, tasks: List[Task]) -> List[Task]:
     day_end = day.replace(hour=DAY_END[0], minute=DAY_END[1], second=0, microsecond=0)
     out = []
@@ -226,45 +1282,200 @@ def eligible_flex_for_day(day: datetime, now: datetime, tasks: List[Task]) -> Li
             out.append(t)
     return sorted(out, key=lambda x: (-compute_score(now, x), x.duration_min))
 
-def plan_today_assign_once(day: datetime, now: datetime, tasks: List[Task], persist: bool) -> List[PlanItem]:
-    items, free = build_fixed_blocks(day, now, tasks)
-    flex = eligible_flex_for_day(day, now, tasks)
+# ==================== Стратегии размещения ====================
+MIN_CHUNK = 30          # короче куски делимой задачи не ставим
+BNB_MAX_TASKS = 12      # перебор — только для небольших дней
+BNB_MAX_NODES = 50000   # и с ограничением на число узлов
 
-    def place(minutes: int, label: str, tid: str) -> bool:
-        nonlocal free, items
-        for i, (fs, fe) in enumerate(free):
-            slot = int((fe - fs).total_seconds() // 60)
-            if slot >= minutes:
-                s = fs
-                e = fs + timedelta(minutes=minutes)
-                items.append(PlanItem(start=s, end=e, label=label, task_id=tid))
-                new_free = []
-                if e < fe:
-                    new_free.append((e, fe))
-                free = free[:i] + new_free + free[i+1:]
-                return True
-        return False
+class Scheduler:
+    """Стратегия размещения гибких задач; базовая — жадный first-fit.
+
+    Гибкие задачи приходят уже отсортированными по compute_score; стратегия
+    может переупорядочить их (order), выбрать отрезок (take), по-своему
+    делить задачу на куски (place) или разложить день целиком (plan_day).
+    """
+    name = "first-fit"
 
-    for t in flex:
+    def order(self, now: datetime, flex: List[Task]) -> List[Task]:
+        return flex
+
+    def take(self, free: FreeSlots, minutes: int) -> Optional[Tuple[datetime, datetime]]:
+        return free.take(minutes)
+
+    def place(self, free: FreeSlots, items: List[PlanItem], t: Task) -> int:
+        return place_task(free, items, t)
+
+    def plan_day(self, day: datetime, now: datetime, free: FreeSlots, items: List[PlanItem],
+                 flex: List[Task]) -> List[Task]:
+        """Разместить задачи в свободное время дня; вернуть размещённые."""
+        placed = []
+        for t in self.order(now, flex):
+            if not free:
+                break
+            if self.place(free, items, t) > 0:
+                placed.append(t)
+        return placed
+
+    def plan_week(self, days: List[datetime], now: datetime, free_map: Dict[date, FreeSlots],
+                  per_day: Dict[date, List[PlanItem]], flex: List[Task]) -> None:
+        """Каждую задачу — в первый день до дедлайна, где она хоть частично помещается."""
+        for t in self.order(now, flex):
+            last_day = min(days[-1], t.deadline_at) if t.deadline_at else days[-1]
+            for day in days:
+                if day > last_day:
+                    break
+                key = day.date()
+                if self.place(free_map[key], per_day[key], t) > 0:
+                    t.planned_for = day.strftime("%Y-%m-%d")
+                    break
+
+class GapFill(Scheduler):
+    """first-fit, но делимые задачи (любой сложности) режутся по размеру дыр, а не
+    фиксированными кусками; «extreme» — не дольше 2 часов подряд."""
+    name = "gap-fill"
+
+    def place(self, free: FreeSlots, items: List[PlanItem], t: Task) -> int:
         need = t.duration_min
-        chunk = 120 if (t.effort == "extreme" and t.splittable) else need
-        placed_total = 0
+        cap = 120 if t.effort == "extreme" and t.splittable else need
+        if t.splittable:
+            # резать имеет смысл, только если дыры дня вмещают задачу целиком,
+            # иначе лучше целиком в другой день, чем кусок без продолжения
+            minute = timedelta(minutes=1)
+            shortest = min(MIN_CHUNK, need)
+            if sum(g for g in ((fe - fs) // minute for fs, fe in free) if g >= shortest) < need:
+                return 0
+        placed = 0
         while need > 0 and free:
-            part = min(chunk, need)
-            if not place(part, t.title, t.id):
-                break
-            placed_total += part
+            part = min(cap, need)
+            slot = self.take(free, part)
+            if slot is None:
+                if not t.splittable:
+                    break
+                part = min(part, free.max_gap() // timedelta(minutes=1))
+                if part < min(MIN_CHUNK, need):
+                    break
+                slot = self.take(free, part)
+            items.append(PlanItem(slot[0], slot[1], t.title, t.id))
+            placed += part
             need -= part
-        if placed_total > 0 and persist:
+        return placed
+
+class BestFit(GapFill):
+    """Каждый кусок — в самую короткую подходящую дыру: длинные остаются для длинных задач."""
+    name = "best-fit"
+
+    def take(self, free: FreeSlots, minutes: int) -> Optional[Tuple[datetime, datetime]]:
+        return free.take_best(minutes)
+
+class EdfSlack(GapFill):
+    """Earliest deadline first; при равных дедлайнах раньше идёт задача с меньшим запасом
+    (время до дедлайна минус длительность)."""
+    name = "edf"
+
+    def order(self, now: datetime, flex: List[Task]) -> List[Task]:
+        def key(t: Task):
+            if t.deadline_at is None:
+                return (datetime.max, 0)
+            return (t.deadline_at, (t.deadline_at - now) // timedelta(minutes=1) - t.duration_min)
+        return sorted(flex, key=key)
+
+class BranchAndBound(BestFit):
+    """Для небольших дней — точная упаковка задач целиком по дырам (ветви и границы).
+
+    Максимизируются занятые минуты, причём задачи, для которых этот день —
+    последний до дедлайна, весят в 10 раз больше. Перебор ограничен
+    BNB_MAX_NODES узлами; не вошедшие задачи доразмещаются как в best-fit.
+    В неделе дни заполняются по порядку, каждый — своим перебором.
+    """
+    name = "bnb"
+
+    def plan_day(self, day: datetime, now: datetime, free: FreeSlots, items: List[PlanItem],
+                 flex: List[Task]) -> List[Task]:
+        if len(flex) > BNB_MAX_TASKS or not free:
+            return super().plan_day(day, now, free, items, flex)
+        minute = timedelta(minutes=1)
+        caps = [(fe - fs) // minute for fs, fe in free]
+        starts = [fs for fs, _ in free]
+        last_chance = day + timedelta(days=1)
+        cand = sorted((t for t in flex if 0 < t.duration_min <= max(caps)), key=lambda t: -t.duration_min)
+        dur = [t.duration_min for t in cand]
+        val = [t.duration_min * (10 if t.deadline_at and t.deadline_at < last_chance else 1) for t in cand]
+        rest = [0] * (len(cand) + 1)
+        for i in range(len(cand) - 1, -1, -1):
+            rest[i] = rest[i + 1] + val[i]
+
+        best = [0, [-1] * len(cand)]
+        assign = [-1] * len(cand)
+        nodes = 0
+
+        def dfs(i: int, got: int) -> None:
+            nonlocal nodes
+            nodes += 1
+            if got > best[0]:
+                best[0], best[1] = got, assign[:]
+            if i == len(cand) or nodes > BNB_MAX_NODES or got + rest[i] <= best[0]:
+                return
+            tried = set()
+            for j, cap in enumerate(caps):
+                if cap >= dur[i] and cap not in tried:  # дыры с равным остатком равноценны
+                    tried.add(cap)
+                    caps[j] -= dur[i]
+                    assign[i] = j
+                    dfs(i + 1, got + val[i])
+                    caps[j] += dur[i]
+            assign[i] = -1
+            dfs(i + 1, got)
+
+        dfs(0, 0)
+        chosen = {id(t): j for t, j in zip(cand, best[1]) if j >= 0}
+        cursor = list(starts)
+        placed = []
+        for t in flex:  # внутри дыры — в порядке приоритета
+            j = chosen.get(id(t))
+            if j is None:
+                continue
+            s, e = cursor[j], cursor[j] + timedelta(minutes=t.duration_min)
+            cursor[j] = e
+            free.carve(s, e)
+            items.append(PlanItem(s, e, t.title, t.id))
+            placed.append(t)
+        for t in flex:
+            if id(t) not in chosen and free and self.place(free, items, t) > 0:
+                placed.append(t)
+        return placed
+
+    def plan_week(self, days: List[datetime], now: datetime, free_map: Dict[date, FreeSlots],
+                  per_day: Dict[date, List[PlanItem]], flex: List[Task]) -> None:
+        left = list(flex)
+        for day in days:
+            key = day.date()
+            cand = [t for t in left if not t.deadline_at or day <= t.deadline_at]
+            placed = {id(t) for t in self.plan_day(day, now, free_map[key], per_day[key], cand)}
+            for t in cand:
+                if id(t) in placed:
+                    t.planned_for = day.strftime("%Y-%m-%d")
+            left = [t for t in left if id(t) not in placed]
+
+SCHEDULERS: Dict[str, Scheduler] = {s.name: s for s in (Scheduler(), GapFill(), BestFit(), EdfSlack(), BranchAndBound())}
+SCHEDULER = SCHEDULERS.get(PLANNER, SCHEDULERS["first-fit"])
+
+def plan_today_assign_once(day: datetime, now: datetime, tasks: List[Task], persist: bool,
+                           scheduler: Optional[Scheduler] = None) -> List[PlanItem]:
+    items, free = build_fixed_blocks(day, now, tasks)
+    flex = eligible_flex_for_day(day, now, tasks)
+    placed = (scheduler or SCHEDULER).plan_day(day, now, free, items, flex)
+    if persist:
+        for t in placed:
             t.planned_for = day.strftime("%Y-%m-%d")
-
     return sorted(items, key=lambda x: x.start)
 
-def plan_week_without_dup(start_day: datetime, now: datetime, tasks: List[Task]) -> Dict[str, List[PlanItem]]:
-    tasks_copy = [copy.deepcopy(t) for t in tasks]
+def plan_week_without_dup(start_day: datetime, now: datetime, tasks: List[Task],
+                          scheduler: Optional[Scheduler] = None) -> Dict[str, List[PlanItem]]:
+    # планирование меняет только planned_for, поэтому хватает поверхностной копии
+    tasks_copy = [copy.copy(t) for t in tasks]
     days = [(start_day + timedelta(days=i)).replace(hour=12, minute=0, second=0, microsecond=0) for i in range(7)]
     per_day: Dict[datetime.date, List[PlanItem]] = {}
-    free_map: Dict[datetime.date, List[Tuple[datetime, datetime]]] = {}
+    free_map: Dict[datetime.date, FreeSlots] = {}
 
     for day in days:
         items, free = build_fixed_blocks(day, now, tasks_copy)
@@ -273,41 +1484,7 @@ def plan_week_without_dup(start_day: datetime, now: datetime, tasks: List[Task])
 
     flex = [t for t in tasks_copy if not t.done and not t.constant and not (t.fixed_start and t.fixed_end) and t.auto and not t.overdue]
     flex = sorted(flex, key=lambda x: (-compute_score(now, x), x.duration_min))
-
-    for t in flex:
-        last_day = min(days[-1], t.deadline_at) if t.deadline_at else days[-1]
-        for day in days:
-            if day > last_day:
-                break
-            key = day.date()
-            free = free_map[key]
-            def place(minutes: int) -> bool:
-                nonlocal free
-                for i, (fs, fe) in enumerate(free):
-                    slot = int((fe - fs).total_seconds() // 60)
-                    if slot >= minutes:
-                        s = fs
-                        e = fs + timedelta(minutes=minutes)
-                        per_day[key].append(PlanItem(s, e, t.title, t.id))
-                        new_free = []
-                        if e < fe:
-                            new_free.append((e, fe))
-                        free = free[:i] + new_free + free[i+1:]
-                        free_map[key] = free
-                        return True
-                return False
-            need = t.duration_min
-            chunk = 120 if (t.effort == "extreme" and t.splittable) else need
-            placed = 0
-            while need > 0 and free:
-                part = min(chunk, need)
-                if not place(part):
-                    break
-                placed += part
-                need -= part
-            if placed > 0:
-                t.planned_for = day.strftime("%Y-%m-%d")
-                break
+    (scheduler or SCHEDULER).plan_week(days, now, free_map, per_day, flex)
 
     result = {}
     for day in days:
@@ -315,6 +1492,532 @@ def plan_week_without_dup(start_day: datetime, now: datetime, tasks: List[Task])
         result[day.strftime("%a %d.%m")] = items
     return result
 
+class PlanCache:
+    """Готовые планы по (чат, вид); запись годна, пока не сменились день, сам
+    репозиторий (repo_for пересоздаёт его при смене store) и его версия.
+
+    Все пути мутаций (добавление, готово/авто/удалить, просроченные, новый
+    дедлайн, перенос в просроченные) идут через TaskRepo и поднимают его
+    версию, так что отдельная инвалидация не нужна.
+    """
+
+    def __init__(self):
+        self.entries: Dict[Tuple[int, str], Tuple[date, Tuple[int, int], object]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, repo: TaskRepo, kind: str, day: date):
+        e = self.entries.get((repo.chat_id, kind))
+        if e is not None and e[0] == day and e[1] == (repo.serial, repo.version):
+            self.hits += 1
+            return e[2]
+        self.misses += 1
+        return None
+
+    def put(self, repo: TaskRepo, kind: str, day: date, value) -> None:
+        self.entries[(repo.chat_id, kind)] = (day, (repo.serial, repo.version), value)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
+
+PLAN_CACHE = PlanCache()
+
+def plan_today_for(repo: TaskRepo, now: datetime) -> List[PlanItem]:
+    """План на сегодня с сохранением назначенных дат в репозитории."""
+    plan = PLAN_CACHE.get(repo, "today", now.date())
+    if plan is not None:
+        return plan
+    return _plan_today_inline(repo, now)
+
+def _plan_today_inline(repo: TaskRepo, now: datetime) -> List[PlanItem]:
+    """Расчёт плана на сегодня в этом процессе; кэш уже проверен вызывающим."""
+    tasks = repo.active()
+    before = [t.planned_for for t in tasks]
+    with METRICS.time("bot_planner_seconds", kind="today", tasks=size_class(len(tasks)), where="inline"):
+        plan = plan_today_assign_once(now, now, tasks, persist=True)
+    for t, was in zip(tasks, before):
+        if t.planned_for != was:
+            repo.touch(t)
+    PLAN_CACHE.put(repo, "today", now.date(), plan)
+    return plan
+
+def plan_week_for(repo: TaskRepo, now: datetime) -> Dict[str, List[PlanItem]]:
+    week = PLAN_CACHE.get(repo, "week", now.date())
+    if week is None:
+        week = _plan_week_inline(repo, now)
+    return week
+
+def _plan_week_inline(repo: TaskRepo, now: datetime) -> Dict[str, List[PlanItem]]:
+    start_day = now.replace(hour=12, minute=0, second=0, microsecond=0)
+    tasks = repo.active()
+    with METRICS.time("bot_planner_seconds", kind="week", tasks=size_class(len(tasks)), where="inline"):
+        week = plan_week_without_dup(start_day, now, tasks)
+    PLAN_CACHE.put(repo, "week", now.date(), week)
+    return week
+
+def plan_today_batch(repos: List[TaskRepo], now: datetime) -> Dict[int, List[PlanItem]]:
+    """Планы на сегодня сразу для многих чатов (утренняя волна).
+
+    Правила те же, что у plan_today_for, но всё считается в целых минутах от
+    начала окна дня: занятость всех чатов — одна матрица минут, из неё
+    вектором выделяются свободные отрезки; оценки гибких задач всех чатов —
+    один вектор, порядок — один lexsort; first-fit идёт раундами, в каждом
+    раунде каждый чат пробует разместить очередной кусок своей задачи.
+    now должен быть кратен минуте — тогда план совпадает с поштучным.
+    """
+    if _numpy() is None or SCHEDULER.name != "first-fit":  # пакетом считается только first-fit
+        return {repo.chat_id: plan_today_for(repo, now) for repo in repos}
+    out: Dict[int, List[PlanItem]] = {}
+    todo: List[TaskRepo] = []
+    for repo in repos:
+        plan = PLAN_CACHE.get(repo, "today", now.date())
+        if plan is None:
+            todo.append(repo)
+        else:
+            out[repo.chat_id] = plan
+    if not todo:
+        return out
+
+    minute = timedelta(minutes=1)
+    day_start, day_end = day_window(now, now)
+    width = (day_end - day_start) // minute
+    if width <= 0:
+        for repo in todo:
+            PLAN_CACHE.put(repo, "today", now.date(), [])
+            out[repo.chat_id] = []
+        return out
+    stamps = [day_start + timedelta(minutes=m) for m in range(width + 1)]
+    ws_mod = day_start.hour * 60 + day_start.minute
+    wd = now.weekday()
+    today = now.strftime("%Y-%m-%d")
+    last_end = now.replace(hour=DAY_END[0], minute=DAY_END[1], second=0, microsecond=0)
+    meals = [((max(s, day_start) - day_start) // minute, (min(e, day_end) - day_start) // minute, label, None)
+             for s, e, label in meals_for_day(now) if e > day_start and s < day_end]
+
+    # 1. фиксированные блоки и кандидаты на гибкое размещение, в целых минутах
+    items_of: List[List[PlanItem]] = []
+    carve_c, carve_s, carve_e = [], [], []
+    flex: List[Task] = []
+    chat_ix, left, effort, duration = [], [], [], []
+    for c, repo in enumerate(todo):
+        fixed, const = [], []
+        for t in repo.active():
+            if t.done:
+                continue
+            if t.fixed_start and t.fixed_end and t.fixed_end > day_start and t.fixed_start < day_end:
+                fixed.append(((max(t.fixed_start, day_start) - day_start) // minute,
+                              (min(t.fixed_end, day_end) - day_start) // minute, t.title, t.id))
+            if t.constant:
+                if t.dow and t.constant_start_hm and t.constant_end_hm and wd in t.dow:
+                    cs = t.constant_start_hm[0] * 60 + t.constant_start_hm[1] - ws_mod
+                    ce = t.constant_end_hm[0] * 60 + t.constant_end_hm[1] - ws_mod
+                    if ce > cs and ce > 0 and cs < width:
+                        const.append((max(cs, 0), min(ce, width), t.title, t.id))
+                continue
+            if (t.fixed_start and t.fixed_end) or not t.auto or t.overdue:
+                continue
+            if t.deadline_at and t.deadline_at < last_end:
+                continue
+            if t.planned_for is None or t.planned_for <= today:
+                flex.append(t)
+                chat_ix.append(c)
+                left.append((t.deadline_at - now) // minute)
+                effort.append(_EFFORT_CODE.get(t.effort, 1))
+                duration.append(t.duration_min)
+        blocks = sorted(meals + fixed + const, key=lambda x: x[0])
+        items_of.append([PlanItem(stamps[bs], stamps[be], label, tid) for bs, be, label, tid in blocks])
+        for bs, be, _, _ in blocks:
+            if bs < be:
+                carve_c.append(c); carve_s.append(bs); carve_e.append(be)
+
+    # 2. матрица занятых минут -> свободные отрезки (начало, длина), по строке на чат
+    n_chats = len(todo)
+    diff = np.zeros((n_chats, width + 1), dtype=np.int32)
+    np.add.at(diff, (np.array(carve_c, dtype=np.int64), np.array(carve_s, dtype=np.int64)), 1)
+    np.add.at(diff, (np.array(carve_c, dtype=np.int64), np.array(carve_e, dtype=np.int64)), -1)
+    busy = np.ones((n_chats, width + 2), dtype=bool)
+    busy[:, 1:-1] = np.cumsum(diff[:, :width], axis=1) > 0
+    rows, cols = np.nonzero(busy[:, 1:] != busy[:, :-1])
+    rows, starts, lens = rows[0::2], cols[0::2], cols[1::2] - cols[0::2]
+    per_row = np.bincount(rows, minlength=n_chats)
+    width_k = int(per_row.max()) if len(rows) else 0
+    slot = np.arange(len(rows)) - (np.cumsum(per_row) - per_row)[rows]
+    free_s = np.zeros((n_chats, width_k), dtype=np.int64)
+    free_l = np.zeros((n_chats, width_k), dtype=np.int64)
+    free_s[rows, slot] = starts
+    free_l[rows, slot] = lens
+
+    # 3. порядок: по чату, затем по убыванию оценки, затем по длительности
+    n = len(flex)
+    chat_arr = np.array(chat_ix, dtype=np.int64)
+    dur_arr = np.array(duration, dtype=np.int64)
+    weights = np.array([effort_weight(e) for e in EFFORTS])
+    score = 1.0 / np.maximum(1.0, np.array(left, dtype=np.float64)) + weights[np.array(effort, dtype=np.int64)]
+    order = np.lexsort((np.arange(n), dur_arr, -score, chat_arr))
+    o_chat, o_dur = chat_arr[order], dur_arr[order]
+    o_chunk = np.array([120 if (t.effort == "extreme" and t.splittable) else t.duration_min
+                        for t in (flex[i] for i in order.tolist())], dtype=np.int64)
+    ptr = np.searchsorted(o_chat, np.arange(n_chats), side="left")
+    end = np.searchsorted(o_chat, np.arange(n_chats), side="right")
+    need = np.zeros(n_chats, dtype=np.int64)
+    has = ptr < end
+    need[has] = o_dur[ptr[has]]
+
+    # 4. first-fit раундами: каждый активный чат размещает очередной кусок
+    placed = np.zeros(n, dtype=bool)
+    log: List[Tuple] = []
+    while width_k:
+        act = np.flatnonzero(ptr < end)
+        if not len(act):
+            break
+        ti = ptr[act]
+        part = np.minimum(o_chunk[ti], need[act])
+        fit = free_l[act] >= part[:, None]
+        ok = fit.any(axis=1) & (part > 0)
+        k = fit.argmax(axis=1)[ok]
+        a_ok, p_ok = act[ok], part[ok]
+        log.append((a_ok, ti[ok], free_s[a_ok, k], p_ok))
+        free_s[a_ok, k] += p_ok
+        free_l[a_ok, k] -= p_ok
+        need[a_ok] -= p_ok
+        placed[ti[ok]] = True
+        adv = act[~ok | (need[act] == 0)]
+        ptr[adv] += 1
+        nxt = adv[ptr[adv] < end[adv]]
+        need[nxt] = o_dur[ptr[nxt]]
+
+    ordered = [flex[i] for i in order.tolist()]
+    for a_ok, t_ok, s_ok, p_ok in log:
+        for c, i, st, p in zip(a_ok.tolist(), t_ok.tolist(), s_ok.tolist(), p_ok.tolist()):
+            t = ordered[i]
+            items_of[c].append(PlanItem(stamps[st], stamps[st + p], t.title, t.id))
+
+    changed: List[List[Task]] = [[] for _ in todo]
+    for i in np.flatnonzero(placed).tolist():
+        t = ordered[i]
+        if t.planned_for != today:
+            t.planned_for = today
+            changed[chat_ix[order[i]]].append(t)
+
+    for c, repo in enumerate(todo):
+        for t in changed[c]:
+            repo.touch(t)
+        plan = sorted(items_of[c], key=lambda x: x.start)
+        PLAN_CACHE.put(repo, "today", now.date(), plan)
+        out[repo.chat_id] = plan
+    return out
+
+# ==================== Пул планирования ====================
+# Снимок для пула — кортежи ser_task: компактно и без ссылок на живые объекты.
+def _plan_today_remote(snapshot: tuple, now: datetime) -> Tuple[list, list]:
+    tasks = [deser_task(d) for d in snapshot]
+    before = [t.planned_for for t in tasks]
+    plan = plan_today_assign_once(now, now, tasks, persist=True)
+    return ([(it.start, it.end, it.label, it.task_id) for it in plan],
+            [(t.id, t.planned_for) for t, was in zip(tasks, before) if t.planned_for != was])
+
+def _plan_week_remote(snapshot: tuple, start_day: datetime, now: datetime) -> Dict[str, list]:
+    week = plan_week_without_dup(start_day, now, [deser_task(d) for d in snapshot])
+    return {day: [(it.start, it.end, it.label, it.task_id) for it in items] for day, items in week.items()}
+
+class PlanPool:
+    """Ленивый ProcessPoolExecutor для тяжёлого планирования.
+
+    Процессы запускаются через spawn: форк процесса с работающим event loop
+    и потоками httpx небезопасен.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.offloaded = 0
+
+    async def run(self, fn, *args):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        self.offloaded += 1
+        return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+PLAN_POOL = PlanPool(PLAN_WORKERS)
+
+def snapshot_repo(repo: TaskRepo) -> tuple:
+    """Активные задачи в порядке репозитория, уже сериализованные (после flush — без пересборки)."""
+    repo.flush()
+    return tuple(repo.store["tasks"][tid] for tid in repo.tasks)
+
+async def plan_today_async(repo: TaskRepo, now: datetime) -> List[PlanItem]:
+    """plan_today_for, но большие наборы задач считаются в пуле процессов."""
+    plan = PLAN_CACHE.get(repo, "today", now.date())
+    if plan is not None:
+        return plan
+    if len(repo.tasks) < PLAN_OFFLOAD_MIN_TASKS:
+        return _plan_today_inline(repo, now)
+    version = repo.version
+    with METRICS.time("bot_planner_seconds", kind="today", tasks=size_class(len(repo.tasks)), where="pool"):
+        rows, changes = await PLAN_POOL.run(_plan_today_remote, snapshot_repo(repo), now)
+    plan = [PlanItem(*row) for row in rows]
+    if repo.version == version:  # за время расчёта задачи не менялись — результат можно закрепить
+        for tid, planned_for in changes:
+            t = repo.tasks.get(tid)
+            if t is not None:
+                t.planned_for = planned_for
+                repo.touch(t)
+        PLAN_CACHE.put(repo, "today", now.date(), plan)
+    return plan
+
+async def plan_week_async(repo: TaskRepo, now: datetime) -> Dict[str, List[PlanItem]]:
+    week = PLAN_CACHE.get(repo, "week", now.date())
+    if week is not None:
+        return week
+    if len(repo.tasks) < PLAN_OFFLOAD_MIN_TASKS:
+        return _plan_week_inline(repo, now)
+    version = repo.version
+    start_day = now.replace(hour=12, minute=0, second=0, microsecond=0)
+    with METRICS.time("bot_planner_seconds", kind="week", tasks=size_class(len(repo.tasks)), where="pool"):
+        rows = await PLAN_POOL.run(_plan_week_remote, snapshot_repo(repo), start_day, now)
+    week = {day: [PlanItem(*row) for row in items] for day, items in rows.items()}
+    if repo.version == version:
+        PLAN_CACHE.put(repo, "week", now.date(), week)
+    return week
+
+class LoopLag:
+    """Задержка пробуждения event loop: сколько он был занят синхронным кодом.
+
+    Фоновая корутина засыпает на interval и меряет, насколько позже
+    проснулась; задержки раскладываются по корзинам гистограммы.
+    """
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, float("inf"))
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.reset()
+
+    def reset(self) -> None:
+        self.counts = [0] * len(self.BUCKETS)
+        self.samples = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, lag: float) -> None:
+        self.counts[bisect_left(self.BUCKETS, lag)] += 1
+        self.samples += 1
+        self.total += lag
+        self.max = max(self.max, lag)
+
+    def quantile(self, q: float) -> float:
+        """Верхняя граница корзины, в которую попадает квантиль q."""
+        need = q * self.samples
+        seen = 0
+        for bound, n in zip(self.BUCKETS, self.counts):
+            seen += n
+            if seen >= need:
+                return bound
+        return self.BUCKETS[-1]
+
+    def stats(self) -> Dict[str, float]:
+        return {"samples": self.samples, "mean": self.total / self.samples if self.samples else 0.0,
+                "p99": self.quantile(0.99) if self.samples else 0.0, "max": self.max}
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            t0 = monotonic()
+            await asyncio.sleep(self.interval)
+            self.observe(max(0.0, monotonic() - t0 - self.interval))
+
+LOOP_LAG = LoopLag()
+
+# ==================== Метрики ====================
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Metrics:
+    """Реестр метрик: счётчики и гистограммы с метками, плюс значения, которые
+    читаются из объектов бота в момент запроса. Отдаётся текстом Prometheus.
+    """
+
+    def __init__(self):
+        self.meta: Dict[str, Tuple[str, str, Optional[tuple]]] = {}  # имя -> (тип, описание, корзины)
+        self.counters: Dict[Tuple[str, tuple], float] = {}
+        self.histograms: Dict[Tuple[str, tuple], Histogram] = {}
+        self.readers: Dict[str, Tuple[Optional[str], Callable]] = {}  # имя -> (метка, функция)
+
+    def counter(self, name: str, text: str) -> None:
+        self.meta[name] = ("counter", text, None)
+
+    def histogram(self, name: str, text: str, buckets: tuple = LATENCY_BUCKETS) -> None:
+        self.meta[name] = ("histogram", text, buckets)
+
+    def gauge(self, name: str, text: str, fn: Callable, label: Optional[str] = None, kind: str = "gauge") -> None:
+        """fn() возвращает число, а если задана метка label — словарь {значение метки: число}."""
+        self.meta[name] = (kind, text, None)
+        self.readers[name] = (label, fn)
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        h = self.histograms.get(key)
+        if h is None:
+            h = self.histograms[key] = Histogram(self.meta[name][2])
+        h.observe(value)
+
+    @contextmanager
+    def time(self, name: str, **labels):
+        t0 = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - t0, **labels)
+
+    def render(self) -> str:
+        def fmt(labels) -> str:
+            return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else ""
+        by_name: Dict[str, List[str]] = {name: [] for name in self.meta}
+        for (name, labels), v in self.counters.items():
+            by_name[name].append(f"{name}{fmt(labels)} {v:g}")
+        for (name, labels), h in self.histograms.items():
+            lines = by_name[name]
+            seen = 0
+            for bound, n in zip(h.bounds + (float("inf"),), h.counts):
+                seen += n
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f"{name}_bucket{fmt(labels + (('le', le),))} {seen}")
+            lines.append(f"{name}_sum{fmt(labels)} {h.sum:g}")
+            lines.append(f"{name}_count{fmt(labels)} {h.count}")
+        for name, (label, fn) in self.readers.items():
+            try:
+                value = fn()
+            except Exception:
+                continue
+            if label is None:
+                by_name[name].append(f"{name} {value:g}")
+            else:
+                by_name[name].extend(f"{name}{fmt(((label, k),))} {v:g}" for k, v in value.items())
+        out = []
+        for name, lines in by_name.items():
+            if lines:
+                kind, text, _ = self.meta[name]
+                out += [f"# HELP {name} {text}", f"# TYPE {name} {kind}", *lines]
+        return "\n".join(out) + "\n"
+
+def size_class(n: int) -> str:
+    """Метка размера набора задач для гистограмм планировщика."""
+    for bound in (10, 100, 1000, 10000):
+        if n <= bound:
+            return f"<={bound}"
+    return ">10000"
+
+METRICS = Metrics()
+METRICS.histogram("bot_handler_seconds", "Время обработчика обновления")
+METRICS.histogram("bot_planner_seconds", "Время построения плана (where: inline, pool, batch)")
+METRICS.histogram("bot_persistence_write_seconds", "Время записи строки состояния (SQLite)")
+METRICS.histogram("bot_persistence_write_bytes", "Размер записанной строки состояния", BYTES_BUCKETS)
+METRICS.counter("bot_persistence_skipped_total", "Записи, пропущенные из-за неизменившихся данных")
+METRICS.histogram("bot_persistence_flush_seconds", "Время flush хранилища")
+METRICS.counter("bot_telegram_calls_total", "Запросы к Bot API")
+METRICS.counter("bot_telegram_retries_total", "Повторы после RetryAfter")
+METRICS.counter("bot_telegram_errors_total", "Запросы к Bot API, завершившиеся ошибкой")
+METRICS.histogram("bot_telegram_seconds", "Время запроса к Bot API без ожидания лимитера")
+METRICS.histogram("bot_job_lag_seconds", "Опоздание срабатывания задания JobQueue")
+METRICS.gauge("bot_loop_lag_seconds", "Задержка event loop", lambda: {k: v for k, v in LOOP_LAG.stats().items() if k != "samples"}, label="stat")
+METRICS.gauge("bot_plan_cache_total", "Обращения к кэшу планов", lambda: {"hit": PLAN_CACHE.hits, "miss": PLAN_CACHE.misses},
+              label="result", kind="counter")
+METRICS.gauge("bot_plan_offloaded_total", "Планы, посчитанные в пуле процессов", lambda: PLAN_POOL.offloaded, kind="counter")
+METRICS.gauge("bot_chats_loaded", "Чаты с загруженными задачами", lambda: len(_REPOS))
+METRICS.gauge("bot_deadline_heap_size", "Записей в куче дедлайнов", lambda: len(DEADLINES.heap))
+
+def timed_handler(callback):
+    """Обёртка обработчика, которая пишет его время в bot_handler_seconds."""
+    name = callback.__name__
+
+    @wraps(callback)
+    async def wrapper(update, context):
+        t0 = perf_counter()
+        try:
+            return await callback(update, context)
+        finally:
+            METRICS.observe("bot_handler_seconds", perf_counter() - t0, handler=name)
+    return wrapper
+
+def instrument_handlers(app: Application) -> None:
+    """Обернуть таймером все обработчики приложения, включая шаги диалогов."""
+    def walk(handlers) -> None:
+        for h in handlers:
+            if isinstance(h, ConversationHandler):
+                walk(h.entry_points)
+                for step in h.states.values():
+                    walk(step)
+                walk(h.fallbacks)
+            else:
+                h.callback = timed_handler(h.callback)
+    for handlers in app.handlers.values():
+        walk(handlers)
+
+_METRICS_RUNNER = None
+
+async def start_metrics_server() -> None:
+    """Поднять /metrics на METRICS_HOST:METRICS_PORT (aiohttp)."""
+    global _METRICS_RUNNER
+    if not METRICS_PORT or _METRICS_RUNNER is not None:
+        return
+    from aiohttp import web
+
+    async def metrics(request: web.Request) -> web.Response:
+        return web.Response(text=METRICS.render(), content_type="text/plain", charset="utf-8")
+
+    web_app = web.Application()
+    web_app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(web_app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    except OSError as exc:
+        log.warning("Метрики не подняты на %s:%s: %s", METRICS_HOST, METRICS_PORT, exc)
+        await runner.cleanup()
+        return
+    _METRICS_RUNNER = runner
+
+async def stop_metrics_server() -> None:
+    global _METRICS_RUNNER
+    if _METRICS_RUNNER is not None:
+        await _METRICS_RUNNER.cleanup()
+        _METRICS_RUNNER = None
+
 # ==================== Форматирование ====================
 def hmm(dt: timedelta) -> str:
     total_min = int(dt.total_seconds() // 60)
@@ -326,37 +2029,49 @@ def time_left_str(now: datetime, to: datetime) -> str:
         return "00:00"
     return hmm(to - now)
 
+# Готовый текст кэшируется по содержимому: ключ — кортеж полей, которые попадают в вывод.
 def fmt_plan(items: List[PlanItem]) -> str:
     if not items:
         return "Нет задач на выбранный день."
-    lines = [f"{it.start:%H:%M}-{it.end:%H:%M} • {it.label}" for it in items]
-    return "\n".join(lines)
+    return _fmt_plan_rows(tuple((it.start, it.end, it.label) for it in items))
+
+@lru_cache(maxsize=1024)
+def _fmt_plan_rows(rows: Tuple[Tuple[datetime, datetime, str], ...]) -> str:
+    return "\n".join(f"{s:%H:%M}-{e:%H:%M} • {label}" for s, e, label in rows)
 
 def fmt_tasks(tasks: List[Task], now: datetime) -> str:
     if not tasks:
         return "Список пуст."
+    rows = tuple((t.id, t.title, t.done, t.auto, t.constant, t.fixed_start, t.fixed_end,
+                  t.deadline_at, t.effort, t.duration_min) for t in tasks)
+    return _fmt_tasks_rows(rows, now.replace(second=0, microsecond=0))
+
+@lru_cache(maxsize=256)
+def _fmt_tasks_rows(rows: tuple, now: datetime) -> str:
     out = []
-    for t in tasks:
-        status = "✅" if t.done else ("🟩" if t.auto else "⬜️")
-        if t.constant:
+    for tid, title, done, auto, constant, fixed_start, fixed_end, deadline_at, effort, duration_min in rows:
+        status = "✅" if done else ("🟩" if auto else "⬜️")
+        if constant:
             tl = "—"
-        elif t.fixed_end:
-            tl = time_left_str(now, t.fixed_end)
+        elif fixed_end:
+            tl = time_left_str(now, fixed_end)
         else:
-            tl = time_left_str(now, t.deadline_at)
-        tag = "фикс" if (t.fixed_start and t.fixed_end) else ("пост." if t.constant else "гибк.")
-        out.append(f"{status} [{t.id}] {t.title} — до дедлайна {tl}; {t.effort}; {t.duration_min} мин; {tag}")
+            tl = time_left_str(now, deadline_at)
+        tag = "фикс" if (fixed_start and fixed_end) else ("пост." if constant else "гибк.")
+        out.append(f"{status} [{tid}] {title} — до дедлайна {tl}; {effort}; {duration_min} мин; {tag}")
     return "\n".join(out)
 
 def fmt_history(hist: List[DoneEntry]) -> str:
     if not hist:
         return "История пуста."
     lines = []
-    for e in hist[-50:][::-1]:
-        lines.append(f"✅ [{e.task.id}] {e.task.title} — выполнено {e.completed_at:%Y-%m-%d %H:%M}")
+    for e in hist:
+        lines.append(f"✅ [{e.task_id}] {e.title} — выполнено {e.completed_at:%Y-%m-%d %H:%M}")
     return "\n".join(lines)
 
 # ==================== Клавиатуры ====================
+# InlineKeyboardMarkup неизменяемы, поэтому одну и ту же разметку можно отдавать многократно.
+@lru_cache(maxsize=1)
 def main_menu_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
         [InlineKeyboardButton("➕ Добавить задачу", callback_data="menu:add")],
@@ -365,18 +2080,32 @@ def main_menu_kb() -> InlineKeyboardMarkup:
         [InlineKeyboardButton("📋 Список задач", callback_data="menu:list"),
          InlineKeyboardButton("📜 История", callback_data="menu:history")],
         [InlineKeyboardButton("⏰ Просроченные", callback_data="menu:overdue")],
-        [InlineKeyboardButton("⚙️ Настройки (в разработке)", callback_data="menu:settings")]
+        [InlineKeyboardButton("⚙️ Настройки", callback_data="menu:settings")]
     ])
 
+@lru_cache(maxsize=256)
+def history_kb(page: int, pages: int) -> InlineKeyboardMarkup:
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("⬅️ Новее", callback_data=f"hist:{page - 1}"))
+    if page + 1 < pages:
+        nav.append(InlineKeyboardButton("Старее ➡️", callback_data=f"hist:{page + 1}"))
+    return InlineKeyboardMarkup(([nav] if nav else []) + list(main_menu_kb().inline_keyboard))
+
 def task_row_buttons(t: Task) -> InlineKeyboardMarkup:
+    return _task_row_kb(t.done, t.auto, t.id)
+
+@lru_cache(maxsize=4096)
+def _task_row_kb(done: bool, auto: bool, tid: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([[
-        InlineKeyboardButton("✅ Готово" if not t.done else "↩️ Вернуть", callback_data=f"task:done:{t.id}"),
-        InlineKeyboardButton("🟩 Авто" if t.auto else "⬜️ Авто", callback_data=f"task:auto:{t.id}")
+        InlineKeyboardButton("✅ Готово" if not done else "↩️ Вернуть", callback_data=f"task:done:{tid}"),
+        InlineKeyboardButton("🟩 Авто" if auto else "⬜️ Авто", callback_data=f"task:auto:{tid}")
     ],[
-        InlineKeyboardButton("🗑 Удалить", callback_data=f"task:del:{t.id}"),
-        InlineKeyboardButton("🆕 На основе", callback_data=f"task:dup:{t.id}")
+        InlineKeyboardButton("🗑 Удалить", callback_data=f"task:del:{tid}"),
+        InlineKeyboardButton("🆕 На основе", callback_data=f"task:dup:{tid}")
     ]])
 
+@lru_cache(maxsize=4096)
 def overdue_row_kb(tid: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([[
         InlineKeyboardButton("🗓 Новый дедлайн", callback_data=f"od:setdl:{tid}"),
@@ -384,13 +2113,173 @@ def overdue_row_kb(tid: str) -> InlineKeyboardMarkup:
         InlineKeyboardButton("🗑 Удалить", callback_data=f"od:del:{tid}"),
     ]])
 
+# ==================== Исходящие сообщения ====================
+class TokenBucket:
+    """Маркерное ведро с резервированием: reserve() сразу списывает маркер и говорит, сколько ждать."""
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = monotonic()
+
+    def _refill(self) -> None:
+        now = monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def reserve(self) -> float:
+        self._refill()
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.burst
+
+class ChatRateLimiter(BaseRateLimiter):
+    """Темп исходящих запросов под лимиты Telegram.
+
+    Общий лимит на бота (~30 сообщений/с), на личный чат (~1/с, но со
+    всплеском, чтобы экран списка уходил сразу) и на группу (~20/мин).
+    При RetryAfter запрос повторяется после паузы, которую назвал сервер.
+    """
+    LIMITED = ("send", "edit", "copy", "forward", "delete")
+
+    def __init__(self, overall: float = 30, per_chat: float = 1, chat_burst: float = 20,
+                 per_group: float = 20 / 60, max_retries: int = 3):
+        self.overall = TokenBucket(overall, overall)
+        self.per_chat = per_chat
+        self.chat_burst = chat_burst
+        self.per_group = per_group
+        self.max_retries = max_retries
+        self.buckets: Dict[int, TokenBucket] = {}
+        self.calls = 0
+        self.retries = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        self.buckets.clear()
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        b = self.buckets.get(chat_id)
+        if b is None:
+            if len(self.buckets) > 10000:
+                self.buckets = {k: v for k, v in self.buckets.items() if not v.is_full()}
+            rate = self.per_group if chat_id < 0 else self.per_chat
+            b = self.buckets[chat_id] = TokenBucket(rate, self.chat_burst)
+        return b
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        max_retries = rate_limit_args or self.max_retries
+        limited = endpoint.startswith(self.LIMITED)
+        chat_id = data.get("chat_id")
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            chat_id = None
+        for attempt in range(max_retries + 1):
+            if limited:
+                if chat_id is not None:
+                    wait = self._bucket(chat_id).reserve()
+                    if wait:
+                        await asyncio.sleep(wait)
+                wait = self.overall.reserve()
+                if wait:
+                    await asyncio.sleep(wait)
+            self.calls += 1
+            METRICS.inc("bot_telegram_calls_total", endpoint=endpoint)
+            t0 = perf_counter()
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                if attempt == max_retries:
+                    METRICS.inc("bot_telegram_errors_total", endpoint=endpoint)
+                    raise
+                self.retries += 1
+                METRICS.inc("bot_telegram_retries_total", endpoint=endpoint)
+                ra = exc.retry_after
+            except TelegramError:
+                METRICS.inc("bot_telegram_errors_total", endpoint=endpoint)
+                raise
+            finally:
+                METRICS.observe("bot_telegram_seconds", perf_counter() - t0, endpoint=endpoint)
+            await asyncio.sleep((ra.total_seconds() if isinstance(ra, timedelta) else ra) + 0.1)
+
+class Outbox:
+    """Очередь уведомлений: всё, что пришло одному чату за delay секунд, уходит одним сообщением.
+
+    Уведомление с ключом заменяет ещё не отправленное с тем же ключом на его
+    месте в очереди: из «приближается» и «СРОЧНО» по одной задаче уйдёт только
+    последнее. retract снимает неотправленные, если их уже перекрыло другое.
+    """
+    MAX_LEN = 4096
+
+    def __init__(self, delay: float = 0.5):
+        self.delay = delay
+        self.pending: Dict[int, Dict[object, str]] = {}
+        self._timers: Dict[int, asyncio.Task] = {}
+        self._bot = None
+        self._seq = itertools.count()
+
+    def notify(self, bot, chat_id: int, text: str, key=None) -> None:
+        self._bot = bot
+        self.pending.setdefault(chat_id, {})[next(self._seq) if key is None else key] = text
+        if chat_id not in self._timers:
+            self._timers[chat_id] = asyncio.get_running_loop().create_task(self._flush_later(chat_id))
+
+    def retract(self, chat_id: int, keys) -> None:
+        pending = self.pending.get(chat_id)
+        if pending:
+            for key in keys:
+                pending.pop(key, None)
+
+    async def _flush_later(self, chat_id: int) -> None:
+        await asyncio.sleep(self.delay)
+        self._timers.pop(chat_id, None)
+        await self._send(chat_id)
+
+    async def _send(self, chat_id: int) -> None:
+        lines = self.pending.pop(chat_id, {}).values()
+        chunk = ""
+        for line in lines:
+            if chunk and len(chunk) + 1 + len(line) > self.MAX_LEN:
+                await self._deliver(chat_id, chunk)
+                chunk = ""
+            chunk = f"{chunk}\n{line}" if chunk else line
+        if chunk:
+            await self._deliver(chat_id, chunk)
+
+    async def _deliver(self, chat_id: int, text: str) -> None:
+        try:
+            await self._bot.send_message(chat_id, text)
+        except TelegramError:
+            log.exception("Не удалось отправить уведомление в чат %s", chat_id)
+
+    async def drain(self) -> None:
+        """Отправить всё накопленное немедленно (при остановке бота)."""
+        for task in self._timers.values():
+            task.cancel()
+        self._timers.clear()
+        for chat_id in list(self.pending):
+            await self._send(chat_id)
+
+OUTBOX = Outbox()
+
+async def drain_outbox(app: Application) -> None:
+    await OUTBOX.drain()
+
 # ==================== Экран-утилиты ====================
 async def delete_bot_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg_ids = context.user_data.get("bot_messages", [])
     chat_id = update.effective_chat.id
-    for mid in msg_ids:
+    # deleteMessages удаляет до 100 сообщений за вызов; ненайденные пропускает
+    for i in range(0, len(msg_ids), 100):
         try:
-            await context.bot.delete_message(chat_id=chat_id, message_id=mid)
+            await context.bot.delete_messages(chat_id=chat_id, message_ids=msg_ids[i:i + 100])
         except Exception:
             pass
     context.user_data["bot_messages"] = []
@@ -430,12 +2319,21 @@ def parse_days_from_buttons(selected: List[str]) -> List[int]:
     map_ru = {"Пн":0,"Вт":1,"Ср":2,"Чт":3,"Пт":4,"Сб":5,"Вс":6}
     return [map_ru[x] for x in selected if x in map_ru]
 
+DAYS_RU = ("Пн","Вт","Ср","Чт","Пт","Сб","Вс")
+
 def days_kb(selected: List[str]) -> InlineKeyboardMarkup:
-    days = ["Пн","Вт","Ср","Чт","Пт","Сб","Вс"]
+    mask = 0
+    for i, d in enumerate(DAYS_RU):
+        if d in selected:
+            mask |= 1 << i
+    return _days_kb(mask)
+
+@lru_cache(maxsize=128)
+def _days_kb(mask: int) -> InlineKeyboardMarkup:
     row = []
     rows = []
-    for d in days:
-        mark = "✅" if d in selected else "⬜️"
+    for i, d in enumerate(DAYS_RU):
+        mark = "✅" if mask >> i & 1 else "⬜️"
         row.append(InlineKeyboardButton(f"{mark} {d}", callback_data=f"add:day:{d}"))
         if len(row)==4:
             rows.append(row); row=[]
@@ -647,7 +2545,7 @@ async def add_save(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif kind == "flex":
         deadline_for_store = a["deadline_at"]
     else:
-        deadline_for_store = datetime.now()
+        deadline_for_store = get_repo(context, update.effective_chat.id).now()
 
     t = Task(
         id=tid,
@@ -669,47 +2567,39 @@ async def add_save(update: Update, context: ContextTypes.DEFAULT_TYPE):
         t.auto = False
         t.splittable = False
 
-    store = get_store(context, update.effective_chat.id)
-    store["tasks"][tid] = ser_task(t)
+    get_repo(context, update.effective_chat.id).save(t)
     context.user_data.pop("add", None)
     await send_screen(update, context, f"Добавлено: [{tid}] {t.title}")
     return ConversationHandler.END
 
 # ==================== Просроченные ====================
 async def sweep_overdue(update_or_context, context: ContextTypes.DEFAULT_TYPE, now: datetime):
+    """now — время в поясе чата (TaskRepo.now())."""
     chat_id = update_or_context.effective_chat.id if hasattr(update_or_context, "effective_chat") else context.job.chat_id
-    store = get_store(context, chat_id)
-    tasks = store["tasks"]
-    moved = []
-    for tid, d in list(tasks.items()):
-        t = deser_task(d)
-        if t.done or t.constant:
-            continue
-        anchor = t.fixed_end if t.fixed_end else t.deadline_at
-        if anchor and anchor < now and not t.overdue:
-            t.overdue = True
-            store["overdue"][tid] = ser_task(t)
-            tasks.pop(tid, None)
-            moved.append((t.title, anchor))
-    for title, anchor in moved:
-        await context.bot.send_message(chat_id, f"Дедлайн «{title}» прошел {anchor:%Y-%m-%d %H:%M}. Задача перемещена в список просроченных.")
+    await sweep_repo(context.bot, get_repo(context, chat_id), now)
 
-def overdue_row_kb(tid: str) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([[
-        InlineKeyboardButton("🗓 Новый дедлайн", callback_data=f"od:setdl:{tid}"),
-        InlineKeyboardButton("✅ Готово", callback_data=f"od:done:{tid}"),
-        InlineKeyboardButton("🗑 Удалить", callback_data=f"od:del:{tid}"),
-    ]])
+async def sweep_repo(bot, repo: TaskRepo, now: datetime):
+    moved = []
+    for t in repo.expired(now):
+        anchor = t.fixed_end or t.deadline_at
+        repo.move_to_overdue(t)
+        moved.append((t.title, anchor))
+        # предупреждение о дедлайне, который уже прошёл, не отправляем
+        OUTBOX.retract(repo.chat_id, [("deadline", t.id)])
+    if len(moved) == 1:
+        title, anchor = moved[0]
+        OUTBOX.notify(bot, repo.chat_id, f"Дедлайн «{title}» прошел {anchor:%Y-%m-%d %H:%M}. Задача перемещена в список просроченных.")
+    elif moved:
+        lines = "\n".join(f"• {title} — {anchor:%Y-%m-%d %H:%M}" for title, anchor in sorted(moved, key=lambda m: m[1]))
+        OUTBOX.notify(bot, repo.chat_id, f"Прошли дедлайны {len(moved)} задач, они перемещены в список просроченных:\n{lines}")
 
 async def show_overdue(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    store = get_store(context, update.effective_chat.id)
-    od = store.get("overdue", {})
+    od = get_repo(context, update.effective_chat.id).overdue
     if not od:
         await send_screen(update, context, "Просроченных задач нет.")
         return
     await send_screen(update, context, "Просроченные задачи:")
-    for tid, d in od.items():
-        t = deser_task(d)
+    for tid, t in list(od.items()):
         msg = await update.effective_chat.send_message(f"[{tid}] {t.title}", reply_markup=overdue_row_kb(tid))
         context.user_data.setdefault("bot_messages", []).append(msg.message_id)
 
@@ -719,24 +2609,24 @@ async def overdue_actions(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query; await q.answer()
     chat_id = update.effective_chat.id
     store = get_store(context, chat_id)
-    od = store.setdefault("overdue", {})
+    repo = get_repo(context, chat_id)
     if not q.data.startswith("od:"):
         return
     _, action, tid = q.data.split(":")
-    if tid not in od:
+    t = repo.overdue.get(tid)
+    if t is None:
         return
-    t = deser_task(od[tid])
 
     if action == "del":
-        od.pop(tid, None)
+        repo.remove_overdue(tid)
         try: await q.message.delete()
         except Exception: pass
         return
 
     if action == "done":
         t.done = True
-        store["history"].append(ser_done(DoneEntry(task=t, completed_at=datetime.now())))
-        od.pop(tid, None)
+        history_for(store, chat_id).append(DoneEntry(task_id=t.id, title=t.title, completed_at=repo.now()))
+        repo.remove_overdue(tid)
         try: await q.message.delete()
         except Exception: pass
         return
@@ -757,41 +2647,120 @@ async def handle_setdl_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not tid:
         await send_screen(update, context, "Не найден идентификатор задачи.")
         return ConversationHandler.END
-    store = get_store(context, update.effective_chat.id)
-    od = store.setdefault("overdue", {})
-    if tid not in od:
+    repo = get_repo(context, update.effective_chat.id)
+    t = repo.overdue.get(tid)
+    if t is None:
         await send_screen(update, context, "Задача уже обновлена или удалена.")
         return ConversationHandler.END
-    t = deser_task(od[tid])
-    t.overdue = False
     t.deadline_at = new_dt
     t.planned_for = None
-    store["tasks"][tid] = ser_task(t)
-    od.pop(tid, None)
+    repo.restore_from_overdue(t)
     await send_screen(update, context, f"Новый дедлайн установлен: {new_dt:%Y-%m-%d %H:%M}")
     return ConversationHandler.END
 
+# ==================== Настройки ====================
+S_TZ, S_DIGEST = 1002, 1003
+
+def digest_minute(bot_data: Dict, chat_id: int) -> int:
+    """Минута суток утреннего плана чата без сдвига."""
+    return bot_data.get("digest_at", {}).get(chat_id, ("", DIGEST_TIME.hour * 60 + DIGEST_TIME.minute))[1]
+
+def set_digest_at(bot_data: Dict, chat_id: int, tz_name: str, minute: int) -> None:
+    """Запомнить пояс и время плана чата и переставить его в корзинах."""
+    bot_data.setdefault("digest_at", {})[chat_id] = (tz_name, minute)
+    if chat_id in bot_data.get("digest_chats", ()):
+        DIGESTS.schedule(bot_data, chat_id)
+
+def settings_text(bot_data: Dict, chat_id: int, repo: TaskRepo) -> str:
+    name = repo.store.get("tz") or DEFAULT_TZ or "как у сервера"
+    m = digest_minute(bot_data, chat_id)
+    if chat_id in bot_data.get("digest_chats", ()):
+        digest = f"{m // 60:02d}:{m % 60:02d} (+{digest_jitter(chat_id)} мин)"
+    else:
+        digest = "выключен"
+    return (f"Настройки\n\nЧасовой пояс: {name}, сейчас {repo.now():%H:%M}\n"
+            f"Утренний план: {digest}")
+
+@lru_cache(maxsize=2)
+def settings_kb(digest_on: bool) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("🌍 Часовой пояс", callback_data="set:tz"),
+         InlineKeyboardButton("🌅 Время плана", callback_data="set:digest")],
+        [InlineKeyboardButton("🔕 Выключить утренний план" if digest_on else "🔔 Включить утренний план",
+                              callback_data="set:off" if digest_on else "set:on")],
+        [InlineKeyboardButton("⬅️ Главное меню", callback_data="menu:main")]
+    ])
+
+async def show_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    on = chat_id in context.bot_data.get("digest_chats", ())
+    await send_screen(update, context, settings_text(context.bot_data, chat_id, get_repo(context, chat_id)),
+                      reply_markup=settings_kb(on))
+
+async def settings_actions(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query; await q.answer()
+    chat_id = update.effective_chat.id
+    action = q.data.split(":")[1]
+    if action == "tz":
+        await send_screen_plain(update, context, "Пришлите часовой пояс: Europe/Moscow, Asia/Almaty или смещение вроде +3, -5:30")
+        return S_TZ
+    if action == "digest":
+        await send_screen_plain(update, context, "Во сколько присылать план на сегодня (HH:MM)?")
+        return S_DIGEST
+    if action == "off":
+        context.bot_data.setdefault("digest_chats", set()).discard(chat_id)
+        context.bot_data.setdefault("digest_off", set()).add(chat_id)
+        DIGESTS.cancel(chat_id)
+    elif action == "on":
+        context.bot_data.setdefault("digest_off", set()).discard(chat_id)
+        digest_chats = context.bot_data.setdefault("digest_chats", set())
+        if chat_id not in digest_chats:
+            digest_chats.add(chat_id)
+            DIGESTS.schedule(context.bot_data, chat_id)
+    await show_settings(update, context)
+    return ConversationHandler.END
+
+async def handle_tz_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    name = update.message.text.strip()
+    chat_id = update.effective_chat.id
+    repo = get_repo(context, chat_id)
+    try:
+        repo.set_tz(name)
+    except ValueError:
+        await send_screen_plain(update, context, "Неизвестный пояс, пример: Europe/Moscow или +3")
+        return S_TZ
+    set_digest_at(context.bot_data, chat_id, name, digest_minute(context.bot_data, chat_id))
+    await show_settings(update, context)
+    return ConversationHandler.END
+
+async def handle_digest_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    txt = update.message.text.strip()
+    try:
+        h, m = map(int, txt.split(":"))
+        time(h, m)
+    except Exception:
+        await send_screen_plain(update, context, "Неверный формат, пример: 07:30")
+        return S_DIGEST
+    chat_id = update.effective_chat.id
+    set_digest_at(context.bot_data, chat_id, get_store(context, chat_id).get("tz", ""), h * 60 + m)
+    await show_settings(update, context)
+    return ConversationHandler.END
+
 # ==================== Экраны ====================
 async def show_today(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    now = datetime.now()
+    repo = get_repo(context, update.effective_chat.id)
+    now = repo.now()
     await sweep_overdue(update, context, now)
-    store = get_store(context, update.effective_chat.id)
-    tasks = [deser_task(d) for d in store["tasks"].values()]
-    quote = stoic_quote_ru()
-    plan = plan_today_assign_once(now, now, tasks, persist=True)
-    # Сохраняем возможные обновления planned_for
-    for t in tasks:
-        store["tasks"][t.id] = ser_task(t)
+    quote = stoic_quote_ru(repo.store)
+    plan = await plan_today_async(repo, now)
     text = f"{quote}\n\nПлан на сегодня:\n{fmt_plan(plan)}"
     await send_screen(update, context, text)
 
 async def show_week(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    now = datetime.now()
+    repo = get_repo(context, update.effective_chat.id)
+    now = repo.now()
     await sweep_overdue(update, context, now)
-    store = get_store(context, update.effective_chat.id)
-    tasks = [deser_task(d) for d in store["tasks"].values()]
-    start_day = now.replace(hour=12, minute=0, second=0, microsecond=0)
-    week = plan_week_without_dup(start_day, now, tasks)
+    week = await plan_week_async(repo, now)
     parts = []
     for day_label, items in week.items():
         parts.append(f"— {day_label} —")
@@ -799,53 +2768,70 @@ async def show_week(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await send_screen(update, context, "Недельный обзор:\n" + "\n".join(parts))
 
 async def show_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    store = get_store(context, update.effective_chat.id)
-    tasks_map = store["tasks"]
-    tasks = [deser_task(d) for d in tasks_map.values()]
-    now = datetime.now()
+    repo = get_repo(context, update.effective_chat.id)
+    tasks = repo.active()
+    now = repo.now()
     await send_screen(update, context, "Список задач (🟩 — отмечена для автопланирования):\n" + fmt_tasks(tasks, now))
     for t in tasks:
         msg = await update.effective_chat.send_message(f"[{t.id}] {t.title}", reply_markup=task_row_buttons(t))
         context.user_data.setdefault("bot_messages", []).append(msg.message_id)
 
-async def show_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    store = get_store(context, update.effective_chat.id)
-    hist = [deser_done(d) for d in store["history"]]
-    await send_screen(update, context, "История выполненных:\n" + fmt_history(hist))
+def history_screen(log: HistoryLog, page: int, today: date) -> str:
+    head = (f"История выполненных (стр. {page + 1}/{log.pages}):\n"
+            f"сегодня — {log.done_since(today)}, за 7 дней — {log.done_since(today - timedelta(days=6))}, "
+            f"всего — {log.total}")
+    return head + "\n\n" + fmt_history(log.page(page))
+
+async def show_history(update: Update, context: ContextTypes.DEFAULT_TYPE, page: int = 0):
+    chat_id = update.effective_chat.id
+    log = history_for(get_store(context, chat_id), chat_id)
+    page = min(max(page, 0), log.pages - 1)
+    await send_screen(update, context, history_screen(log, page, get_repo(context, chat_id).now().date()), reply_markup=history_kb(page, log.pages))
+
+async def history_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Листание истории: правим то же сообщение, читая только нужную страницу."""
+    q = update.callback_query; await q.answer()
+    chat_id = update.effective_chat.id
+    log = history_for(get_store(context, chat_id), chat_id)
+    page = min(max(int(q.data.split(":")[1]), 0), log.pages - 1)
+    try:
+        await q.message.edit_text(history_screen(log, page, get_repo(context, chat_id).now().date()), reply_markup=history_kb(page, log.pages))
+    except Exception:
+        await show_history(update, context, page)
 
 # ==================== Операции над задачами ====================
 async def task_actions(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query; await q.answer()
     chat_id = update.effective_chat.id
     store = get_store(context, chat_id)
-    tasks = store["tasks"]
+    repo = get_repo(context, chat_id)
     parts = q.data.split(":")
     _, action, tid = parts
-    if tid not in tasks:
+    t = repo.tasks.get(tid)
+    if t is None:
         await q.message.reply_text("Задача не найдена.")
         return
-    t = deser_task(tasks[tid])
 
     if action == "done":
         if not t.done:
             t.done = True
-            store["history"].append(ser_done(DoneEntry(task=t, completed_at=datetime.now())))
+            history_for(store, chat_id).append(DoneEntry(task_id=t.id, title=t.title, completed_at=repo.now()))
         else:
             t.done = False
-        tasks[tid] = ser_task(t)
+        repo.touch(t)
         try: await q.message.delete()
         except Exception: pass
         return
 
     if action == "auto":
         t.auto = not t.auto
-        tasks[tid] = ser_task(t)
+        repo.touch(t)
         try: await q.message.edit_reply_markup(reply_markup=task_row_buttons(t))
         except Exception: pass
         return
 
     if action == "del":
-        tasks.pop(tid, None)
+        repo.remove(tid)
         try: await q.message.delete()
         except Exception: pass
         return
@@ -868,13 +2854,14 @@ async def task_actions(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ==================== Меню и фоновые задачи ====================
 async def start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data["bot_messages"] = []
-    if context.job_queue:
-        chat_id = update.effective_chat.id
-        for name in (f"daily-{chat_id}", f"watch-{chat_id}"):
-            for job in context.job_queue.get_jobs_by_name(name):
-                job.schedule_removal()
-        context.job_queue.run_daily(morning_digest, time=time(7,30), chat_id=chat_id, name=f"daily-{chat_id}")
-        context.job_queue.run_repeating(deadline_watchdog, interval=1800, first=10, chat_id=chat_id, name=f"watch-{chat_id}")
+    chat_id = update.effective_chat.id
+    # утренний план рассылает общий job «digest», дедлайны — общий DEADLINES;
+    # чат, отписавшийся в настройках, /start обратно не подписывает
+    digest_chats = context.bot_data.setdefault("digest_chats", set())
+    if chat_id not in digest_chats and chat_id not in context.bot_data.get("digest_off", ()):
+        digest_chats.add(chat_id)
+        DIGESTS.schedule(context.bot_data, chat_id)
+    get_repo(context, chat_id)
     await update.effective_chat.send_message("Главное меню:", reply_markup=main_menu_kb())
 
 async def menu_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -891,41 +2878,734 @@ async def menu_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if key == "overdue":
         await show_overdue(update, context); return
     if key == "settings":
-        await send_screen(update, context, "Настройки в разработке."); return
-
-async def morning_digest(context: ContextTypes.DEFAULT_TYPE):
-    now = datetime.now()
-    await sweep_overdue(context, context, now)
-    chat_id = context.job.chat_id
-    store = get_store(context, chat_id)
-    tasks = [deser_task(d) for d in store["tasks"].values()]
-    quote = stoic_quote_ru()
-    plan = plan_today_assign_once(now, now, tasks, persist=True)
-    for t in tasks:
-        store["tasks"][t.id] = ser_task(t)
-    await context.bot.send_message(chat_id, f"{quote}\n\nПлан на сегодня:\n{fmt_plan(plan)}")
-
-async def deadline_watchdog(context: ContextTypes.DEFAULT_TYPE):
+        await show_settings(update, context); return
+    if key == "main":
+        await send_screen(update, context, "Главное меню:"); return
+
+def digest_jitter(chat_id: int) -> int:
+    """Постоянный для чата сдвиг утреннего плана, 0..DIGEST_JITTER минут."""
+    return zlib.crc32(str(chat_id).encode()) % (DIGEST_JITTER + 1)
+
+class DigestScheduler:
+    """Утренний план по минутным корзинам.
+
+    Для каждого подписанного чата в куче лежит серверное время его следующего
+    плана: местное время из настроек (или DIGEST_TIME) плюс digest_jitter в
+    поясе чата. Пояс и время берутся из bot_data["digest_at"], чтобы не
+    распаковывать чаты при старте. Один repeating job раз в DIGEST_TICK
+    секунд забирает наступившие корзины; устаревшие записи кучи отбрасываются
+    сверкой с self._next.
+    """
+
+    def __init__(self):
+        self.heap: List[Tuple[datetime, int]] = []
+        self._next: Dict[int, datetime] = {}
+
+    @staticmethod
+    def slot(bot_data: Dict, chat_id: int) -> Tuple[Optional[tzinfo], int]:
+        """Пояс чата и минута суток его плана (с учётом сдвига)."""
+        name, minute = bot_data.get("digest_at", {}).get(chat_id, (DEFAULT_TZ, DIGEST_TIME.hour * 60 + DIGEST_TIME.minute))
+        try:
+            tz = zone(name)
+        except ValueError:
+            tz = None
+        return tz, minute + digest_jitter(chat_id)
+
+    @staticmethod
+    def _at(tz: Optional[tzinfo], minute: int, now: datetime) -> datetime:
+        local = from_server(now, tz)
+        when = datetime.combine(local.date(), time(0)) + timedelta(minutes=minute)
+        if when <= local:
+            when += timedelta(days=1)
+        return to_server(when, tz)
+
+    def next_time(self, bot_data: Dict, chat_id: int, now: Optional[datetime] = None) -> datetime:
+        """Серверное время ближайшего ещё не наступившего плана чата; now — серверное время."""
+        tz, minute = self.slot(bot_data, chat_id)
+        return self._at(tz, minute, now or datetime.now())
+
+    @staticmethod
+    def subscribed(bot_data: Dict, chat_id: int) -> bool:
+        return chat_id in bot_data.get("digest_chats", ()) and chat_id not in bot_data.get("digest_off", ())
+
+    def schedule(self, bot_data: Dict, chat_id: int, now: Optional[datetime] = None) -> Optional[datetime]:
+        """Поставить следующий план чата; повторный вызов с тем же результатом ничего не добавляет.
+        Отписавшийся чат (в том числе пока шла рассылка его корзины) снимается; None."""
+        if not self.subscribed(bot_data, chat_id):
+            self.cancel(chat_id)
+            return None
+        when = self.next_time(bot_data, chat_id, now)
+        if self._next.get(chat_id) != when:
+            self._next[chat_id] = when
+            heapq.heappush(self.heap, (when, chat_id))
+        return when
+
+    def schedule_all(self, bot_data: Dict, chat_ids, now: Optional[datetime] = None) -> None:
+        """Разложить сразу много чатов (старт): одна heapify вместо heappush на чат."""
+        now = now or datetime.now()
+        seen: Dict[Tuple[Optional[tzinfo], int], datetime] = {}  # корзин на порядки меньше, чем чатов
+        for chat_id in chat_ids:
+            slot = self.slot(bot_data, chat_id)
+            when = seen.get(slot)
+            if when is None:
+                when = seen[slot] = self._at(*slot, now)
+            self._next[chat_id] = when
+        self.heap = [(when, chat_id) for chat_id, when in self._next.items()]
+        heapq.heapify(self.heap)
+
+    def cancel(self, chat_id: int) -> None:
+        self._next.pop(chat_id, None)
+
+    def due(self, now: datetime) -> Dict[datetime, List[int]]:
+        """Забрать наступившие корзины: серверное время корзины -> чаты."""
+        out: Dict[datetime, List[int]] = {}
+        while self.heap and self.heap[0][0] <= now:
+            when, chat_id = heapq.heappop(self.heap)
+            if self._next.get(chat_id) == when:
+                del self._next[chat_id]
+                out.setdefault(when, []).append(chat_id)
+        return out
+
+DIGESTS = DigestScheduler()
+
+async def digest_tick(context: ContextTypes.DEFAULT_TYPE):
+    """Разослать наступившие корзины утреннего плана и поставить каждому чату следующий."""
     now = datetime.now()
-    chat_id = context.job.chat_id
-    store = get_store(context, chat_id)
-    await sweep_overdue(context, context, now)
-    for d in list(store["tasks"].values()):
-        t = deser_task(d)
-        if t.done or t.constant:
+    buckets = DIGESTS.due(now)
+    for when, chat_ids in sorted(buckets.items()):
+        METRICS.observe("bot_job_lag_seconds", max(0.0, (now - when).total_seconds()), job="digest")
+        await morning_digest(context, chat_ids)
+        for chat_id in chat_ids:
+            DIGESTS.schedule(context.bot_data, chat_id, now)
+
+async def morning_digest(context: ContextTypes.DEFAULT_TYPE, chat_ids: List[int]):
+    """Утренний план чатам одной корзины.
+
+    Свободные чаты одного пояса планируются одним plan_today_batch без await
+    между чтением и записью репозиториев, поэтому корзина не вклинивается в
+    обработчики. Чаты, чей замок сейчас занят, планируются после — под замком.
+    """
+    app = context.application
+    groups: Dict[Optional[tzinfo], List[TaskRepo]] = {}
+    busy = []
+    for chat_id in chat_ids:
+        if CHAT_LOCKS.busy(chat_id):
+            busy.append(chat_id)
+        else:
+            repo = repo_for(app.chat_data[chat_id], chat_id)
+            groups.setdefault(repo.tz, []).append(repo)
+    plans: Dict[int, List[PlanItem]] = {}
+    for tz, repos in groups.items():
+        now = local_now(tz).replace(second=0, microsecond=0)
+        for repo in repos:
+            await sweep_repo(context.bot, repo, now)
+        with METRICS.time("bot_planner_seconds", kind="today", tasks=size_class(sum(len(r.tasks) for r in repos)),
+                          where="batch"):
+            plans.update(plan_today_batch(repos, now))
+    for chat_id in busy:
+        async with CHAT_LOCKS.hold(chat_id):
+            if not DIGESTS.subscribed(app.bot_data, chat_id):
+                continue  # отписался, пока ждали замок
+            repo = repo_for(app.chat_data[chat_id], chat_id)
+            now = repo.now().replace(second=0, microsecond=0)
+            await sweep_repo(context.bot, repo, now)
+            plans[chat_id] = await plan_today_async(repo, now)
+    for chat_id, plan in plans.items():
+        quote = stoic_quote_ru(chat_store(app.chat_data[chat_id], chat_id))
+        OUTBOX.notify(context.bot, chat_id, f"{quote}\n\nПлан на сегодня:\n{fmt_plan(plan)}")
+    if chat_ids:
+        app.mark_data_for_update_persistence(chat_ids=chat_ids)
+
+def restore_digest(app: Application) -> None:
+    """Разложить подписанные чаты по корзинам и зарегистрировать общий job;
+    при переходе со старых per-chat jobs подписать все уже известные чаты,
+    кроме отписавшихся (bot_data["digest_off"]).
+
+    Реестр — bot_data["digest_chats"], ["digest_at"] и ["digest_off"]: он сохраняется
+    вместе с bot_data, так что после перезапуска /start не нужен. Вызов
+    идемпотентен: корзины пересчитываются заново, job остаётся один.
+    """
+    if "digest_chats" not in app.bot_data:
+        app.bot_data["digest_chats"] = set(app.chat_data) - app.bot_data.get("digest_off", set())
+    DIGESTS.schedule_all(app.bot_data, app.bot_data["digest_chats"])
+    if app.job_queue:
+        for job in app.job_queue.get_jobs_by_name("digest"):
+            job.schedule_removal()
+        app.job_queue.run_repeating(digest_tick, interval=DIGEST_TICK, first=DIGEST_TICK - datetime.now().second,
+                                    name="digest")
+
+# ==================== Планировщик дедлайнов ====================
+WARN_EARLY = timedelta(hours=24)
+WARN_URGENT = timedelta(hours=4)
+EV_EARLY, EV_URGENT, EV_OVERDUE, EV_WAKE = 0, 1, 2, 3
+
+class DeadlineScheduler:
+    """Одна куча событий дедлайнов на все чаты.
+
+    Для каждой задачи в куче лежат до трёх событий: предупреждение за 24 часа,
+    за 4 часа и перенос в просроченные. JobQueue будится одним run_once ровно
+    к ближайшему событию. Устаревшие записи не удаляются из кучи, а
+    отбрасываются при извлечении по номеру поколения задачи. Отправленные
+    предупреждения записываются в Task.alerted и после перезапуска не повторяются.
+    """
+
+    def __init__(self):
+        self.heap: List[Tuple[datetime, int, int, str, int, int]] = []
+        self.app: Optional[Application] = None
+        self._gen: Dict[Tuple[int, str], int] = {}
+        self._anchor: Dict[Tuple[int, str], datetime] = {}
+        self._woken: Dict[int, datetime] = {}
+        self._seq = 0
+        self._job = None
+        self._armed_at: Optional[datetime] = None
+
+    def attach(self, app: Application) -> None:
+        self.app = app
+        self._job = None
+        self._armed_at = None
+        self._arm()
+
+    def watch(self, chat_id: int, t: Task, now: Optional[datetime] = None, tz: Optional[tzinfo] = None) -> None:
+        """Поставить события задачи; её времена и now — в поясе чата tz, в кучу идёт серверное время."""
+        key = (chat_id, t.id)
+        anchor = task_anchor(t)
+        if self._anchor.get(key) == anchor:
+            return
+        if anchor is None:
+            self.forget(chat_id, t.id)
+            return
+        now = now or local_now(tz)
+        gen = self._gen.get(key, 0) + 1
+        self._gen[key] = gen
+        self._anchor[key] = anchor
+        for when, kind in ((anchor - WARN_EARLY, EV_EARLY), (anchor - WARN_URGENT, EV_URGENT), (anchor, EV_OVERDUE)):
+            if kind != EV_OVERDUE and (anchor <= now or t.alerted > kind):
+                continue
+            if kind == EV_EARLY and anchor - WARN_URGENT <= now:
+                continue  # уже внутри 4 часов — хватит срочного предупреждения
+            self._seq += 1
+            heapq.heappush(self.heap, (to_server(max(when, now), tz), self._seq, chat_id, t.id, kind, gen))
+        self._arm()
+
+    def wake(self, chat_id: int, when: datetime) -> None:
+        """Загрузить чат к моменту when: при загрузке его задачи встанут в кучу сами.
+        Повторный вызов с тем же when ничего не добавляет."""
+        if self._woken.get(chat_id) == when:
+            return
+        self._woken[chat_id] = when
+        self._seq += 1
+        self._gen.setdefault((chat_id, ""), 0)
+        heapq.heappush(self.heap, (when, self._seq, chat_id, "", EV_WAKE, 0))
+        self._arm()
+
+    def forget(self, chat_id: int, tid: str) -> None:
+        key = (chat_id, tid)
+        if key in self._anchor:
+            self._gen[key] = self._gen.get(key, 0) + 1
+            del self._anchor[key]
+
+    def _arm(self) -> None:
+        """Поставить run_once на время вершины кучи, если оно раньше уже взведённого."""
+        if self.app is None or self.app.job_queue is None:
+            return
+        while self.heap and self._gen.get((self.heap[0][2], self.heap[0][3])) != self.heap[0][5]:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return
+        when = self.heap[0][0]
+        if self._job is not None and self._armed_at is not None and self._armed_at <= when:
+            return
+        if self._job is not None:
+            # задание могло уже сработать и быть удалено планировщиком
+            try: self._job.schedule_removal()
+            except Exception: pass
+        delay = max(0.0, (when - datetime.now()).total_seconds())
+        self._job = self.app.job_queue.run_once(self._fire, when=delay, name="deadlines")
+        self._armed_at = when
+
+    async def _fire(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        now = datetime.now()
+        if self._armed_at is not None:
+            METRICS.observe("bot_job_lag_seconds", max(0.0, (now - self._armed_at).total_seconds()), job="deadlines")
+        self._job = None
+        self._armed_at = None
+        due: Dict[int, List[Tuple[str, int]]] = {}
+        while self.heap and self.heap[0][0] <= now:
+            _, _, chat_id, tid, kind, gen = heapq.heappop(self.heap)
+            if self._gen.get((chat_id, tid)) == gen:
+                due.setdefault(chat_id, []).append((tid, kind))
+        for chat_id, events in due.items():
+            async with CHAT_LOCKS.hold(chat_id):
+                repo = repo_for(self.app.chat_data[chat_id], chat_id)
+                for tid, kind in sorted(events, key=lambda e: -e[1]):
+                    t = repo.tasks.get(tid)
+                    if t is None or kind >= EV_OVERDUE or t.alerted > kind:
+                        continue
+                    if kind == EV_EARLY:
+                        OUTBOX.notify(context.bot, chat_id, f"Дедлайн «{t.title}» приближается! Нужно ускориться.",
+                                      key=("deadline", tid))
+                    else:
+                        OUTBOX.notify(context.bot, chat_id, f"СРОЧНО: дедлайн «{t.title}» менее чем через 4 часа!",
+                                      key=("deadline", tid))
+                    t.alerted = kind + 1
+                    repo.mark_dirty(t)
+                if any(kind == EV_OVERDUE for _, kind in events):
+                    await sweep_repo(context.bot, repo, repo.now())
+            self.app.mark_data_for_update_persistence(chat_ids=chat_id)
+        self._arm()
+
+DEADLINES = DeadlineScheduler()
+
+async def restore_deadlines(app: Application) -> None:
+    """Заполнить кучу дедлайнов по всем сохранённым чатам.
+
+    Если хранилище знает время ближайшего события чата, чат не распаковывается:
+    в кучу кладётся одно событие EV_WAKE, остальные загружаются сразу, и их
+    alert_at дописывается в хранилище — к следующему старту они тоже ленивые.
+    Повторный вызов ничего не дублирует.
+    """
+    sqlite = isinstance(app.persistence, SQLitePersistence)
+    known = app.persistence.alert_times() if sqlite else {}
+    backfill = {}
+    for chat_id in list(app.chat_data):
+        if chat_id in _REPOS:
+            continue  # уже загружен — его задачи в куче
+        if chat_id not in known:
+            repo = repo_for(app.chat_data[chat_id], chat_id)
+            alert = repo.next_alert()
+            backfill[chat_id] = None if alert is None else to_server(alert, repo.tz)
+        elif known[chat_id] is not None:
+            DEADLINES.wake(chat_id, known[chat_id])
+    if sqlite and backfill:
+        app.persistence.store_alert_times(backfill)
+    DEADLINES.attach(app)
+
+async def on_startup(app: Application) -> None:
+    """post_init: восстановить фоновые задачи после загрузки сохранённых данных."""
+    await restore_deadlines(app)
+    restore_digest(app)
+    LOOP_LAG.start()
+    await start_metrics_server()
+
+async def on_stop(app: Application) -> None:
+    """post_stop: дослать уведомления и записать в лог задержки event loop."""
+    await drain_outbox(app)
+    await LOOP_LAG.stop()
+    if LOOP_LAG.samples:
+        log.info("Задержка event loop: %s", LOOP_LAG.stats())
+
+async def on_shutdown(app: Application) -> None:
+    """post_shutdown: остановить пул планирования и сервер метрик."""
+    PLAN_POOL.shutdown()
+    await stop_metrics_server()
+
+# ==================== Параллельная обработка ====================
+class ChatLocks:
+    """Замки по chat_id: всё, что меняет store чата, выполняется под его замком по очереди."""
+
+    def __init__(self):
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._holders: Dict[int, int] = {}
+
+    @asynccontextmanager
+    async def hold(self, chat_id: int):
+        lock = self._locks.get(chat_id)
+        if lock is None:
+            lock = self._locks[chat_id] = asyncio.Lock()
+        self._holders[chat_id] = self._holders.get(chat_id, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._holders[chat_id] -= 1
+            if not self._holders[chat_id]:
+                del self._holders[chat_id], self._locks[chat_id]
+
+    def busy(self, chat_id: int) -> bool:
+        """Занят ли замок чата (кто-то держит его или ждёт)."""
+        return chat_id in self._holders
+
+CHAT_LOCKS = ChatLocks()
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Разные чаты обрабатываются параллельно, обновления одного чата — строго по порядку.
+
+    asyncio.Lock честный (FIFO), а Application запускает обработку в порядке
+    поступления, поэтому очередь на замке чата повторяет порядок обновлений.
+    Рабочие места (max_concurrent_updates) занимаются уже после замка чата,
+    чтобы поток нажатий из одного чата не занял их все ожиданием.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        # базовый семафор ограничивает лишь число ожидающих обновлений
+        super().__init__(max_concurrent_updates * 16)
+        self.workers = asyncio.Semaphore(max_concurrent_updates)
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        chat = getattr(update, "effective_chat", None)
+        user = getattr(update, "effective_user", None)
+        key = chat.id if chat else (user.id if user else None)
+        if key is None:
+            async with self.workers:
+                await coroutine
+            return
+        async with CHAT_LOCKS.hold(key):
+            async with self.workers:
+                await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+# ==================== Вебхук ====================
+def make_webhook_app(app: Application) -> web.Application:
+    """aiohttp-приложение, которое принимает обновления Telegram и кладёт их в очередь Application.
+
+    Ответ 200 уходит сразу после постановки в очередь, обработка идёт в
+    Application (параллельно, если задан CONCURRENT_UPDATES).
+    """
+    from aiohttp import web
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        await app.update_queue.put(Update.de_json(data, app.bot))
+        return web.Response()
+
+    async def health(request: web.Request) -> web.Response:
+        return web.Response(text="ok")
+
+    web_app = web.Application()
+    web_app.router.add_post(WEBHOOK_PATH, handle_update)
+    web_app.router.add_get("/healthz", health)
+    return web_app
+
+async def run_webhook(app: Application) -> None:
+    """Запустить Application и aiohttp-сервер вебхука; работать до SIGINT/SIGTERM."""
+    from aiohttp import web
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    if WEBHOOK_URL:
+        await app.bot.set_webhook(WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                                  secret_token=WEBHOOK_SECRET or None,
+                                  allowed_updates=Update.ALL_TYPES)
+    runner = web.AppRunner(make_webhook_app(app))
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+# ==================== Шардирование ====================
+def shard_of(chat_id: int, shards: int) -> int:
+    """Шард чата: значения crc32(chat_id) делятся на shards равных диапазонов."""
+    return zlib.crc32(str(chat_id).encode()) * shards >> 32
+
+def update_chat_id(data: Dict) -> Optional[int]:
+    """chat_id сырого обновления Telegram без разбора в Update; None — чата нет."""
+    for key in ("message", "edited_message", "channel_post", "edited_channel_post",
+                "my_chat_member", "chat_member", "chat_join_request"):
+        if key in data:
+            return data[key]["chat"]["id"]
+    if "callback_query" in data:
+        q = data["callback_query"]
+        return q["message"]["chat"]["id"] if "message" in q else q["from"]["id"]
+    for obj in data.values():
+        if isinstance(obj, dict) and "from" in obj:
+            return obj["from"]["id"]  # личный чат совпадает с id пользователя
+    return None
+
+def shard_db_path(index: int) -> Path:
+    return STATE_DB_PATH.with_name(f"{STATE_DB_PATH.stem}.{index}{STATE_DB_PATH.suffix}")
+
+SHARD_KEY = "shard"  # kv шарда: pickle((index, shards)) — его место в раскладке
+
+def shard_layout() -> Dict[int, Optional[int]]:
+    """Существующие state.<i>.db: индекс -> записанное в файле число шардов (None — не записано)."""
+    name = re.compile(rf"{re.escape(STATE_DB_PATH.stem)}\.(\d+){re.escape(STATE_DB_PATH.suffix)}")
+    out: Dict[int, Optional[int]] = {}
+    for path in STATE_DB_PATH.parent.glob(f"{STATE_DB_PATH.stem}.*{STATE_DB_PATH.suffix}"):
+        m = name.fullmatch(path.name)
+        if m is None:
             continue
-        anchor = t.fixed_end if t.fixed_end else t.deadline_at
-        left = anchor - now
-        if timedelta(hours=0) < left <= timedelta(hours=24):
-            await context.bot.send_message(chat_id, f"Дедлайн «{t.title}» приближается! Нужно ускориться.")
-        if timedelta(hours=0) < left <= timedelta(hours=4):
-            await context.bot.send_message(chat_id, f"СРОЧНО: дедлайн «{t.title}» менее чем через 4 часа!")
+        db = sqlite3.connect(path)
+        try:
+            row = db.execute("SELECT data FROM kv WHERE key = ?", (SHARD_KEY,)).fetchone()
+        except sqlite3.OperationalError:  # нет таблицы kv
+            row = None
+        finally:
+            db.close()
+        out[int(m.group(1))] = pickle.loads(row[0])[1] if row else None
+    return out
+
+def _merge_bot_data(parts: List[Dict]) -> Dict:
+    """bot_data шардов -> общий: реестры утреннего плана объединяются, остальное — из шарда 0."""
+    out = dict(parts[0]) if parts else {}
+    for key in ("digest_chats", "digest_off"):
+        if any(key in p for p in parts):
+            out[key] = set().union(*(p.get(key, ()) for p in parts))
+    if any("digest_at" in p for p in parts):
+        out["digest_at"] = {c: v for p in parts for c, v in p.get("digest_at", {}).items()}
+    return out
+
+def merge_shards(shards: int, target: Path) -> None:
+    """Собрать state.<i>.db раскладки на shards шардов обратно в один файл target."""
+    part = target.with_name(target.name + ".part")
+    _remove_db(part)
+    merged = SQLitePersistence(part)
+    merged.db.create_function("home", 1, lambda u: shard_of(u, shards), deterministic=True)
+    parts = []
+    for i in range(shards):
+        merged.db.execute("ATTACH DATABASE ? AS src", (str(shard_db_path(i)),))
+        with merged.db:
+            merged.db.execute("BEGIN")
+            merged.db.execute("INSERT INTO chat_data (chat_id, data, alert_at, tasks, log_seq) "
+                              "SELECT chat_id, data, alert_at, tasks, log_seq FROM src.chat_data")
+            merged.db.execute("INSERT INTO task_log SELECT * FROM src.task_log")
+            # копии user_data лежат в нескольких шардах; главная — из шарда личного чата
+            merged.db.execute("INSERT OR REPLACE INTO user_data SELECT * FROM src.user_data WHERE home(user_id) = ?", (i,))
+            merged.db.execute("INSERT OR IGNORE INTO user_data SELECT * FROM src.user_data")
+            merged.db.execute("INSERT INTO conversations SELECT * FROM src.conversations")
+            kv = dict(merged.db.execute("SELECT key, data FROM src.kv WHERE key != ?", (SHARD_KEY,)))
+            parts.append(pickle.loads(kv.pop("bot_data")) if "bot_data" in kv else {})
+            if i == 0:
+                merged.db.executemany("INSERT INTO kv VALUES (?, ?)", kv.items())
+        merged.db.execute("DETACH DATABASE src")
+    merged.db.execute("INSERT INTO kv VALUES ('bot_data', ?)",
+                      (pickle.dumps(_merge_bot_data(parts), pickle.HIGHEST_PROTOCOL),))
+    merged.db.close()
+    os.replace(part, target)  # target появляется только целиком
+
+def _split_into(source_path: Path, shards: int, paths: List[Path]) -> None:
+    source = SQLitePersistence(source_path)  # заодно доводит схему до текущей
+    kv = dict(source.db.execute("SELECT key, data FROM kv WHERE key != ?", (SHARD_KEY,)))
+    conversations = source.db.execute("SELECT name, key, state FROM conversations").fetchall()
+    source.db.close()
+    bot_data = pickle.loads(kv.pop("bot_data")) if "bot_data" in kv else {}
+    # пользователь нужен в шарде каждого своего известного чата: личного и тех, где он в диалоге
+    user_shards: Dict[int, set] = {}
+    for _, key, _ in conversations:
+        chat_id, user_id = json.loads(key)[:2]
+        user_shards.setdefault(user_id, {shard_of(user_id, shards)}).add(shard_of(chat_id, shards))
+    parts = [path.with_name(path.name + ".part") for path in paths]
+    for i, path in enumerate(parts):
+        _remove_db(path)
+        p = SQLitePersistence(path)
+        p.db.create_function("shard_of", 1, lambda c: shard_of(c, shards), deterministic=True)
+        p.db.create_function("user_here", 1, lambda u, i=i: i in user_shards.get(u, (shard_of(u, shards),)),
+                             deterministic=True)
+        p.db.execute("ATTACH DATABASE ? AS src", (str(source_path),))
+        own = {k: v for k, v in bot_data.items() if k not in ("digest_chats", "digest_off", "digest_at")}
+        for key in ("digest_chats", "digest_off"):
+            if key in bot_data:
+                own[key] = {c for c in bot_data[key] if shard_of(c, shards) == i}
+        if "digest_at" in bot_data:
+            own["digest_at"] = {c: v for c, v in bot_data["digest_at"].items() if shard_of(c, shards) == i}
+        with p.db:
+            p.db.execute("BEGIN")
+            p.db.execute("INSERT INTO chat_data (chat_id, data, alert_at, tasks, log_seq) "
+                         "SELECT chat_id, data, alert_at, tasks, log_seq FROM src.chat_data WHERE shard_of(chat_id) = ?", (i,))
+            p.db.execute("INSERT INTO task_log SELECT * FROM src.task_log WHERE shard_of(chat_id) = ?", (i,))
+            p.db.execute("INSERT INTO user_data SELECT * FROM src.user_data WHERE user_here(user_id)")
+            p.db.executemany("INSERT INTO kv VALUES (?, ?)", kv.items())
+            p.db.execute("INSERT INTO kv VALUES ('bot_data', ?)", (pickle.dumps(own, pickle.HIGHEST_PROTOCOL),))
+            p.db.execute("INSERT INTO kv VALUES (?, ?)", (SHARD_KEY, pickle.dumps((i, shards))))
+            # ключ диалога — [chat_id, user_id]
+            p.db.executemany("INSERT INTO conversations VALUES (?, ?, ?)",
+                             (row for row in conversations if shard_of(json.loads(row[1])[0], shards) == i))
+        p.db.execute("DETACH DATABASE src")
+        p.db.close()
+    for part, path in zip(parts, paths):
+        os.replace(part, path)
+
+def _remove_db(path: Path) -> None:
+    for p in (path, path.with_name(path.name + "-wal"), path.with_name(path.name + "-shm")):
+        p.unlink(missing_ok=True)
+
+def split_state(shards: int) -> None:
+    """Разложить состояние по state.<i>.db перед шардированным запуском.
+
+    Всё делится по chat_id — тому же ключу, по которому фронт направляет
+    обновления: строки чатов, журнал задач, диалоги (ключ [chat_id, user_id])
+    и подписки на утренний план уходят в шард чата. user_data привязан не к
+    чату, поэтому пользователь копируется в шард каждого своего известного
+    чата: личного (chat_id == user_id) и тех, где у него открыт диалог.
+
+    Каждый шард записывает в kv свой индекс и число шардов. Если раскладка уже
+    на shards шардов — ничего не делается; если на другое число — шарды
+    сливаются в state.reshard.db и раскладываются заново; файлы пишутся под
+    временными именами, так что прерванная перекладка продолжается со слитого
+    файла. Несогласованные файлы (разные числа, пропуски, нет записи) — отказ
+    стартовать.
+    Исходный state.db (state.pkl) при первой раскладке не трогается.
+    """
+    paths = [shard_db_path(i) for i in range(shards)]
+    layout = shard_layout()
+    merged = STATE_DB_PATH.with_name(f"{STATE_DB_PATH.stem}.reshard{STATE_DB_PATH.suffix}")
+    if merged.exists():  # прошлая перекладка прервалась после слияния — оно и есть актуальное состояние
+        for i in layout:
+            _remove_db(shard_db_path(i))
+        _split_into(merged, shards, paths)
+        _remove_db(merged)
+        log.info("Перекладка по %d шардам завершена из %s", shards, merged)
+        return
+    if not layout:
+        source = SQLitePersistence(STATE_DB_PATH)
+        if source.is_empty() and STATE_PICKLE_PATH.exists():
+            source.import_pickle(STATE_PICKLE_PATH)
+        source.db.close()
+        _split_into(STATE_DB_PATH, shards, paths)
+        log.info("Состояние %s разложено по %d шардам", STATE_DB_PATH, shards)
+        return
+    counts = set(layout.values())
+    old = next(iter(counts))
+    if len(counts) != 1 or old is None or set(layout) != set(range(old)):
+        raise SystemExit(f"Файлы шардов {STATE_DB_PATH.stem}.<i>{STATE_DB_PATH.suffix} не согласованы "
+                         f"(индекс: число шардов — {dict(sorted(layout.items()))}); разложите состояние заново вручную")
+    if old == shards:
+        return
+    merge_shards(old, merged)
+    for i in range(old):
+        _remove_db(shard_db_path(i))
+    _split_into(merged, shards, paths)
+    _remove_db(merged)
+    log.info("Состояние переложено с %d на %d шардов", old, shards)
+
+def run_shard(index: int, shards: int, base_url: Optional[str] = None) -> None:
+    """Рабочий процесс шарда: свой state.<i>.db, JobQueue, пул планирования и доля
+    лимита Bot API; обновления приходят от фронта на SHARD_BASE_PORT + index."""
+    global STATE_DB_PATH, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_URL, METRICS_PORT
+    STATE_DB_PATH = shard_db_path(index)
+    WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_URL = SHARD_HOST, SHARD_BASE_PORT + index, ""
+    METRICS_PORT = METRICS_PORT + 1 + index if METRICS_PORT else 0
+    QUOTE_BOOK.refresh()
+    app = build_app(SQLitePersistence(STATE_DB_PATH), base_url=base_url,
+                    rate_limiter=ChatRateLimiter(overall=BOT_API_RATE / shards))
+    asyncio.run(run_webhook(app))
+
+def make_front_app(shards: int) -> web.Application:
+    """aiohttp-фронт: принимает вебхук Telegram и пересылает тело обновления шарду его чата.
+
+    Ответ Telegram — статус шарда, поэтому обновление, которое шард не принял,
+    Telegram доставит повторно. Обновления одного чата идут в один шард по порядку.
+    """
+    from aiohttp import web, ClientSession, ClientError
+    urls = [f"http://{SHARD_HOST}:{SHARD_BASE_PORT + i}{WEBHOOK_PATH}" for i in range(shards)]
+    headers = {"Content-Type": "application/json"}
+    if WEBHOOK_SECRET:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = WEBHOOK_SECRET
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            return web.Response(status=403)
+        body = await request.read()
+        try:
+            chat_id = update_chat_id(json.loads(body))
+        except (ValueError, KeyError, TypeError):
+            return web.Response(status=400)
+        url = urls[0 if chat_id is None else shard_of(chat_id, shards)]
+        try:
+            async with request.app["session"].post(url, data=body, headers=headers) as resp:
+                return web.Response(status=resp.status)
+        except ClientError:
+            return web.Response(status=503)
+
+    async def health(request: web.Request) -> web.Response:
+        return web.Response(text="ok")
+
+    async def open_session(web_app: web.Application) -> None:
+        web_app["session"] = ClientSession()
+
+    async def close_session(web_app: web.Application) -> None:
+        await web_app["session"].close()
+
+    web_app = web.Application()
+    web_app.router.add_post(WEBHOOK_PATH, handle_update)
+    web_app.router.add_get("/healthz", health)
+    web_app.on_startup.append(open_session)
+    web_app.on_cleanup.append(close_session)
+    return web_app
+
+async def run_sharded(shards: int, base_url: Optional[str] = None) -> None:
+    """Фронт шардированного режима: разложить состояние, поднять шарды (перезапуская
+    упавшие) и принимать вебхук на WEBHOOK_HOST:WEBHOOK_PORT до SIGINT/SIGTERM."""
+    from aiohttp import web
+    split_state(shards)
+    ctx = multiprocessing.get_context("spawn")
+
+    def spawn(i: int):
+        proc = ctx.Process(target=run_shard, args=(i, shards, base_url), name=f"shard-{i}")
+        proc.start()
+        return proc
+
+    procs = [spawn(i) for i in range(shards)]
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    runner = web.AppRunner(make_front_app(shards))
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    if WEBHOOK_URL:
+        async with Bot(BOT_TOKEN, base_url=base_url or "https://api.telegram.org/bot") as bot:
+            await bot.set_webhook(WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET or None,
+                                  allowed_updates=Update.ALL_TYPES)
+    try:
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), 1.0)
+            except asyncio.TimeoutError:
+                pass
+            for i, proc in enumerate(procs):
+                if not stop.is_set() and not proc.is_alive():
+                    log.warning("Шард %d завершился с кодом %s, перезапуск", i, proc.exitcode)
+                    procs[i] = spawn(i)
+    finally:
+        await runner.cleanup()
+        for proc in procs:
+            proc.terminate()  # SIGTERM: шард штатно останавливает Application и сбрасывает состояние
+        for proc in procs:
+            await loop.run_in_executor(None, proc.join)
 
 # ==================== Точка входа ====================
-def main():
-    load_quotes()  # загрузить цитаты стоиков из файла quotes.json (UTF-8)
-    persistence = PicklePersistence(filepath="state.pkl")
-    app = Application.builder().token(BOT_TOKEN).persistence(persistence).build()
+def build_app(persistence: Optional[BasePersistence] = None, token: str = BOT_TOKEN,
+              base_url: Optional[str] = None, rate_limiter: Optional[BaseRateLimiter] = None) -> Application:
+    builder = (
+        Application.builder().token(token)
+        .rate_limiter(rate_limiter or ChatRateLimiter())
+        .concurrent_updates(PerChatUpdateProcessor(CONCURRENT_UPDATES) if CONCURRENT_UPDATES > 1 else False)
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+    )
+    if persistence is not None:
+        builder = builder.persistence(persistence)
+    if isinstance(persistence, SQLitePersistence):
+        # chat_data новых чатов — тоже LazyChatData, чтобы Application не копировал его при записи
+        builder = builder.context_types(ContextTypes(chat_data=LazyChatData))
+    if base_url:
+        builder = builder.base_url(base_url)
+    app = builder.build()
 
     app.add_handler(CommandHandler("start", start_cmd))
 
@@ -975,17 +3655,84 @@ def main():
     )
     app.add_handler(setdl_conv)
 
+    # Настройки: пояс и время утреннего плана вводятся текстом
+    settings_conv = ConversationHandler(
+        entry_points=[CallbackQueryHandler(settings_actions, pattern=r"^set:(tz|digest|on|off)$")],
+        states={
+            S_TZ: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_tz_text)],
+            S_DIGEST: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_digest_text)]
+        },
+        fallbacks=[],
+        name="settings_conv",
+        persistent=True,
+        per_chat=True,
+        per_user=True,
+        per_message=False
+    )
+    app.add_handler(settings_conv)
+
     # Обработчики просроченных для «Готово» и «Удалить»
     app.add_handler(CallbackQueryHandler(overdue_actions, pattern=r"^od:(done|del):"))
 
     # Общее меню — после диалогов; не ловит «menu:add»
     app.add_handler(CallbackQueryHandler(menu_router, pattern=r"^menu:(?!add$)"))
 
+    # Листание истории
+    app.add_handler(CallbackQueryHandler(history_page, pattern=r"^hist:\d+$"))
+
     # Операции над задачами (готово/авто/удалить/на основе)
     app.add_handler(CallbackQueryHandler(task_actions, pattern=r"^task:(done|auto|del|dup):"))
+    instrument_handlers(app)
+    return app
+
+async def profile_startup() -> None:
+    """--profile-startup: замерить этапы холодного старта и выйти, не обращаясь к Telegram.
+
+    Разбивка импорта по пакетам подробнее видна через python -X importtime.
+    """
+    stages = [(name, t - prev) for (_, prev), (name, t) in zip(_IMPORTS, _IMPORTS[1:])]
+    t0 = perf_counter()
+    QUOTE_BOOK.refresh()
+    stages.append(("цитаты", perf_counter() - t0))
+    t0 = perf_counter()
+    persistence = make_persistence()
+    app = build_app(persistence)
+    stages.append(("сборка Application", perf_counter() - t0))
+    # те же публичные загрузчики хранилища, что зовёт initialize(), но без getMe
+    loaded = {}
+    for kind in ("user_data", "chat_data", "bot_data", "callback_data"):
+        t0 = perf_counter()
+        loaded[kind] = await getattr(persistence, f"get_{kind}")()
+        stages.append((f"загрузка {kind}", perf_counter() - t0))
+    state = SimpleNamespace(persistence=persistence, job_queue=app.job_queue, **loaded)
+    t0 = perf_counter()
+    await restore_deadlines(state)
+    restore_digest(state)
+    stages.append(("перерегистрация задач", perf_counter() - t0))
+
+    print("Этапы старта:")
+    for name, dt in stages:
+        print(f"  {name:<24} {dt * 1000:9.1f} мс")
+    print(f"  {'итого':<24} {sum(dt for _, dt in stages) * 1000:9.1f} мс")
+    unpacked = sum(1 for d in state.chat_data.values() if getattr(d, "loaded", True))
+    print(f"Чатов: {len(state.chat_data)}, распаковано при старте: {unpacked}; "
+          f"событий в куче дедлайнов: {len(DEADLINES.heap)}")
+    if isinstance(persistence, SQLitePersistence):
+        persistence.db.close()
 
-    app.run_polling()
+def main():
+    if SHARDS > 1:
+        asyncio.run(run_sharded(SHARDS))
+        return
+    QUOTE_BOOK.refresh()  # загрузить цитаты стоиков; дальше перечитываются при смене файла
+    app = build_app(make_persistence())
+    if UPDATE_MODE == "webhook":
+        asyncio.run(run_webhook(app))
+    else:
+        app.run_polling()
 
 if __name__ == "__main__":
-    load_quotes()  # загрузить цитаты стоиков из quotes.json (UTF-8)
-    main()
+    if "--profile-startup" in sys.argv:
+        asyncio.run(profile_startup())
+    else:
+        main()
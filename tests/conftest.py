@@ -0,0 +1,19 @@
+# tests/conftest.py — общие фикстуры: main импортируется из корня репозитория,
+# глобальное состояние процесса (репозитории, кучи расписаний) сбрасывается перед каждым тестом.
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main
+
+@pytest.fixture(autouse=True)
+def fresh_state():
+    main.DEADLINES = main.DeadlineScheduler()
+    main.DIGESTS = main.DigestScheduler()
+    main._REPOS.clear()
+    yield
+    main._REPOS.clear()
@@ -0,0 +1,73 @@
+# tests/test_batch_planner.py — plan_today_batch (NumPy) должен давать те же планы и даты, что поштучный план.
+
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import main
+from main import EFFORTS, PlanCache, Task, chat_store, plan_today_assign_once, repo_for, ser_task
+
+pytest.importorskip("numpy")
+
+def random_tasks(rnd: random.Random, n: int, now: datetime) -> list:
+    """Смесь фиксированных, постоянных и гибких задач, включая закрытые, просроченные и уже назначенные."""
+    day0 = now.replace(hour=0, minute=0)
+    out = []
+    for i in range(n):
+        tid = f"{i:04x}"
+        kind = rnd.random()
+        effort = rnd.choice(EFFORTS)
+        if kind < 0.25:
+            start = day0 + timedelta(days=rnd.choice((0, 0, 1)), hours=rnd.randint(5, 22), minutes=rnd.choice((0, 10, 25, 40)))
+            dur = rnd.choice((10, 30, 55, 90, 180))
+            out.append(Task(id=tid, title=f"fixed {i}", duration_min=dur, deadline_at=start + timedelta(minutes=dur),
+                            effort=effort, fixed_start=start, fixed_end=start + timedelta(minutes=dur)))
+        elif kind < 0.4:
+            sh, sm = rnd.randint(5, 21), rnd.choice((0, 15, 45))
+            eh, em = divmod(sh * 60 + sm + rnd.choice((20, 60, 150)), 60)
+            out.append(Task(id=tid, title=f"const {i}", duration_min=60, deadline_at=now, effort=effort, constant=True,
+                            dow=sorted(rnd.sample(range(7), rnd.randint(1, 7))),
+                            constant_start_hm=(sh, sm), constant_end_hm=(min(eh, 23), em)))
+        else:
+            planned = rnd.choice((None, None, now.date(), now.date() - timedelta(days=2), now.date() + timedelta(days=1)))
+            out.append(Task(id=tid, title=f"flex {i}", duration_min=rnd.choice((5, 15, 30, 45, 60, 120, 300)),
+                            deadline_at=now + timedelta(hours=rnd.randint(-5, 24 * 10), minutes=rnd.randint(0, 59)),
+                            effort=effort, splittable=rnd.random() < 0.5, auto=rnd.random() < 0.85,
+                            done=rnd.random() < 0.1, overdue=rnd.random() < 0.05,
+                            planned_for=planned.isoformat() if planned else None))
+    return out
+
+def repos_for(chats: dict) -> list:
+    main._REPOS.clear()
+    out = []
+    for cid, tasks in chats.items():
+        chat_data = {}
+        chat_store(chat_data, cid)["tasks"] = {t.id: ser_task(t) for t in tasks}
+        out.append(repo_for(chat_data, cid))
+    return out
+
+def snapshot(plan) -> list:
+    return [(i.start, i.end, i.label, i.task_id) for i in plan]
+
+@pytest.mark.parametrize("seed", range(8))
+def test_batch_matches_inline(seed, monkeypatch):
+    monkeypatch.setattr(main, "SCHEDULER", main.SCHEDULERS["first-fit"])
+    rnd = random.Random(seed)
+    hour, minute = rnd.choice(((5, 0), (6, 0), (7, 30), (9, 17), (12, 59), (18, 3), (21, 45), (23, 10)))
+    now = datetime(2026, 3, 2 + seed, hour, minute)
+    chats = {cid: random_tasks(rnd, rnd.randint(0, 40), now) for cid in range(1, 26)}
+
+    inline_repos = repos_for(chats)
+    expected = {}
+    for repo in inline_repos:
+        tasks = repo.active()
+        expected[repo.chat_id] = (snapshot(plan_today_assign_once(now, now, tasks, persist=True)),
+                                  sorted((t.id, t.planned_for) for t in tasks))
+
+    monkeypatch.setattr(main, "PLAN_CACHE", PlanCache())
+    batch_repos = repos_for(chats)
+    plans = main.plan_today_batch(batch_repos, now)
+    got = {repo.chat_id: (snapshot(plans[repo.chat_id]), sorted((t.id, t.planned_for) for t in repo.active()))
+           for repo in batch_repos}
+    assert got == expected
@@ -0,0 +1,113 @@
+# tests/test_deadlines.py — DeadlineScheduler: события 24ч/4ч/просрочки в общей куче, забывание и перестановка.
+
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+import main
+from main import EV_EARLY, EV_OVERDUE, EV_URGENT, Outbox, Task, repo_for
+
+CHAT = 42
+
+@pytest.fixture
+def now():
+    return datetime.now().replace(microsecond=0)
+
+def task(tid: str, deadline: datetime, **kw) -> Task:
+    return Task(id=tid, title=tid, duration_min=30, deadline_at=deadline, **kw)
+
+def live(tid: str = None) -> list:
+    """Действующие (не устаревшие) события кучи по порядку срабатывания: (время, задача, вид)."""
+    d = main.DEADLINES
+    return [(when, t, kind) for when, _, c, t, kind, gen in sorted(d.heap)
+            if d._gen.get((c, t)) == gen and (tid is None or t == tid)]
+
+def test_events_are_ordered_early_urgent_overdue(now):
+    anchor = now + timedelta(hours=30)
+    main.DEADLINES.watch(CHAT, task("a", anchor), now=now)
+    assert live() == [(anchor - timedelta(hours=24), "a", EV_EARLY),
+                      (anchor - timedelta(hours=4), "a", EV_URGENT),
+                      (anchor, "a", EV_OVERDUE)]
+
+def test_late_watch_skips_passed_warnings(now):
+    # внутри 24 часов раннее предупреждение — сразу, внутри 4 часов — только срочное
+    main.DEADLINES.watch(CHAT, task("a", now + timedelta(hours=10)), now=now)
+    main.DEADLINES.watch(CHAT, task("b", now + timedelta(hours=2)), now=now)
+    main.DEADLINES.watch(CHAT, task("c", now - timedelta(hours=1)), now=now)
+    assert live("a") == [(now, "a", EV_EARLY), (now + timedelta(hours=6), "a", EV_URGENT),
+                         (now + timedelta(hours=10), "a", EV_OVERDUE)]
+    assert live("b") == [(now, "b", EV_URGENT), (now + timedelta(hours=2), "b", EV_OVERDUE)]
+    assert live("c") == [(now, "c", EV_OVERDUE)]
+
+def test_sent_warnings_are_not_rescheduled(now):
+    anchor = now + timedelta(hours=30)
+    main.DEADLINES.watch(CHAT, task("a", anchor, alerted=1), now=now)
+    assert [kind for _, _, kind in live()] == [EV_URGENT, EV_OVERDUE]
+    main.DEADLINES.watch(CHAT, task("b", anchor, alerted=2), now=now)
+    assert [kind for _, _, kind in live("b")] == [EV_OVERDUE]
+
+def test_done_and_deleted_tasks_are_forgotten(now):
+    repo = repo_for({}, CHAT)
+    for tid in "abc":
+        repo.save(task(tid, now + timedelta(hours=30)))
+    assert {t for _, t, _ in live()} == {"a", "b", "c"}
+    t = repo.tasks["a"]
+    t.done = True
+    repo.touch(t)
+    repo.remove("b")
+    assert {t for _, t, _ in live()} == {"c"}
+    repo.move_to_overdue(repo.tasks["c"])
+    assert live() == []
+
+def test_deadline_change_reschedules_and_rearms_warnings(now):
+    repo = repo_for({}, CHAT)
+    repo.save(task("a", now + timedelta(hours=10)))
+    t = repo.tasks["a"]
+    t.alerted = 1  # раннее уже ушло
+    repo.mark_dirty(t)
+    t.deadline_at = now + timedelta(hours=50)
+    repo.touch(t)
+    assert t.alerted == 0
+    assert [(when - now, kind) for when, _, kind in live()] == [
+        (timedelta(hours=26), EV_EARLY), (timedelta(hours=46), EV_URGENT), (timedelta(hours=50), EV_OVERDUE)]
+
+class Bot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        self.sent.append((chat_id, text))
+
+def test_fire_sends_highest_warning_and_sweeps(monkeypatch, now):
+    monkeypatch.setattr(main, "OUTBOX", Outbox())
+    chat_data = {}
+    repo = repo_for(chat_data, CHAT)
+    a = task("a", now + timedelta(hours=3))
+    repo.save(a)
+    # a пролежала, пока бот был выключен: и 24ч, и 4ч уже наступили
+    main.DEADLINES.forget(CHAT, "a")
+    main.DEADLINES.watch(CHAT, a, now=a.deadline_at - timedelta(hours=30))
+    repo.save(task("b", now - timedelta(minutes=1)))
+    repo.save(task("c", now + timedelta(hours=10)))
+    repo.save(task("d", now + timedelta(hours=30)))
+    main.DEADLINES.attach(SimpleNamespace(chat_data={CHAT: chat_data}, job_queue=None,
+                                          mark_data_for_update_persistence=lambda chat_ids: None))
+    bot = Bot()
+
+    async def go():
+        await main.DEADLINES._fire(SimpleNamespace(bot=bot))
+        await main.OUTBOX.drain()
+    asyncio.run(go())
+
+    (chat_id, text), = bot.sent
+    lines = text.split("\n")
+    assert chat_id == CHAT and len(lines) == 3
+    assert lines[0] == "СРОЧНО: дедлайн «a» менее чем через 4 часа!"
+    assert lines[1] == "Дедлайн «c» приближается! Нужно ускориться."
+    assert lines[2].startswith("Дедлайн «b» прошел")
+    assert (a.alerted, repo.tasks["c"].alerted, repo.tasks["d"].alerted) == (2, 1, 0)
+    assert set(repo.overdue) == {"b"}
+    assert [(t, kind) for _, t, kind in live()] == [
+        ("a", EV_OVERDUE), ("c", EV_URGENT), ("d", EV_EARLY), ("c", EV_OVERDUE), ("d", EV_URGENT), ("d", EV_OVERDUE)]
@@ -0,0 +1,73 @@
+# tests/test_digest.py — утренний план: корзины DigestScheduler и рассылка digest_tick.
+
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import main
+
+def subscribed_bot_data(chat_ids) -> dict:
+    return {"digest_chats": set(chat_ids), "digest_at": {}}
+
+def test_unsubscribe_during_wave_is_not_undone(monkeypatch):
+    bot_data = subscribed_bot_data([1, 2, 3])
+    start = datetime.now() - timedelta(days=2)  # корзины всех трёх чатов уже наступили
+    main.DIGESTS.schedule_all(bot_data, bot_data["digest_chats"], start)
+    sent = []
+
+    async def fake_digest(context, chat_ids):
+        sent.extend(chat_ids)
+        await asyncio.sleep(0)
+        # пока шла рассылка, чат 2 выключил план в настройках, чат 3 — вышел из подписки иначе
+        bot_data["digest_chats"].discard(2)
+        bot_data.setdefault("digest_off", set()).add(2)
+        main.DIGESTS.cancel(2)
+        bot_data["digest_chats"].discard(3)
+    monkeypatch.setattr(main, "morning_digest", fake_digest)
+
+    asyncio.run(main.digest_tick(SimpleNamespace(bot_data=bot_data)))
+
+    assert sorted(sent) == [1, 2, 3]
+    assert set(main.DIGESTS._next) == {1}
+    # и в следующие дни корзины отписавшихся пусты
+    later = datetime.now() + timedelta(days=2)
+    assert [c for chats in main.DIGESTS.due(later).values() for c in chats] == [1]
+
+def test_schedule_refuses_unsubscribed_chat():
+    bot_data = subscribed_bot_data([1])
+    bot_data["digest_off"] = {2}
+    assert main.DIGESTS.schedule(bot_data, 2) is None
+    assert main.DIGESTS.schedule(bot_data, 3) is None
+    assert main.DIGESTS.schedule(bot_data, 1) is not None
+    assert set(main.DIGESTS._next) == {1}
+
+def test_jitter_stays_within_window(monkeypatch):
+    for width in (main.DIGEST_JITTER, 0, 5):
+        monkeypatch.setattr(main, "DIGEST_JITTER", width)
+        shifts = [main.digest_jitter(c) for c in (*range(-500, 500), -1001234567890, 9876543210)]
+        assert min(shifts) >= 0 and max(shifts) <= width
+        assert len(set(shifts)) == width + 1  # чаты расходятся по всему окну
+        assert shifts == [main.digest_jitter(c) for c in (*range(-500, 500), -1001234567890, 9876543210)]
+
+def test_bucket_is_digest_time_plus_jitter():
+    day = datetime(2026, 1, 5)
+    chats = range(1, 200)
+    bot_data = {"digest_chats": set(chats), "digest_at": {c: ("", 7 * 60 + 30) for c in chats}}
+    for c in chats:
+        when = main.DIGESTS.next_time(bot_data, c, day)
+        assert when - day == timedelta(minutes=450 + main.digest_jitter(c))
+        start = day.replace(hour=7, minute=30)
+        assert start <= when <= start + timedelta(minutes=main.DIGEST_JITTER)
+    # после времени плана — завтрашняя корзина с тем же сдвигом
+    late = day.replace(hour=9)
+    assert main.DIGESTS.next_time(bot_data, 7, late) == main.DIGESTS.next_time(bot_data, 7, day) + timedelta(days=1)
+
+def test_schedule_all_buckets_match_schedule():
+    day = datetime(2026, 1, 5)
+    chats = range(1, 200)
+    bot_data = {"digest_chats": set(chats), "digest_at": {c: ("", 450) for c in chats}}
+    main.DIGESTS.schedule_all(bot_data, chats, day)
+    buckets = main.DIGESTS.due(day + timedelta(hours=12))
+    assert sorted(c for cs in buckets.values() for c in cs) == list(chats)
+    assert all(main.DIGESTS.next_time(bot_data, c, day) == when for when, cs in buckets.items() for c in cs)
+    assert len(buckets) <= main.DIGEST_JITTER + 1
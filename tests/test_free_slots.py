@@ -0,0 +1,111 @@
+# tests/test_free_slots.py — FreeSlots: вырезание занятых блоков, кэш самой длинной дыры, take/take_best.
+
+import random
+from datetime import datetime, timedelta
+
+from main import FreeSlots
+
+DAY = datetime(2026, 1, 5)
+
+def at(h: int, m: int = 0) -> datetime:
+    return DAY.replace(hour=h, minute=m)
+
+def gaps(free: FreeSlots) -> list:
+    return [(s.strftime("%H:%M"), e.strftime("%H:%M")) for s, e in free]
+
+def test_empty_window():
+    assert not FreeSlots(at(18), at(9))
+    assert not FreeSlots(at(9), at(9))
+    assert FreeSlots(at(9), at(9)).take(1) is None
+
+def test_carve():
+    free = FreeSlots(at(9), at(18))
+    free.carve(at(10), at(11))
+    assert gaps(free) == [("09:00", "10:00"), ("11:00", "18:00")]
+    free.carve(at(12), at(13))
+    assert gaps(free) == [("09:00", "10:00"), ("11:00", "12:00"), ("13:00", "18:00")]
+    # блок через несколько дыр срезает края и съедает середину
+    free.carve(at(9, 30), at(11, 30))
+    assert gaps(free) == [("09:00", "09:30"), ("11:30", "12:00"), ("13:00", "18:00")]
+    # уже занятое и лежащее вне окна ничего не меняет, в том числе касание границ
+    free.carve(at(12), at(13))
+    free.carve(at(7), at(9))
+    free.carve(at(18), at(20))
+    assert gaps(free) == [("09:00", "09:30"), ("11:30", "12:00"), ("13:00", "18:00")]
+    assert free.max_gap() == timedelta(hours=5)
+    free.carve(at(8), at(19))
+    assert not free and free.max_gap() == timedelta(0)
+
+def test_take_is_first_fit():
+    free = FreeSlots(at(9), at(18))
+    free.carve(at(9, 30), at(11, 30))
+    free.carve(at(12), at(13))
+    assert free.take(30) == (at(9), at(9, 30))  # дыра занята целиком и исчезает
+    assert gaps(free) == [("11:30", "12:00"), ("13:00", "18:00")]
+    assert free.take(60) == (at(13), at(14))
+    assert gaps(free) == [("11:30", "12:00"), ("14:00", "18:00")]
+    assert free.take(241) is None
+    assert free.take(20) == (at(11, 30), at(11, 50))
+
+def test_take_best_picks_shortest_fitting_gap():
+    free = FreeSlots(at(9), at(18))
+    free.carve(at(10), at(11))
+    free.carve(at(11, 45), at(13))
+    assert gaps(free) == [("09:00", "10:00"), ("11:00", "11:45"), ("13:00", "18:00")]
+    assert free.take_best(40) == (at(11), at(11, 40))
+    assert free.take_best(60) == (at(9), at(10))
+    assert free.take_best(5) == (at(11, 40), at(11, 45))
+    assert gaps(free) == [("13:00", "18:00")]
+
+def test_max_gap_cache_follows_takes():
+    free = FreeSlots(at(9), at(18))
+    free.carve(at(12), at(13))
+    assert free.max_gap() == timedelta(hours=5)
+    assert free.take_best(300) == (at(13), at(18))  # длиннейшая дыра ушла — кэш сброшен
+    assert free.max_gap() == timedelta(hours=3)
+    assert free.take(240) is None
+    assert free.take(180) == (at(9), at(12))
+    assert not free and free.take(1) is None
+
+def test_matches_minute_model():
+    """Случайные carve/take против множества свободных минут; выданные отрезки не пересекаются."""
+    rnd = random.Random(7)
+    minute = timedelta(minutes=1)
+    for _ in range(200):
+        lo, hi = rnd.randint(0, 300), rnd.randint(300, 1440)
+        free = FreeSlots(DAY + lo * minute, DAY + hi * minute)
+        model = set(range(lo, hi))
+        taken = []
+        for _ in range(30):
+            a = rnd.randint(-30, 1470)
+            b = a + rnd.randint(1, 180)
+            if rnd.random() < 0.5:
+                free.carve(DAY + a * minute, DAY + b * minute)
+                model -= set(range(a, b))
+            else:
+                need = b - a
+                best = rnd.random() < 0.5
+                slot = (free.take_best if best else free.take)(need)
+                fits = [(e - s, s) for s, e in model_runs(model) if e - s >= need]
+                if slot is None:
+                    assert not fits
+                    continue
+                s, e = (slot[0] - DAY) // minute, (slot[1] - DAY) // minute
+                assert e - s == need and set(range(s, e)) <= model
+                assert s == (min(fits)[1] if best else fits[0][1])
+                model -= set(range(s, e))
+                taken.append((s, e))
+            runs = model_runs(model)
+            assert [((s - DAY) // minute, (e - DAY) // minute) for s, e in free] == runs
+            assert free.max_gap() == max((e - s for s, e in runs), default=0) * minute
+        taken.sort()
+        assert all(e <= s for (_, e), (s, _) in zip(taken, taken[1:]))
+
+def model_runs(model: set) -> list:
+    runs = []
+    for m in sorted(model):
+        if runs and runs[-1][1] == m:
+            runs[-1][1] = m + 1
+        else:
+            runs.append([m, m + 1])
+    return [tuple(r) for r in runs]
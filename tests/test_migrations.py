@@ -0,0 +1,126 @@
+# tests/test_migrations.py — цепочка миграций store: v0 (вложенный, ISO-словари) и v1 (плоский) -> v2.
+
+import asyncio
+import copy
+import pickle
+from datetime import datetime, timedelta
+
+import pytest
+
+from main import (RepoPicklePersistence, SQLitePersistence, STORE_VERSION, chat_store,
+                  deser_done, migrate_store, repo_for, ser_task)
+
+CHAT = 42
+
+@pytest.fixture
+def now():
+    return datetime.now().replace(second=0, microsecond=0)
+
+def legacy_task(tid: str, now: datetime, **kw) -> dict:
+    """Задача в формате до кортежей: словарь с ISO-строками."""
+    d = {"id": tid, "title": f"task {tid}", "duration_min": 45, "deadline_at": (now + timedelta(days=2)).isoformat(),
+         "effort": "heavy", "fixed_start": None, "fixed_end": None, "splittable": True, "done": False,
+         "auto": True, "constant": False, "dow": [], "constant_start_hm": None, "constant_end_hm": None,
+         "planned_for": now.date().isoformat(), "overdue": False, "alerted": 1}
+    d.update(kw)
+    return d
+
+def legacy_done(tid: str, at: datetime) -> dict:
+    return {"task": {"id": tid, "title": f"task {tid}"}, "completed_at": at.isoformat()}
+
+def v1_store(now: datetime) -> dict:
+    return {"tasks": {"a": legacy_task("a", now),
+                      "c": legacy_task("c", now, constant=True, dow=[0, 2], constant_start_hm=[9, 0],
+                                       constant_end_hm=[10, 30])},
+            "overdue": {"o": legacy_task("o", now, overdue=True)},
+            "history": [legacy_done("d", now - timedelta(days=1))],
+            "tz": "Europe/Moscow"}
+
+def v0_chat_data(now: datetime) -> dict:
+    return {CHAT: v1_store(now), "bot_messages": [1, 2]}
+
+def v1_chat_data(now: datetime) -> dict:
+    return {**v1_store(now), "v": 1}
+
+def check_v2(data: dict, now: datetime) -> None:
+    assert data["v"] == STORE_VERSION
+    assert CHAT not in data
+    assert all(isinstance(d, tuple) for d in (*data["tasks"].values(), *data["overdue"].values(), *data["history"]))
+    repo = repo_for(data, CHAT)
+    a = repo.tasks["a"]
+    assert (a.title, a.duration_min, a.deadline_at, a.effort) == ("task a", 45, now + timedelta(days=2), "heavy")
+    assert a.splittable and a.auto and not a.done and a.alerted == 1
+    assert a.planned_for == now.date().isoformat()
+    c = repo.tasks["c"]
+    assert c.constant and c.dow == [0, 2] and c.constant_start_hm == (9, 0) and c.constant_end_hm == (10, 30)
+    assert repo.overdue["o"].overdue
+    done = deser_done(data["history"][0])
+    assert (done.task_id, done.completed_at) == ("d", now - timedelta(days=1))
+    assert data["tz"] == "Europe/Moscow"
+
+def test_v0_nested_store_is_flattened_and_packed(now):
+    data = v0_chat_data(now)
+    assert migrate_store(data, CHAT)
+    assert data["bot_messages"] == [1, 2]
+    check_v2(data, now)
+
+def test_v1_flat_store_is_packed(now):
+    data = v1_chat_data(now)
+    assert migrate_store(data, CHAT)
+    check_v2(data, now)
+
+def test_current_store_is_left_alone(now):
+    data = v0_chat_data(now)
+    migrate_store(data, CHAT)
+    before = copy.deepcopy(data)
+    assert not migrate_store(data, CHAT)
+    assert data == before
+
+def test_chat_store_migrates_on_first_access(now):
+    data = v0_chat_data(now)
+    store = chat_store(data, CHAT)
+    assert store is data
+    check_v2(data, now)
+
+def test_migration_round_trips_through_ser_task(now):
+    data = v1_chat_data(now)
+    migrate_store(data, CHAT)
+    repo = repo_for(data, CHAT)
+    assert {tid: ser_task(t) for tid, t in repo.tasks.items()} == data["tasks"]
+
+def state_pickle(path, chat_data: dict) -> None:
+    with open(path, "wb") as f:
+        pickle.dump({"chat_data": {CHAT: chat_data}, "user_data": {}, "bot_data": {}, "conversations": {},
+                     "callback_data": None}, f)
+
+@pytest.mark.parametrize("make", [v0_chat_data, v1_chat_data], ids=["v0", "v1"])
+def test_pickle_backend_migrates_on_load(tmp_path, now, make):
+    path = tmp_path / "state.pkl"
+    state_pickle(path, make(now))
+    data = asyncio.run(RepoPicklePersistence(filepath=path).get_chat_data())[CHAT]
+    check_v2(data, now)
+
+@pytest.mark.parametrize("make", [v0_chat_data, v1_chat_data], ids=["v0", "v1"])
+def test_sqlite_import_migrates_pickle(tmp_path, now, make):
+    path = tmp_path / "state.pkl"
+    state_pickle(path, make(now))
+    p = SQLitePersistence(tmp_path / "state.db")
+    assert p.import_pickle(path) == 1
+    (blob,) = p.db.execute("SELECT data FROM chat_data WHERE chat_id = ?", (CHAT,)).fetchone()
+    p.db.close()
+    check_v2(pickle.loads(blob), now)
+
+def test_sqlite_row_in_old_format_migrates_on_unpack(tmp_path, now):
+    p = SQLitePersistence(tmp_path / "state.db")
+    p.db.execute("INSERT INTO chat_data (chat_id, data) VALUES (?, ?)", (CHAT, pickle.dumps(v0_chat_data(now))))
+    p.db.close()
+    p = SQLitePersistence(tmp_path / "state.db")
+    chats = {}
+
+    async def load():
+        chats.update(await p.get_chat_data())
+    asyncio.run(load())
+    data = chats[CHAT]
+    chat_store(data, CHAT)
+    check_v2(data, now)
+    p.db.close()
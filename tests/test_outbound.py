@@ -0,0 +1,167 @@
+# tests/test_outbound.py — исходящие сообщения: TokenBucket, ChatRateLimiter и очередь Outbox.
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from telegram.error import RetryAfter
+
+import main
+from main import ChatRateLimiter, Outbox, Task, TokenBucket, repo_for
+
+class Clock:
+    """Подменяет monotonic и asyncio.sleep в main: ожидание лимитера только двигает часы."""
+
+    def __init__(self, monkeypatch):
+        self.t = 1000.0
+        self.sleeps = []
+        monkeypatch.setattr(main, "monotonic", lambda: self.t)
+        monkeypatch.setattr(main.asyncio, "sleep", self.sleep)
+
+    async def sleep(self, seconds):
+        self.sleeps.append(round(seconds, 6))
+        self.t += seconds
+
+class Bot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        self.sent.append((chat_id, text))
+
+def test_bucket_burst_then_rate(monkeypatch):
+    clock = Clock(monkeypatch)
+    b = TokenBucket(rate=2, burst=3)
+    assert [b.reserve() for _ in range(3)] == [0, 0, 0]
+    # дальше — в долг: каждый следующий маркер на 1/rate секунды позже
+    assert [b.reserve() for _ in range(3)] == [0.5, 1.0, 1.5]
+    assert not b.is_full()
+    clock.t += 1.5 + 0.5  # долг погашен, и один маркер накопился
+    assert b.reserve() == 0
+    assert b.reserve() == 0.5
+
+def test_bucket_refill_is_capped_by_burst(monkeypatch):
+    clock = Clock(monkeypatch)
+    b = TokenBucket(rate=10, burst=2)
+    b.reserve()
+    clock.t += 3600
+    assert b.is_full() and b.tokens == 2
+    assert [b.reserve() for _ in range(3)] == [0, 0, 0.1]
+
+def send(limiter: ChatRateLimiter, chat_id, endpoint: str = "sendMessage", callback=None):
+    async def ok():
+        return True
+    return asyncio.run(limiter.process_request(callback or ok, (), {}, endpoint, {"chat_id": chat_id}, None))
+
+def test_limiter_paces_each_chat_separately(monkeypatch):
+    clock = Clock(monkeypatch)
+    limiter = ChatRateLimiter(overall=1000, per_chat=1, chat_burst=3)
+    for _ in range(3):
+        send(limiter, 1)
+        send(limiter, 2)
+    assert clock.sleeps == []  # всплеск каждого чата уходит сразу
+    send(limiter, 1)
+    assert clock.sleeps == [1.0]
+    send(limiter, 2)  # у чата 2 своё ведро: секунда уже прошла, маркер накопился
+    assert clock.sleeps == [1.0]
+    assert set(limiter.buckets) == {1, 2}
+
+def test_limiter_groups_are_slower(monkeypatch):
+    clock = Clock(monkeypatch)
+    limiter = ChatRateLimiter(overall=1000, per_chat=1, chat_burst=1, per_group=20 / 60)
+    send(limiter, "-100")
+    send(limiter, "-100")
+    assert clock.sleeps == [3.0]
+
+def test_limiter_overall_bucket_spans_chats(monkeypatch):
+    clock = Clock(monkeypatch)
+    limiter = ChatRateLimiter(overall=2, per_chat=1, chat_burst=5)
+    for chat_id in (1, 2, 3):
+        send(limiter, chat_id)
+    assert clock.sleeps == [0.5]
+
+def test_limiter_skips_unlimited_endpoints(monkeypatch):
+    clock = Clock(monkeypatch)
+    limiter = ChatRateLimiter(overall=1, per_chat=1, chat_burst=1)
+    for _ in range(3):
+        send(limiter, 1, "getMe")
+    assert clock.sleeps == [] and not limiter.buckets and limiter.calls == 3
+
+def test_limiter_waits_out_retry_after(monkeypatch):
+    clock = Clock(monkeypatch)
+    limiter = ChatRateLimiter(overall=1000, chat_burst=10, max_retries=2)
+    calls = []
+
+    async def flaky():
+        calls.append(clock.t)
+        if len(calls) == 1:
+            raise RetryAfter(2)
+        return "ok"
+    assert send(limiter, 1, callback=flaky) == "ok"
+    assert clock.sleeps == [2.1] and limiter.retries == 1
+
+    async def flood():
+        raise RetryAfter(1)
+    with pytest.raises(RetryAfter):
+        send(limiter, 1, callback=flood)
+    assert limiter.retries == 3
+
+def test_outbox_coalesces_chat_notifications():
+    bot = Bot()
+    outbox = Outbox(delay=0.01)
+
+    async def go():
+        outbox.notify(bot, 1, "a")
+        outbox.notify(bot, 2, "x")
+        outbox.notify(bot, 1, "b")
+        await asyncio.sleep(0.05)
+    asyncio.run(go())
+    assert sorted(bot.sent) == [(1, "a\nb"), (2, "x")]
+    assert not outbox.pending and not outbox._timers
+
+def test_outbox_splits_at_message_limit(monkeypatch):
+    monkeypatch.setattr(Outbox, "MAX_LEN", 10)
+    bot = Bot()
+    outbox = Outbox()
+
+    async def go():
+        for line in ("aaaa", "bbbb", "cccc"):
+            outbox.notify(bot, 1, line)
+        await outbox.drain()
+    asyncio.run(go())
+    assert bot.sent == [(1, "aaaa\nbbbb"), (1, "cccc")]
+
+def test_outbox_replaces_superseded_notification():
+    bot = Bot()
+    outbox = Outbox()
+
+    async def go():
+        outbox.notify(bot, 1, "early t1", key=("deadline", "t1"))
+        outbox.notify(bot, 1, "other")
+        outbox.notify(bot, 1, "early t2", key=("deadline", "t2"))
+        outbox.notify(bot, 1, "urgent t1", key=("deadline", "t1"))
+        outbox.retract(1, [("deadline", "t2"), ("deadline", "t3")])
+        await outbox.drain()
+    asyncio.run(go())
+    # замена встаёт на место заменённого, снятое не уходит вовсе
+    assert bot.sent == [(1, "urgent t1\nother")]
+
+def test_sweep_drops_pending_warning_of_moved_task(monkeypatch):
+    bot = Bot()
+    monkeypatch.setattr(main, "OUTBOX", Outbox())
+    now = datetime.now().replace(second=0, microsecond=0)
+    chat_data = {}
+    repo = repo_for(chat_data, 1)
+    repo.save(Task(id="t1", title="отчёт", duration_min=30, deadline_at=now - timedelta(minutes=1)))
+    repo.save(Task(id="t2", title="план", duration_min=30, deadline_at=now + timedelta(hours=3)))
+
+    async def go():
+        main.OUTBOX.notify(bot, 1, "СРОЧНО: отчёт", key=("deadline", "t1"))
+        main.OUTBOX.notify(bot, 1, "СРОЧНО: план", key=("deadline", "t2"))
+        await main.sweep_repo(bot, repo, now)
+        await main.OUTBOX.drain()
+    asyncio.run(go())
+    assert len(bot.sent) == 1
+    lines = bot.sent[0][1].split("\n")
+    assert lines[0] == "СРОЧНО: план"
+    assert lines[1].startswith("Дедлайн «отчёт» прошел") and len(lines) == 2
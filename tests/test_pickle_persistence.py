@@ -0,0 +1,59 @@
+# tests/test_pickle_persistence.py — RepoPicklePersistence: запись и чтение state.pkl.
+
+import asyncio
+import copy
+from datetime import datetime, timedelta
+
+import main
+from main import RepoPicklePersistence, Task, repo_for
+
+CHAT = 42
+
+def make_task(tid: str, now: datetime) -> Task:
+    return Task(id=tid, title=f"task {tid}", duration_min=30, deadline_at=now + timedelta(days=1))
+
+def reload(path):
+    """Прочитать state.pkl свежим экземпляром, как при перезапуске бота."""
+    main._REPOS.clear()
+    return asyncio.run(RepoPicklePersistence(filepath=path).get_chat_data())
+
+def test_update_chat_data_saves_changes_made_before_ptb_copy(tmp_path):
+    path = tmp_path / "state.pkl"
+    now = datetime.now().replace(second=0, microsecond=0)
+    chat_data = {}
+    repo = repo_for(chat_data, CHAT)
+    repo.save(make_task("a", now))
+    # Application снимает копию до update_chat_data — то есть до сброса задач из TaskRepo
+    stale = copy.deepcopy(chat_data)
+    assert "a" not in stale["tasks"]
+
+    async def write():
+        p = RepoPicklePersistence(filepath=path, update_interval=3600)
+        await p.get_chat_data()
+        await p.update_chat_data(CHAT, stale)
+        assert p.chat_data[CHAT] is stale  # изменения донесены в копию Application, второй копии нет
+        await p.flush()
+    asyncio.run(write())
+
+    loaded = reload(path)
+    assert set(loaded[CHAT]["tasks"]) == {"a"}
+    assert repo_for(loaded[CHAT], CHAT).tasks["a"].title == "task a"
+
+def test_flush_saves_changes_without_update_chat_data(tmp_path):
+    path = tmp_path / "state.pkl"
+    now = datetime.now().replace(second=0, microsecond=0)
+    chat_data = {}
+    repo = repo_for(chat_data, CHAT)
+    repo.save(make_task("a", now))
+
+    async def write():
+        p = RepoPicklePersistence(filepath=path, update_interval=3600)
+        await p.get_chat_data()
+        await p.update_chat_data(CHAT, copy.deepcopy(chat_data))
+        # последняя правка до остановки: Application её ещё не отдавал
+        repo.save(make_task("b", now))
+        repo.remove("a")
+        await p.flush()
+    asyncio.run(write())
+
+    assert set(reload(path)[CHAT]["tasks"]) == {"b"}
@@ -0,0 +1,42 @@
+# tests/test_plan_cache.py — PlanCache: план годен только для того репозитория и той версии, что его считали.
+
+from datetime import datetime, timedelta
+
+from main import PLAN_CACHE, Task, plan_today_for, repo_for
+
+CHAT = 42
+
+def flex(tid: str, now: datetime, minutes: int) -> Task:
+    return Task(id=tid, title=tid, duration_min=minutes, deadline_at=now + timedelta(days=2), auto=True)
+
+def test_new_repo_for_same_chat_does_not_hit_old_plan():
+    now = datetime.now().replace(hour=9, minute=0, second=0, microsecond=0)
+    PLAN_CACHE.entries.clear()
+    first = {}
+    repo_for(first, CHAT).save(flex("a", now, 30))
+    old = repo_for(first, CHAT)
+    plan_a = plan_today_for(old, now)
+
+    # store чата сменился (перезагрузка, миграция) — новый репозиторий догоняет ту же version
+    second = {}
+    repo = repo_for(second, CHAT)
+    assert repo is not old
+    t = flex("b", now, 60)
+    repo.save(t)
+    while repo.version < old.version:
+        repo.touch(t)
+    assert repo.version == old.version
+    plan_b = plan_today_for(repo, now)
+    assert {i.task_id for i in plan_a if i.task_id} == {"a"}
+    assert {i.task_id for i in plan_b if i.task_id} == {"b"}
+
+def test_same_repo_and_version_hits():
+    now = datetime.now().replace(hour=9, minute=0, second=0, microsecond=0)
+    repo = repo_for({}, CHAT)
+    repo.save(flex("a", now, 30))
+    plan = plan_today_for(repo, now)
+    hits = PLAN_CACHE.hits
+    assert plan_today_for(repo, now) is plan
+    assert PLAN_CACHE.hits == hits + 1
+    repo.save(flex("b", now, 30))
+    assert plan_today_for(repo, now) is not plan
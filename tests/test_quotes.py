@@ -0,0 +1,65 @@
+# tests/test_quotes.py — QuoteBook: круг без повторов на чат, позиция в chat_data, mmap-корпус.
+
+import json
+import pickle
+
+import pytest
+
+import main
+from main import QUOTE_FALLBACK, QuoteBook
+
+def write_quotes(path, n: int) -> None:
+    items = [{"q": f"цитата {i}", "a": "Сенека"} for i in range(n)]
+    if path.suffix == ".jsonl":
+        path.write_text("".join(json.dumps(it, ensure_ascii=False) + "\n" for it in items), encoding="utf-8")
+    else:
+        path.write_text(json.dumps(items, ensure_ascii=False), encoding="utf-8")
+
+@pytest.mark.parametrize("n", [1, 2, 7, 12, 97, 5000])
+def test_no_repeat_within_cycle(tmp_path, n):
+    path = tmp_path / "quotes.json"
+    write_quotes(path, n)
+    book = QuoteBook(path)
+    chats = [{}, {}, {}]
+    for chat_data in chats:
+        for _ in range(2):  # и второй круг — снова все цитаты по разу
+            assert len({book.pick(chat_data) for _ in range(n)}) == n
+    assert all(set(chat_data) == {"quote"} for chat_data in chats)
+
+def test_position_survives_restart(tmp_path):
+    path = tmp_path / "quotes.json"
+    write_quotes(path, 30)
+    chat_data = {}
+    seen = [QuoteBook(path).pick(chat_data) for _ in range(11)]
+    chat_data = pickle.loads(pickle.dumps(chat_data))  # перезапуск: состояние только в chat_data
+    book = QuoteBook(path)
+    seen += [book.pick(chat_data) for _ in range(19)]
+    assert len(set(seen)) == 30
+
+def test_resized_corpus_starts_new_cycle(tmp_path):
+    path = tmp_path / "quotes.json"
+    write_quotes(path, 10)
+    book = QuoteBook(path)
+    chat_data = {}
+    for _ in range(4):
+        book.pick(chat_data)
+    write_quotes(path, 6)
+    book.load()
+    assert len({book.pick(chat_data) for _ in range(6)}) == 6
+    assert chat_data["quote"][0] == 6
+
+def test_mmap_corpus_rotates_without_repeats(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "QUOTES_MMAP_MIN", 0)
+    path = tmp_path / "quotes.jsonl"
+    write_quotes(path, 50)
+    book = QuoteBook(path)
+    chat_data = {}
+    assert len({book.pick(chat_data) for _ in range(50)}) == 50
+    assert book._offsets is not None
+
+def test_missing_file_falls_back(tmp_path):
+    book = QuoteBook(tmp_path / "nope.json")
+    chat_data = {}
+    assert book.pick(chat_data) == QUOTE_FALLBACK
+    assert book.pick() == QUOTE_FALLBACK
+    assert chat_data == {}
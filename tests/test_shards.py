@@ -0,0 +1,105 @@
+# tests/test_shards.py — split_state: раскладка state.db по шардам и перекладка при смене их числа.
+
+import asyncio
+import json
+import pickle
+import sqlite3
+
+import pytest
+
+import main
+from main import SQLitePersistence, shard_db_path, shard_of, split_state
+
+CHATS = range(1, 41)
+GROUP = -100500  # групповой чат: диалог [GROUP, user] живёт в шарде группы
+
+@pytest.fixture
+def state(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "STATE_DB_PATH", tmp_path / "state.db")
+    monkeypatch.setattr(main, "STATE_PICKLE_PATH", tmp_path / "state.pkl")
+    p = SQLitePersistence(main.STATE_DB_PATH)
+    with p.db:
+        p.db.execute("BEGIN")
+        p.db.executemany("INSERT INTO chat_data (chat_id, data) VALUES (?, ?)",
+                         ((c, pickle.dumps({"v": main.STORE_VERSION, "n": c})) for c in [*CHATS, GROUP]))
+        p.db.executemany("INSERT INTO user_data VALUES (?, ?)", ((c, pickle.dumps({"u": c})) for c in CHATS))
+        p.db.executemany("INSERT INTO conversations VALUES ('add', ?, ?)",
+                         ((json.dumps([c, c]), pickle.dumps(1)) for c in CHATS))
+        p.db.execute("INSERT INTO conversations VALUES ('add', ?, ?)", (json.dumps([GROUP, 4]), pickle.dumps(2)))
+        p.db.execute("INSERT INTO kv VALUES ('bot_data', ?)", (pickle.dumps({
+            "digest_chats": set(CHATS), "digest_off": {GROUP}, "digest_at": {c: ("", 450) for c in CHATS}}),))
+    p.db.close()
+    return tmp_path
+
+def rows(i: int, sql: str) -> list:
+    db = sqlite3.connect(shard_db_path(i))
+    try:
+        return db.execute(sql).fetchall()
+    finally:
+        db.close()
+
+def check_layout(shards: int) -> None:
+    assert main.shard_layout() == {i: shards for i in range(shards)}
+    seen_chats, seen_users = [], set()
+    for i in range(shards):
+        chats = [c for (c,) in rows(i, "SELECT chat_id FROM chat_data")]
+        assert all(shard_of(c, shards) == i for c in chats)
+        seen_chats += chats
+        convs = [tuple(json.loads(k)) for (k,) in rows(i, "SELECT key FROM conversations")]
+        assert all(shard_of(c, shards) == i for c, _ in convs)
+        users = {u for (u,) in rows(i, "SELECT user_id FROM user_data")}
+        # пользователь есть везде, где есть его диалог, — ключ раскладки у них один
+        assert {u for _, u in convs if u in CHATS} <= users
+        seen_users |= users
+        bot_data = pickle.loads(rows(i, "SELECT data FROM kv WHERE key = 'bot_data'")[0][0])
+        assert bot_data["digest_chats"] == {c for c in CHATS if shard_of(c, shards) == i}
+        assert bot_data["digest_off"] == ({GROUP} if shard_of(GROUP, shards) == i else set())
+        assert set(bot_data["digest_at"]) == bot_data["digest_chats"]
+    assert sorted(seen_chats) == sorted([*CHATS, GROUP])
+    assert seen_users == set(CHATS)
+
+def test_split_then_reshard(state):
+    split_state(2)
+    check_layout(2)
+    # данные, записанные шардом после раскладки, переживают перекладку
+    home = shard_of(3, 2)
+    db = sqlite3.connect(shard_db_path(home))
+    db.execute("UPDATE chat_data SET data = ? WHERE chat_id = 3", (pickle.dumps({"v": main.STORE_VERSION, "n": 333}),))
+    db.commit()
+    db.close()
+
+    split_state(2)  # то же число шардов — ничего не меняется
+    check_layout(2)
+
+    split_state(3)
+    check_layout(3)
+    (blob,) = rows(shard_of(3, 3), "SELECT data FROM chat_data WHERE chat_id = 3")[0]
+    assert pickle.loads(blob)["n"] == 333
+    assert not list(state.glob("*.part")) and not (state / "state.reshard.db").exists()
+    assert not shard_db_path(3).exists()
+
+    split_state(1)
+    check_layout(1)
+    assert not shard_db_path(1).exists() and not shard_db_path(2).exists()
+
+def test_interrupted_reshard_resumes_from_merged_file(state):
+    split_state(2)
+    main.merge_shards(2, state / "state.reshard.db")
+    shard_db_path(0).unlink()  # упали, успев удалить часть старых шардов
+    split_state(3)
+    check_layout(3)
+    assert not (state / "state.reshard.db").exists()
+
+def test_inconsistent_layout_refuses_to_start(state):
+    split_state(2)
+    shard_db_path(1).unlink()
+    with pytest.raises(SystemExit):
+        split_state(2)
+
+def test_shard_persistence_sees_its_chats(state):
+    split_state(2)
+    for i in range(2):
+        p = SQLitePersistence(shard_db_path(i))
+        chats = asyncio.run(p.get_chat_data())
+        assert set(chats) == {c for c in [*CHATS, GROUP] if shard_of(c, 2) == i}
+        p.db.close()
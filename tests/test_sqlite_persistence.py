@@ -0,0 +1,210 @@
+# tests/test_sqlite_persistence.py — SQLitePersistence: строки чатов, журнал task_log и снимки.
+
+import asyncio
+import copy
+import pickle
+import sqlite3
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import pytest
+
+import main
+from main import LazyChatData, SQLitePersistence, Task, repo_for, ser_task
+
+CHAT = 42
+
+@pytest.fixture
+def now():
+    return datetime.now().replace(second=0, microsecond=0)
+
+def make_task(tid: str, now: datetime, **kw) -> Task:
+    kw.setdefault("duration_min", 30)
+    return Task(id=tid, title=f"task {tid}", deadline_at=now + timedelta(days=1), **kw)
+
+def run(coro):
+    return asyncio.run(coro)
+
+def reopen(path) -> tuple:
+    """Новый экземпляр хранилища и его chat_data — как после перезапуска бота."""
+    main._REPOS.clear()
+    p = SQLitePersistence(path)
+    chats = defaultdict(LazyChatData)
+
+    async def load():  # результат asyncio.run попадает в repr задачи и распаковал бы чаты
+        chats.update(await p.get_chat_data())
+    run(load())
+    return p, chats
+
+def write(p: SQLitePersistence, chat_data) -> None:
+    """Запись, как её делает Application: deepcopy, затем update_chat_data."""
+    run(p.update_chat_data(CHAT, copy.deepcopy(chat_data)))
+
+def test_round_trip_restores_tasks_and_other_fields(tmp_path, now):
+    path = tmp_path / "state.db"
+    p, chats = reopen(path)
+    chat_data = chats[CHAT]
+    repo = repo_for(chat_data, CHAT)
+    for i in range(5):
+        repo.save(make_task(f"t{i}", now))
+    repo.move_to_overdue(repo.tasks["t4"])
+    chat_data["tz"] = "Europe/Moscow"
+    write(p, chat_data)
+    p.db.close()
+
+    p, chats = reopen(path)
+    loaded = chats[CHAT]
+    assert isinstance(loaded, LazyChatData) and not loaded.loaded
+    repo2 = repo_for(loaded, CHAT)
+    assert loaded["tz"] == "Europe/Moscow"
+    assert set(repo2.tasks) == {"t0", "t1", "t2", "t3"}
+    assert set(repo2.overdue) == {"t4"}
+    assert {tid: ser_task(t) for tid, t in repo2.tasks.items()} == {tid: ser_task(t) for tid, t in repo.tasks.items()}
+
+def test_deepcopy_does_not_copy_chat_data():
+    data = LazyChatData()
+    data["tasks"] = {"a": (1,)}
+    assert copy.deepcopy(data) is data
+
+def test_untouched_chat_is_not_unpacked_on_write(tmp_path, now):
+    path = tmp_path / "state.db"
+    p, chats = reopen(path)
+    repo_for(chats[CHAT], CHAT).save(make_task("a", now))
+    write(p, chats[CHAT])
+    p.db.close()
+
+    p, chats = reopen(path)
+    write(p, chats[CHAT])
+    assert not chats[CHAT].loaded
+
+def test_task_edit_is_one_log_row(tmp_path, now):
+    path = tmp_path / "state.db"
+    p, chats = reopen(path)
+    repo = repo_for(chats[CHAT], CHAT)
+    for i in range(10):
+        repo.save(make_task(f"t{i}", now))
+    write(p, chats[CHAT])
+    (rest_before,) = p.db.execute("SELECT data FROM chat_data WHERE chat_id = ?", (CHAT,)).fetchone()
+
+    t = repo.tasks["t3"]
+    t.title = "renamed"
+    repo.touch(t)
+    repo.remove("t5")
+    write(p, chats[CHAT])
+
+    log = p.task_log(CHAT, limit=2)
+    assert [(tid, None if task is None else task.title) for _, _, tid, task in log] in (
+        [("t5", None), ("t3", "renamed")], [("t3", "renamed"), ("t5", None)])
+    (rest_after,) = p.db.execute("SELECT data FROM chat_data WHERE chat_id = ?", (CHAT,)).fetchone()
+    assert rest_after == rest_before  # строка чата без задач не переписывалась
+    assert "tasks" not in pickle.loads(rest_after)
+
+def test_replay_applies_log_after_snapshot(tmp_path, now, monkeypatch):
+    monkeypatch.setattr(main, "TASK_LOG_SNAPSHOT", 8)
+    monkeypatch.setattr(main, "TASK_LOG_KEEP", 4)
+    path = tmp_path / "state.db"
+    p, chats = reopen(path)
+    repo = repo_for(chats[CHAT], CHAT)
+    for i in range(30):
+        repo.save(make_task(f"t{i % 6}", now, duration_min=i + 1))
+        if i % 7 == 6:
+            repo.remove(f"t{i % 6}")
+        write(p, chats[CHAT])
+    expected = {tid: ser_task(t) for tid, t in repo.tasks.items()}
+
+    seq, snap = p.db.execute("SELECT log_seq, tasks IS NOT NULL FROM chat_data WHERE chat_id = ?", (CHAT,)).fetchone()
+    head = p.db.execute("SELECT MAX(seq) FROM task_log WHERE chat_id = ?", (CHAT,)).fetchone()[0]
+    (kept,) = p.db.execute("SELECT COUNT(*) FROM task_log WHERE chat_id = ?", (CHAT,)).fetchone()
+    assert snap and 0 < seq < head  # снимок есть, и после него в журнале остались события
+    assert head - seq < main.TASK_LOG_SNAPSHOT
+    assert kept <= main.TASK_LOG_KEEP + main.TASK_LOG_SNAPSHOT
+    p.db.close()
+
+    p, chats = reopen(path)
+    assert {tid: ser_task(t) for tid, t in repo_for(chats[CHAT], CHAT).tasks.items()} == expected
+
+    # после перезапуска журнал продолжается с прежнего seq
+    repo2 = repo_for(chats[CHAT], CHAT)
+    repo2.remove(next(iter(repo2.tasks)))
+    write(p, chats[CHAT])
+    assert p.task_log(CHAT, limit=1)[0][0] == head + 1
+
+def test_legacy_row_keeps_tasks_in_data_until_repo_loads(tmp_path, now):
+    path = tmp_path / "state.db"
+    p = SQLitePersistence(path)
+    data = {"v": main.STORE_VERSION, "tasks": {"a": ser_task(make_task("a", now))}, "history": [], "overdue": {}}
+    p.db.execute("INSERT INTO chat_data (chat_id, data) VALUES (?, ?)", (CHAT, pickle.dumps(data)))
+    p.db.close()
+
+    p, chats = reopen(path)
+    chats[CHAT]["note"] = "x"  # меняется chat_data, задачи не загружаются
+    write(p, chats[CHAT])
+    (snap,) = p.db.execute("SELECT tasks FROM chat_data WHERE chat_id = ?", (CHAT,)).fetchone()
+    assert snap is None
+    p.db.close()
+
+    p, chats = reopen(path)
+    assert chats[CHAT]["note"] == "x"
+    assert set(repo_for(chats[CHAT], CHAT).tasks) == {"a"}
+
+def test_drop_chat_data_removes_log(tmp_path, now):
+    path = tmp_path / "state.db"
+    p, chats = reopen(path)
+    repo_for(chats[CHAT], CHAT).save(make_task("a", now))
+    write(p, chats[CHAT])
+    run(p.drop_chat_data(CHAT))
+    assert p.task_log(CHAT) == []
+    p.db.close()
+    _, chats = reopen(path)
+    assert CHAT not in chats.keys()
+
+class FailingDB:
+    """Соединение, у которого следующая запись падает, как при «database is locked»."""
+
+    def __init__(self, db):
+        self.db = db
+        self.fail = True
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+    def __enter__(self):
+        return self.db.__enter__()
+
+    def __exit__(self, *exc):
+        return self.db.__exit__(*exc)
+
+    def _check(self, sql: str) -> None:
+        if self.fail and sql.lstrip().startswith(("INSERT", "UPDATE")):
+            self.fail = False
+            raise sqlite3.OperationalError("database is locked")
+
+    def execute(self, sql, *args):
+        self._check(sql)
+        return self.db.execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        self._check(sql)
+        return self.db.executemany(sql, *args)
+
+def test_failed_write_is_retried(tmp_path, now):
+    path = tmp_path / "state.db"
+    p, chats = reopen(path)
+    real = p.db
+    p.db = FailingDB(real)
+    with pytest.raises(sqlite3.OperationalError):
+        run(p.update_user_data(7, {"bot_messages": [1]}))
+    run(p.update_user_data(7, {"bot_messages": [1]}))  # тот же blob — но он не записан, пропускать нельзя
+
+    repo = repo_for(chats[CHAT], CHAT)
+    repo.save(make_task("a", now))
+    p.db.fail = True
+    with pytest.raises(sqlite3.OperationalError):
+        write(p, chats[CHAT])
+    write(p, chats[CHAT])
+    real.close()
+
+    p, chats = reopen(path)
+    assert run(p.get_user_data()) == {7: {"bot_messages": [1]}}
+    assert set(repo_for(chats[CHAT], CHAT).tasks) == {"a"}
+    assert [tid for _, _, tid, _ in p.task_log(CHAT)] == ["a"]
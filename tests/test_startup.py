@@ -0,0 +1,24 @@
+# tests/test_startup.py — --profile-startup: чтение состояния через публичные загрузчики хранилища.
+
+import asyncio
+
+import pytest
+from telegram.ext import Application
+
+import main
+
+@pytest.mark.parametrize("backend", ["sqlite", "pickle"])
+def test_profile_startup_uses_public_loaders(tmp_path, monkeypatch, capsys, backend):
+    monkeypatch.setattr(main, "STATE_BACKEND", backend)
+    monkeypatch.setattr(main, "STATE_DB_PATH", tmp_path / "state.db")
+    monkeypatch.setattr(main, "STATE_PICKLE_PATH", tmp_path / "state.pkl")
+
+    async def private(self):
+        raise AssertionError("profile_startup не должен звать Application._initialize_persistence")
+    monkeypatch.setattr(Application, "_initialize_persistence", private)
+
+    asyncio.run(main.profile_startup())
+    out = capsys.readouterr().out
+    for kind in ("user_data", "chat_data", "bot_data", "callback_data"):
+        assert f"загрузка {kind}" in out
+    assert "Чатов: 0" in out
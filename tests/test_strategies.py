@@ -0,0 +1,137 @@
+# tests/test_strategies.py — стратегии размещения: first-fit, gap-fill, best-fit, edf, bnb.
+
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import main
+from main import SCHEDULERS, FreeSlots, Task
+
+DAY = datetime(2026, 1, 5)
+FAR = DAY + timedelta(days=5)
+
+def at(h: int, m: int = 0) -> datetime:
+    return DAY.replace(hour=h, minute=m)
+
+def task(tid: str, minutes: int, deadline: datetime = FAR, **kw) -> Task:
+    return Task(id=tid, title=tid, duration_min=minutes, deadline_at=deadline, auto=True, **kw)
+
+def window(*busy) -> FreeSlots:
+    """Свободное время 09:00–18:00 за вычетом занятых (час, минута, час, минута)."""
+    free = FreeSlots(at(9), at(18))
+    for sh, sm, eh, em in busy:
+        free.carve(at(sh, sm), at(eh, em))
+    return free
+
+def plan(name: str, free: FreeSlots, flex: list):
+    items = []
+    placed = SCHEDULERS[name].plan_day(DAY, DAY, free, items, flex)
+    return [t.id for t in placed], [(i.task_id, i.start.strftime("%H:%M"), i.end.strftime("%H:%M")) for i in items]
+
+def three_gaps() -> FreeSlots:
+    """Дыры 09:00–10:00 (60), 11:00–11:30 (30), 13:00–15:00 (120)."""
+    return window((10, 0, 11, 0), (11, 30, 13, 0), (15, 0, 18, 0))
+
+def short_first() -> list:
+    return [task("c", 30), task("b", 60), task("a", 90)]
+
+@pytest.mark.parametrize("name", ["first-fit", "gap-fill"])
+def test_first_fit_loses_long_task(name):
+    placed, items = plan(name, three_gaps(), short_first())
+    # короткие заняли начало дыр, и 90 минут подряд уже нигде нет
+    assert placed == ["c", "b"]
+    assert items == [("c", "09:00", "09:30"), ("b", "13:00", "14:00")]
+
+def test_best_fit_keeps_long_gap():
+    placed, items = plan("best-fit", three_gaps(), short_first())
+    assert placed == ["c", "b", "a"]
+    assert items == [("c", "11:00", "11:30"), ("b", "09:00", "10:00"), ("a", "13:00", "14:30")]
+
+def test_gap_fill_cuts_by_gaps():
+    free = window((10, 0, 11, 0), (11, 30, 13, 0), (14, 0, 18, 0))  # 60 + 30 + 60
+    s = task("s", 120, splittable=True)
+    # first-fit ставит делимую задачу одним куском и не находит 120 минут
+    assert plan("first-fit", window((10, 0, 11, 0), (11, 30, 13, 0), (14, 0, 18, 0)), [s]) == ([], [])
+    placed, items = plan("gap-fill", free, [s])
+    assert placed == ["s"]
+    assert items == [("s", "09:00", "10:00"), ("s", "13:00", "14:00")]
+    assert list(free) == [(at(11), at(11, 30))]
+
+def test_gap_fill_does_not_cut_what_the_day_cannot_hold():
+    free = window((10, 0, 11, 0), (11, 30, 13, 0), (14, 0, 18, 0))  # всего 150 минут
+    assert plan("gap-fill", free, [task("s", 200, splittable=True)]) == ([], [])
+    assert len(free) == 3  # ничего не занято
+
+def test_gap_fill_caps_extreme_chunks():
+    placed, items = plan("gap-fill", window(), [task("x", 300, effort="extreme", splittable=True)])
+    assert placed == ["x"]
+    assert items == [("x", "09:00", "11:00"), ("x", "11:00", "13:00"), ("x", "13:00", "14:00")]
+
+def test_edf_orders_by_deadline_then_slack():
+    soon = DAY + timedelta(days=1)
+    flex = [task("x", 60), task("y", 60, soon), task("z", 120, soon)]
+    placed, items = plan("edf", window((12, 0, 18, 0)), flex)
+    # у z тот же дедлайн, но запаса меньше: он длиннее
+    assert placed == ["z", "y"]
+    assert items == [("z", "09:00", "11:00"), ("y", "11:00", "12:00")]
+
+def test_bnb_packs_what_best_fit_cannot():
+    flex = [task("a", 50), task("b", 60), task("c", 40)]
+    busy = ((10, 30, 11, 0), (12, 0, 18, 0))  # дыры 90 и 60 — ровно 150 минут
+    assert plan("best-fit", window(*busy), flex)[0] == ["a", "b"]
+    free = window(*busy)
+    placed, items = plan("bnb", free, flex)
+    assert placed == ["a", "b", "c"]
+    assert sorted(items, key=lambda i: i[1]) == [("a", "09:00", "09:50"), ("c", "09:50", "10:30"),
+                                                 ("b", "11:00", "12:00")]
+    assert not free
+
+def test_bnb_prefers_last_chance_tasks():
+    flex = [task("a", 60), task("b", 30, DAY + timedelta(hours=20)), task("c", 30)]
+    placed, items = plan("bnb", window((10, 0, 18, 0)), flex)
+    # b в последний день до дедлайна весит вдесятеро: b + c выгоднее, чем a
+    assert placed == ["b", "c"]
+    assert items == [("b", "09:00", "09:30"), ("c", "09:30", "10:00")]
+
+def test_bnb_falls_back_on_large_days(monkeypatch):
+    monkeypatch.setattr(main, "BNB_MAX_TASKS", 2)
+    flex = [task("a", 50), task("b", 60), task("c", 40)]
+    busy = ((10, 30, 11, 0), (12, 0, 18, 0))
+    assert plan("bnb", window(*busy), flex) == plan("best-fit", window(*busy), flex)
+
+@pytest.mark.parametrize("name", sorted(SCHEDULERS))
+def test_random_days_never_overlap(name):
+    """Размещённое лежит в свободном времени, куски не пересекаются, минуты задач не превышены."""
+    rnd = random.Random(name)
+    minute = timedelta(minutes=1)
+    for _ in range(60):
+        busy = []
+        free = window()
+        for _ in range(rnd.randint(0, 6)):
+            s = at(9) + rnd.randint(0, 520) * minute
+            e = s + rnd.randint(10, 120) * minute
+            busy.append((s, e))
+            free.carve(s, e)
+        before = list(free)
+        flex = [task(f"t{i}", rnd.choice((15, 30, 45, 60, 90, 120, 200, 300)),
+                     DAY + timedelta(hours=rnd.choice((20, 30, 80))),
+                     effort=rnd.choice(main.EFFORTS), splittable=rnd.random() < 0.5)
+                for i in range(rnd.randint(1, 14))]
+        items = []
+        placed = SCHEDULERS[name].plan_day(DAY, DAY, free, items, flex)
+
+        spans = sorted((i.start, i.end) for i in items)
+        assert all(e <= s for (_, e), (s, _) in zip(spans, spans[1:]))
+        assert all(any(fs <= s and e <= fe for fs, fe in before) for s, e in spans)
+        assert all(e <= bs or be <= s for s, e in spans for bs, be in busy)
+        left = [(s, e) for s, e in free]
+        assert all(e <= ls or le <= s for s, e in spans for ls, le in left)
+        by_task = {}
+        for i in items:
+            by_task.setdefault(i.task_id, []).append((i.end - i.start) // minute)
+        assert set(by_task) == {t.id for t in placed}
+        for t in placed:
+            assert sum(by_task[t.id]) <= t.duration_min
+            if not t.splittable:
+                assert by_task[t.id] == [t.duration_min]